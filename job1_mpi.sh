@@ -43,3 +43,9 @@ conda activate parflow_pywr
 mpirun -n $NSLOTS parflow-pywr search optim_seed_$SGE_TASK_ID -h file://optim_results_seed_$SGE_TASK_ID -d \
 optim_$SGE_TASK_ID -w parflow_tmp_$SGE_TASK_ID --mpi -a NSGAIII -ne 140000 -p $NSLOTS -i pywr-1-reservoir-model_profile1.json \
 --seed=${SEED_PARAM[$INDEX]}
+
+# To exchange solutions between the seeds of the job array every 2000
+# evaluations add: -id islands --migration-interval 2000
+# To save checkpoints every 2000 evaluations add: -ci 2000
+# To continue a job stopped at the wall time from its last checkpoint, run the
+# same command with the --resume flag added
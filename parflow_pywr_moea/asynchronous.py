@@ -0,0 +1,449 @@
+""" This module defines an asynchronous steady-state MOEA and the
+    dispatchers used to evaluate its solutions without generational
+    barriers
+
+    Parflow run times vary with the landuse design, so a generational MOEA
+    leaves workers idle while the slowest solution of each generation is
+    evaluated. AsynchronousEpsMOEA instead breeds a new offspring as soon as
+    any evaluation completes (as in the Borg MOEA), so that every worker is
+    kept busy.
+
+    Functions:
+    ---------------------------------
+    run_timed_job(job): runs a Platypus job and records its run time
+
+    Classes:
+    ---------------------------------
+    ProcessDispatcher: dispatches jobs to a concurrent.futures executor
+    MPIDispatcher: dispatches jobs to the workers of a Platypus MPIPool
+    SpeculativeEvaluator(Evaluator): evaluates jobs with a dispatcher and
+        re-executes stragglers on idle workers
+    AsynchronousEpsMOEA(EpsMOEA): steady-state epsilon-MOEA evaluating
+        offspring asynchronously
+"""
+
+import time
+import random
+import logging
+import statistics
+import concurrent.futures
+from platypus.algorithms import EpsMOEA
+from platypus.core import EvaluateSolution
+from platypus.evaluator import Evaluator
+from .evaluators import set_solution_result, mark_failed, is_failed
+from .telemetry import TimedJob
+from .variators import default_variator
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+
+def run_timed_job(job):
+    """ Run a Platypus job and store its run time (in seconds) in the
+        elapsed attribute """
+    start = time.time()
+    job.run()
+    job.elapsed = time.time() - start
+    return job
+
+
+class ProcessDispatcher:
+    """ Dispatches jobs to a concurrent.futures executor (e.g. the executor
+        of platypus.ProcessPoolEvaluator)
+
+        Methods:
+        ---------------------------------
+        close(self): closes the executor / pool
+        idle(self): returns the number of idle workers
+        submit(self, job): starts evaluating job on an idle worker and
+                           returns its tag
+        receive(self, timeout): waits for a job to complete and returns its
+                                tag and the job (or None after timeout)
+        next_completed(self): waits for a job to complete and returns it
+        cancel(self, tag): cancels the job of tag
+    """
+
+    def __init__(self, executor, size):
+        self.executor = executor
+        self.size = size
+        self._futures = {}
+        self._cancelled = set()
+        self._tag = 0
+
+    @property
+    def pending(self):
+        return len(self._futures)
+
+    def idle(self):
+        return self.size - len(self._futures)
+
+    def submit(self, job):
+        tag = self._tag
+        self._futures[self.executor.submit(run_timed_job, job)] = tag
+        self._tag += 1
+        return tag
+
+    def receive(self, timeout=None):
+        end = None if timeout is None else time.time() + timeout
+        while self._futures:
+            done, _ = concurrent.futures.wait(
+                self._futures,
+                timeout=None if end is None else max(end - time.time(), 0),
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                return None
+            future = done.pop()
+            tag = self._futures.pop(future)
+            if tag in self._cancelled:
+                self._cancelled.discard(tag)
+                continue
+            return tag, future.result()
+        return None
+
+    def cancel(self, tag):
+        """ Cancel the job of tag. A job already running can not be
+            interrupted; its result is discarded when it completes. """
+        for future, other in list(self._futures.items()):
+            if other == tag:
+                if future.cancel():
+                    del self._futures[future]
+                else:
+                    self._cancelled.add(tag)
+
+    def next_completed(self):
+        return self.receive()[1]
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class MPIDispatcher:
+    """ Dispatches jobs to the workers of a platypus.mpipool.MPIPool. The
+        workers run the pool's usual event loop (MPIPool.wait); each job is
+        sent to an idle worker and results are received from any worker.
+
+        Job tags grow without bound, while MPI only guarantees message
+        tags up to 32767 (MPI.TAG_UB). The tag of a job is therefore sent in
+        its dispatch_tag attribute and the messages are tagged with the rank
+        of the worker instead.
+
+        Methods:
+        ---------------------------------
+        close(self): closes the executor / pool
+        idle(self): returns the number of idle workers
+        submit(self, job): starts evaluating job on an idle worker and
+                           returns its tag
+        receive(self, timeout): waits for a job to complete and returns its
+                                tag and the job (or None after timeout)
+        next_completed(self): waits for a job to complete and returns it
+        cancel(self, tag): discards the result of the job of tag
+    """
+
+    # Interval (in seconds) at which receive polls for completed jobs
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, pool):
+        from mpi4py import MPI
+        from platypus.mpipool import _function_wrapper
+        self.pool = pool
+        self.comm = pool.comm
+        self.size = pool.size
+        self._status = MPI.Status
+        self._any_source = MPI.ANY_SOURCE
+        self._any_tag = MPI.ANY_TAG
+        self._idle = list(range(1, self.size + 1))
+        self._cancelled = set()
+        self._tag = 0
+        # Tell the workers which function to run
+        if pool.function is not run_timed_job:
+            pool.function = run_timed_job
+            requests = [self.comm.isend(_function_wrapper(run_timed_job),
+                                        dest=worker)
+                        for worker in self._idle]
+            MPI.Request.waitall(requests)
+
+    @property
+    def pending(self):
+        return self.size - len(self._idle)
+
+    def idle(self):
+        return len(self._idle)
+
+    def submit(self, job):
+        tag = self._tag
+        worker = self._idle.pop()
+        job.dispatch_tag = tag
+        self.comm.send(job, dest=worker, tag=worker)
+        self._tag += 1
+        return tag
+
+    def receive(self, timeout=None):
+        from platypus.mpipool import MPIPoolException
+        if timeout is not None:
+            end = time.time() + timeout
+        while self.pending > 0:
+            if timeout is not None:
+                while not self.comm.Iprobe(source=self._any_source,
+                                           tag=self._any_tag):
+                    if time.time() >= end:
+                        return None
+                    time.sleep(self.POLL_INTERVAL)
+            status = self._status()
+            job = self.comm.recv(source=self._any_source, tag=self._any_tag,
+                                 status=status)
+            if isinstance(job, MPIPoolException):
+                logger.error('One of the MPIPool workers failed with the '
+                             'exception:\n{}'.format(job.traceback))
+                raise job
+            self._idle.append(status.source)
+            tag = job.dispatch_tag
+            if tag in self._cancelled:
+                self._cancelled.discard(tag)
+                continue
+            return tag, job
+        return None
+
+    def cancel(self, tag):
+        """ Discard the result of the job of tag when it arrives (a job can
+            not be interrupted on a worker) """
+        self._cancelled.add(tag)
+
+    def next_completed(self):
+        return self.receive()[1]
+
+    def close(self):
+        self.pool.close()
+
+
+class SpeculativeEvaluator(Evaluator):
+    """ Evaluator dispatching jobs to the workers one at a time (instead of
+        mapping a batch over the pool) and re-executing stragglers.
+
+        Once min_completed (fraction) of the jobs have completed, a job that
+        has been running for more than straggler_factor times the median
+        run time of the completed jobs is started again on an idle worker.
+        Evaluations are deterministic, so the first result to arrive is
+        used and the other copy is cancelled through the dispatcher: it is
+        removed if it has not started yet, otherwise its result is
+        discarded when it arrives (a running job can not be interrupted on
+        a worker). Cancelled copies are not counted as completed jobs or in
+        the telemetry.
+
+        Methods:
+        ---------------------------------
+        evaluate_all(self, jobs): evaluates the jobs
+        close(self): waits for copies still running and closes the
+                     dispatcher
+    """
+
+    def __init__(self, dispatcher, straggler_factor=2.0, min_completed=0.5,
+                 poll_interval=1.0):
+        super().__init__()
+        self.dispatcher = dispatcher
+        self.straggler_factor = straggler_factor
+        self.min_completed = min_completed
+        self.poll_interval = poll_interval
+        self.speculative = 0
+        self.speculative_wins = 0
+
+    def evaluate_all(self, jobs, **kwargs):
+        results = [None] * len(jobs)
+        queue = list(range(len(jobs)))
+        running = {}  # tag -> (index of job, start time, speculative)
+        duplicated = set()
+        durations = []
+        remaining = len(jobs)
+        while remaining > 0:
+            while queue and self.dispatcher.idle() > 0:
+                i = queue.pop(0)
+                tag = self.dispatcher.submit(jobs[i])
+                running[tag] = (i, time.time(), False)
+            if not queue and self.dispatcher.idle() > 0:
+                self._speculate(jobs, running, duplicated, durations)
+
+            received = self.dispatcher.receive(timeout=self.poll_interval)
+            if received is None:
+                continue
+            tag, job = received
+            i, _, speculative = running.pop(tag)
+            for other in [other for other, (j, _, _) in running.items()
+                          if j == i]:
+                del running[other]
+                self.dispatcher.cancel(other)
+            results[i] = job
+            durations.append(job.elapsed)
+            remaining -= 1
+            if speculative:
+                self.speculative_wins += 1
+        return results
+
+    def _speculate(self, jobs, running, duplicated, durations):
+        """ Start copies of straggling jobs on idle workers """
+        if len(durations) < self.min_completed * len(jobs):
+            return
+        threshold = self.straggler_factor * statistics.median(durations)
+        now = time.time()
+        stragglers = sorted(
+            (start, i) for i, start, _ in running.values()
+            if i not in duplicated and now - start > threshold)
+        for start, i in stragglers:
+            if self.dispatcher.idle() == 0:
+                break
+            tag = self.dispatcher.submit(jobs[i])
+            running[tag] = (i, now, True)
+            duplicated.add(i)
+            self.speculative += 1
+            logger.info('Re-executing a job running for {:.1f} s (median '
+                        '{:.1f} s)'.format(now - start,
+                                           statistics.median(durations)))
+
+    def close(self):
+        while self.dispatcher.pending > 0:
+            self.dispatcher.receive()
+        logger.info('Re-executed {} straggling jobs, {} copies finished '
+                    'first'.format(self.speculative, self.speculative_wins))
+        self.dispatcher.close()
+
+
+class AsynchronousEpsMOEA(EpsMOEA):
+    """ Steady-state epsilon-MOEA with asynchronous evaluations.
+
+        Each step waits for one evaluation to complete, inserts the solution
+        into the population (steady-state replacement of EpsMOEA) and the
+        epsilon-box archive, and dispatches new solutions to the idle
+        workers. Random solutions are dispatched until the population is
+        full; afterwards offspring are bred from a population member and an
+        archive member.
+
+        Worker utilisation (busy time of the workers divided by their
+        available time) is logged every population_size evaluations and
+        stored in the utilisation attribute.
+
+        Attributes:
+        -------------------------
+        dispatcher: ProcessDispatcher or MPIDispatcher
+            dispatches evaluation jobs to the workers
+        cache: EvaluationCache
+            optional cache of evaluation results; cached solutions are not
+            dispatched
+        telemetry: Telemetry
+            optional telemetry recording the metrics of the evaluations
+
+        Methods:
+        -------------------------
+        run(self, condition, callback): runs the search
+        step(self): processes one completed evaluation
+    """
+
+    def __init__(self, problem, epsilons, dispatcher, population_size=100,
+                 cache=None, telemetry=None, **kwargs):
+        kwargs.pop('evaluator', None)
+        super().__init__(problem, epsilons, population_size=population_size,
+                         **kwargs)
+        if self.variator is None:
+            self.variator = default_variator(problem)
+        self.dispatcher = dispatcher
+        self.cache = cache
+        self.telemetry = telemetry
+        self.max_evaluations = None
+        self.utilisation = None
+        self.population = []
+        self._submitted = 0
+        self._children = []
+        self._pending = {}
+        self._busy_time = 0.0
+        self._start_time = None
+
+    def run(self, condition, callback=None):
+        if isinstance(condition, int):
+            self.max_evaluations = self.nfe + condition
+        # Solutions in flight when a checkpoint was saved are not restored
+        self._submitted = self.nfe
+        super().run(condition, callback=callback)
+        # Wait for evaluations still running (only possible when the
+        # termination condition is not a number of evaluations)
+        while self.dispatcher.pending > 0:
+            self.dispatcher.next_completed()
+        self._report()
+
+    def step(self):
+        if self._start_time is None:
+            self._start_time = time.time()
+            self._dispatch()
+        if self.dispatcher.pending > 0:
+            job = self.dispatcher.next_completed()
+            self._busy_time += job.elapsed
+            if isinstance(job, TimedJob):
+                self.telemetry.record(job)
+                job = job.job
+            solution = self._pending.pop(job.solution_id)
+            result = job.solution
+            if is_failed(job):
+                mark_failed(solution)
+            else:
+                set_solution_result(solution, result.objectives[:],
+                                    result.constraints[:])
+            if self.cache is not None and not is_failed(job):
+                self.cache.put(list(solution.variables),
+                               solution.objectives[:],
+                               solution.constraints[:])
+            self._complete(solution)
+        self._dispatch()
+        self.result = self.archive
+
+    def _complete(self, solution):
+        self.nfe += 1
+        if len(self.population) < self.population_size:
+            self.population.append(solution)
+        else:
+            self._add_to_population(solution)
+        self.archive.add(solution)
+        if self.nfe % self.population_size == 0:
+            self._report()
+
+    def _candidate(self):
+        """ Return a new solution to evaluate """
+        if len(self.population) + self.dispatcher.pending < \
+                self.population_size or len(self.population) < 2:
+            return self.generator.generate(self.problem)
+        if not self._children:
+            if len(self.archive) <= 1:
+                parents = self.selector.select(self.variator.arity,
+                                               self.population)
+            else:
+                parents = self.selector.select(
+                    self.variator.arity-1, self.population) + \
+                    [random.choice(self.archive)]
+            random.shuffle(parents)
+            self._children = list(self.variator.evolve(parents))
+        return self._children.pop()
+
+    def _dispatch(self):
+        """ Dispatch new solutions to all idle workers """
+        while self.dispatcher.idle() > 0 and (
+                self.max_evaluations is None or
+                self._submitted < self.max_evaluations):
+            solution = self._candidate()
+            self._submitted += 1
+            if self.cache is not None:
+                result = self.cache.get(list(solution.variables))
+                if result is not None:
+                    set_solution_result(solution, *result)
+                    self._complete(solution)
+                    continue
+            job = EvaluateSolution(solution)
+            job.solution_id = self._submitted
+            self._pending[job.solution_id] = solution
+            if self.telemetry is not None:
+                job = TimedJob(job)
+            self.dispatcher.submit(job)
+
+    def _report(self):
+        if self._start_time is None:
+            return
+        available = self.dispatcher.size * (time.time() - self._start_time)
+        if available > 0:
+            self.utilisation = self._busy_time / available
+        logger.info('Evaluations: {}, archive size: {}, worker utilisation: '
+                    '{:.1%}'.format(self.nfe, len(self.archive),
+                                    self.utilisation or 0.0))
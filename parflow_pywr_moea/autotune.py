@@ -0,0 +1,183 @@
+""" This module defines the autotuning of the concurrency of MOEA searches
+
+    Before a search starts, a short calibration on the actual model and
+    node evaluates random solutions with every combination of the number of
+    concurrent evaluations and the number of cores of each Parflow run which
+    uses all the available cores. The throughput (evaluations per hour), the
+    memory used and the I/O pressure of each combination are measured, and
+    the combination with the highest throughput within the memory limit is
+    used for the search.
+
+    Functions:
+    ---------------------------------
+    candidate_configurations(cores): returns the (concurrent evaluations,
+                                     cores per Parflow run) combinations
+    parflow_topology(cores): returns a P x Q x 1 Parflow topology
+    configure_parflow(model, topology, launcher): sets the topology and
+                                                  launcher of Parflow runs
+    calibrate(wrapper, cores, rounds, max_memory, launcher): measures the
+        combinations and returns the best configuration
+"""
+
+import time
+import logging
+import threading
+import platypus
+from platypus.core import EvaluateSolution
+from .parflow.manager import ParflowRunner
+from .parflow.pywr_parameters import ParflowRunnerParameter
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+# Command starting parallel Parflow runs on the local node
+LOCAL_LAUNCHER = ('mpirun', '-np', '{np}')
+
+# Seconds between two samples of the available memory
+SAMPLE_INTERVAL = 0.5
+
+
+def candidate_configurations(cores):
+    """ Return the (concurrent evaluations, cores per Parflow run)
+        combinations using all cores """
+    return [(cores // per_run, per_run) for per_run in range(1, cores + 1)
+            if cores % per_run == 0]
+
+
+def parflow_topology(cores):
+    """ Return the P x Q x 1 topology of a Parflow run on cores processes
+        with P and Q as close as possible (CLM needs R = 1) """
+    q = max(n for n in range(1, int(cores ** 0.5) + 1) if cores % n == 0)
+    return (cores // q, q, 1)
+
+
+def configure_parflow(model, topology, launcher=None):
+    """ Set the topology (None for serial runs) and launcher of the Parflow
+        runs of model and of the models created later by this process (and
+        the worker processes forked from it) """
+    ParflowRunner.default_topology = topology
+    ParflowRunner.default_launcher = launcher
+    for parameter in model.parameters:
+        if isinstance(parameter, ParflowRunnerParameter):
+            parameter.runner.topology = topology
+            parameter.runner.launcher = launcher
+
+
+def _read_meminfo():
+    """ Return the total and available memory (kB) or None """
+    try:
+        with open('/proc/meminfo') as fh:
+            values = dict(line.split()[:2] for line in fh)
+    except (OSError, ValueError):
+        return None
+    return int(values['MemTotal:']), int(values['MemAvailable:'])
+
+
+def _read_io_stall():
+    """ Return the total time (microseconds) in which some task was stalled
+        on I/O (Linux pressure stall information) or None """
+    try:
+        with open('/proc/pressure/io') as fh:
+            some = fh.readline().split()
+    except OSError:
+        return None
+    return int(dict(item.split('=') for item in some[1:])['total'])
+
+
+class _Monitor(threading.Thread):
+    """ Samples the memory used while a configuration is measured """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.max_memory = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            meminfo = _read_meminfo()
+            if meminfo is not None:
+                used = 1.0 - meminfo[1] / meminfo[0]
+                self.max_memory = max(self.max_memory or 0.0, used)
+            self._stop_event.wait(SAMPLE_INTERVAL)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _measure(wrapper, solutions, concurrency, cores_per_run, launcher):
+    """ Evaluate solutions with the given concurrency and cores per Parflow
+        run and return the measurements """
+    topology = parflow_topology(cores_per_run) if cores_per_run > 1 else None
+    configure_parflow(wrapper.model, topology,
+                      launcher if topology is not None else None)
+    measurement = {'concurrency': concurrency, 'cores_per_run': cores_per_run,
+                   'topology': list(topology) if topology else [1, 1, 1],
+                   'evaluations': len(solutions)}
+    monitor = _Monitor()
+    monitor.start()
+    io_stall = _read_io_stall()
+    start = time.time()
+    try:
+        with platypus.ProcessPoolEvaluator(concurrency) as evaluator:
+            evaluator.evaluate_all([EvaluateSolution(s) for s in solutions])
+    except Exception as error:
+        logger.warning('Calibration of {} evaluations x {} cores failed: '
+                       '{}'.format(concurrency, cores_per_run, error))
+        measurement['error'] = str(error)
+    finally:
+        elapsed = time.time() - start
+        monitor.stop()
+    measurement['seconds'] = elapsed
+    measurement['evaluations_per_hour'] = 3600.0 * len(solutions) / elapsed
+    measurement['memory_fraction'] = monitor.max_memory
+    if io_stall is not None:
+        # Fraction of the time in which some task was waiting for I/O
+        measurement['io_pressure'] = \
+            (_read_io_stall() - io_stall) / 1e6 / elapsed
+    else:
+        measurement['io_pressure'] = None
+    return measurement
+
+
+def calibrate(wrapper, cores, rounds=1, max_memory=0.9, launcher=None):
+    """ Measure the throughput of each combination of concurrent
+        evaluations and cores per Parflow run on cores cores. Each
+        combination evaluates rounds x concurrency random solutions of
+        wrapper (a wrapper which does not save results). Returns the
+        configuration with the highest throughput among those using at
+        most max_memory of the memory, with the measurements of all
+        combinations under "calibration". """
+    if launcher is None:
+        launcher = LOCAL_LAUNCHER
+    generator = platypus.RandomGenerator()
+    configurations = candidate_configurations(cores)
+    solutions = [generator.generate(wrapper.problem)
+                 for _ in range(rounds * configurations[0][0])]
+
+    measurements = []
+    for concurrency, cores_per_run in configurations:
+        measurement = _measure(wrapper, solutions[:rounds * concurrency],
+                               concurrency, cores_per_run, launcher)
+        logger.info('Calibration: {} evaluations x {} cores: {:.1f} '
+                    'evaluations per hour, memory {}, I/O pressure '
+                    '{}'.format(concurrency, cores_per_run,
+                                measurement['evaluations_per_hour'],
+                                measurement['memory_fraction'],
+                                measurement['io_pressure']))
+        measurements.append(measurement)
+
+    feasible = [m for m in measurements if 'error' not in m and
+                (m['memory_fraction'] is None or
+                 m['memory_fraction'] <= max_memory)]
+    if not feasible:
+        raise RuntimeError('No configuration could be calibrated within the '
+                           'memory limit of {}.'.format(max_memory))
+    best = max(feasible, key=lambda m: m['evaluations_per_hour'])
+    configuration = dict(best, launcher=list(launcher)
+                         if best['cores_per_run'] > 1 else None,
+                         calibration=measurements)
+    logger.info('Autotuned configuration: {} concurrent evaluations with {} '
+                'cores per Parflow run'.format(best['concurrency'],
+                                               best['cores_per_run']))
+    return configuration
@@ -0,0 +1,116 @@
+""" This module defines EvaluationCache class
+
+    EvaluationCache class memoises the objectives and constraints of
+    evaluated decision vectors so that duplicate solutions proposed by the
+    MOEA are not evaluated (i.e. Parflow and Pywr are not run) again. The
+    cache can be persisted to a JSON lines file and reloaded when a search
+    is restarted.
+"""
+
+import os
+import json
+import logging
+import numpy as np
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+
+class EvaluationCache:
+    """ Cache of evaluation results keyed on canonicalised decision vectors.
+
+        Integer (landuse) variables are rounded to integers, as they are
+        when the Pywr model is evaluated, and real variables are rounded to
+        the given number of significant digits.
+
+        Attributes:
+        -------------------------
+        integer_indices: list
+            indices of the integer variables of the decision vector
+        digits: int
+            number of significant digits of real variables in the keys
+        filename: str
+            JSON lines file to which new results are appended (None for an
+            in-memory cache)
+
+        Methods:
+        -------------------------
+        from_wrapper(cls, wrapper, filename, digits): creates a cache for
+            the decision vectors of a Pywr optimisation wrapper
+        key(self, variables): returns the key of a decision vector
+        get(self, variables): returns cached (objectives, constraints) or None
+        put(self, variables, objectives, constraints): stores a result
+        load(self): reads the results stored in filename
+    """
+
+    def __init__(self, integer_indices, filename=None, digits=12):
+        self.integer_indices = set(integer_indices)
+        self.digits = digits
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self._results = {}
+        if filename is not None and os.path.exists(filename):
+            self.load()
+
+    @classmethod
+    def from_wrapper(cls, wrapper, filename=None, digits=12):
+        """ Create a cache for the decision vectors of wrapper """
+        integer_indices = []
+        for ivar, var in enumerate(wrapper.model_variables):
+            end = wrapper.model_variable_map[ivar+1]
+            integer_indices.extend(range(end - var.integer_size, end))
+        return cls(integer_indices, filename=filename, digits=digits)
+
+    def key(self, variables):
+        """ Return the canonical form of a decision vector as a tuple """
+        key = []
+        for i, x in enumerate(variables):
+            if i in self.integer_indices:
+                key.append(int(np.round(x)))
+            else:
+                key.append(float('{:.{}g}'.format(x, self.digits)))
+        return tuple(key)
+
+    def __len__(self):
+        return len(self._results)
+
+    def __contains__(self, variables):
+        return self.key(variables) in self._results
+
+    def get(self, variables):
+        """ Return the cached (objectives, constraints) of a decision vector
+            or None """
+        result = self._results.get(self.key(variables))
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, variables, objectives, constraints):
+        """ Store the result of a decision vector (and append it to the
+            cache file) """
+        key = self.key(variables)
+        if key in self._results:
+            return
+        result = (list(objectives), list(constraints))
+        self._results[key] = result
+        if self.filename is not None:
+            with open(self.filename, 'a') as fh:
+                fh.write(json.dumps({'variables': list(key),
+                                     'objectives': result[0],
+                                     'constraints': result[1]}) + '\n')
+
+    def load(self):
+        """ Read the results stored in the cache file """
+        with open(self.filename) as fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # line truncated when a run was killed
+                self._results[self.key(record['variables'])] = (
+                    record['objectives'], record['constraints'])
+        logger.info('Loaded {} cached evaluations from {}'.format(
+            len(self._results), self.filename))
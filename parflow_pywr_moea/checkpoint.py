@@ -0,0 +1,136 @@
+""" This module defines checkpointing of the state of a Platypus algorithm
+    so that a MOEA search can be resumed after it was stopped (e.g. when a
+    batch job reached its wall time)
+
+    A checkpoint holds the algorithm's attributes (population, archive,
+    reference points, NFE counter, ...) and the states of the random number
+    generators. The problem, evaluator, variator and other components which
+    are rebuilt when a search is started are not stored; the state of a
+    variator providing get_state and set_state (e.g. the decision vectors
+    seen by UniqueVariator) is stored and restored into the new variator.
+
+    Functions:
+    ---------------------------------
+    checkpoint_filename(search_name): returns the checkpoint file of a search
+    save_checkpoint(algorithm, filename): writes a checkpoint
+    load_checkpoint(algorithm, filename): restores a checkpoint into an
+                                          algorithm
+
+    Classes:
+    ---------------------------------
+    CheckpointExtension(Extension): saves checkpoints during a run
+"""
+
+import os
+import pickle
+import random
+import logging
+import numpy as np
+from platypus.extensions import Extension
+from .variators import default_variator
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+# Attributes of algorithms which are not stored in checkpoints. These are
+# set up again when the algorithm is instantiated.
+EXCLUDED_ATTRIBUTES = ('problem', 'evaluator', 'variator', 'generator',
+                       'selector', 'dominance', '_extensions', 'dispatcher',
+                       'cache', 'telemetry', '_pending', '_children',
+                       '_start_time', '_busy_time')
+
+
+def checkpoint_filename(search_name):
+    """ Return the name of the checkpoint file of a search """
+    return 'checkpoint_{}.pkl'.format(search_name)
+
+
+class _Pickler(pickle.Pickler):
+    """ Pickler storing references to the problem instead of the problem
+        (and the Pywr model it wraps) """
+
+    def __init__(self, file, problem):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.problem = problem
+
+    def persistent_id(self, obj):
+        if obj is self.problem:
+            return 'problem'
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def __init__(self, file, problem):
+        super().__init__(file)
+        self.problem = problem
+
+    def persistent_load(self, pid):
+        if pid == 'problem':
+            return self.problem
+        raise pickle.UnpicklingError('Unknown reference {}'.format(pid))
+
+
+def save_checkpoint(algorithm, filename):
+    """ Write the state of algorithm to filename. The file is replaced
+        atomically so that a checkpoint is never left incomplete. """
+    state = {key: value for key, value in algorithm.__dict__.items()
+             if key not in EXCLUDED_ATTRIBUTES}
+    checkpoint = {'algorithm': type(algorithm).__name__,
+                  'state': state,
+                  'random_state': random.getstate(),
+                  'numpy_random_state': np.random.get_state()}
+    variator = getattr(algorithm, 'variator', None)
+    if hasattr(variator, 'get_state'):
+        checkpoint['variator_state'] = variator.get_state()
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as fh:
+        _Pickler(fh, algorithm.problem).dump(checkpoint)
+    os.replace(tmp_filename, filename)
+    logger.info('Saved checkpoint after {} evaluations to {}'.format(
+        algorithm.nfe, filename))
+
+
+def load_checkpoint(algorithm, filename):
+    """ Restore the state saved in filename into algorithm (an instance of
+        the same algorithm class set up for the same problem) """
+    with open(filename, 'rb') as fh:
+        checkpoint = _Unpickler(fh, algorithm.problem).load()
+    if checkpoint['algorithm'] != type(algorithm).__name__:
+        raise ValueError('Checkpoint {} was saved by algorithm {}, not '
+                         '{}.'.format(filename, checkpoint['algorithm'],
+                                      type(algorithm).__name__))
+    algorithm.__dict__.update(checkpoint['state'])
+    # The default variator is normally set up in the first step
+    if getattr(algorithm, 'variator', False) is None:
+        algorithm.variator = default_variator(algorithm.problem)
+    variator = getattr(algorithm, 'variator', None)
+    if 'variator_state' in checkpoint and hasattr(variator, 'set_state'):
+        variator.set_state(checkpoint['variator_state'])
+    random.setstate(checkpoint['random_state'])
+    np.random.set_state(checkpoint['numpy_random_state'])
+    logger.info('Resuming from checkpoint {} after {} evaluations'.format(
+        filename, algorithm.nfe))
+
+
+class CheckpointExtension(Extension):
+    """ Platypus extension saving a checkpoint of the algorithm after every
+        interval evaluations (and at the end of the run) """
+
+    def __init__(self, filename, interval):
+        super().__init__()
+        self.filename = filename
+        self.interval = interval
+        self.last_nfe = None
+
+    def start_run(self, algorithm):
+        self.last_nfe = algorithm.nfe
+
+    def post_step(self, algorithm):
+        if algorithm.nfe - self.last_nfe >= self.interval:
+            save_checkpoint(algorithm, self.filename)
+            self.last_nfe = algorithm.nfe
+
+    def end_run(self, algorithm):
+        if algorithm.nfe != self.last_nfe:
+            save_checkpoint(algorithm, self.filename)
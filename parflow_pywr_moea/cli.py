@@ -3,6 +3,8 @@
 
     Functions:
     ---------------------------------
+    register_components(): registers the custom Pywr parameters and
+                           recorders
     render_model(filename, **data): populates Pywr .json file with data using
                                     jinja2 templating module
 
@@ -18,40 +20,61 @@ import sys
 import os
 import json
 import logging
+import importlib
 import click
-import tables
-import pandas
-import platypus
 import random
-import requests
-import ast
-import numpy as np
-from matplotlib import pyplot as plt
-from jinja2 import Environment, BaseLoader
+import shlex
 from pathlib import Path
-from pywr.model import Model
-from pywr.recorders import TablesRecorder, CSVRecorder
-from pywr.recorders import NumpyArrayNodeRecorder, NumpyArrayParameterRecorder, HydropowerRecorder
-from pywr.recorders.progress import ProgressRecorder
-from .moea import platypus_main, platypus_main_mpi
-from .parflow.pywr_parameters import *
-from .parflow.pywr_recorders import *
-from .recorders import *
-from .parflow_file_read_scripts import pf_read as pf_read
-from .parflow.manager import ParflowRunner
-from multiprocessing import Pool
+
+# The modules used by the subcommands are imported by the subcommands so
+# that e.g. "--help", "read-parflow-results" and every MPI rank of a search
+# only import what they need. COMMAND_IMPORTS lists them for the startup
+# benchmark (see startup.py); keep it in step with the imports of the
+# subcommands.
+
+# Modules registering the custom Pywr parameters and recorders which can be
+# used in model JSON files
+COMPONENT_MODULES = ('parflow_pywr_moea.parflow.pywr_parameters',
+                     'parflow_pywr_moea.parflow.pywr_recorders',
+                     'parflow_pywr_moea.recorders')
+
+COMMAND_IMPORTS = {
+    'read-parflow-results': (
+        'numpy', 'parflow_pywr_moea.parflow_file_read_scripts.pf_read'),
+    'run-parflow-batch': ('pandas', 'parflow_pywr_moea.parflow.manager'),
+    'run': ('numpy', 'pandas', 'jinja2', 'pywr.model',
+            'pywr.recorders') + COMPONENT_MODULES,
+    'plot': ('tables', 'pandas', 'matplotlib.pyplot'),
+    'search': ('platypus', 'jinja2', 'parflow_pywr_moea.moea',
+               'parflow_pywr_moea.asynchronous',
+               'parflow_pywr_moea.parflow.manager') + COMPONENT_MODULES,
+    'import-results': ('requests', ),
+    'archive-summary': ('parflow_pywr_moea.snapshots', ),
+    'worker': ('parflow_pywr_moea.workqueue',
+               'parflow_pywr_moea.parflow.manager') + COMPONENT_MODULES,
+    'startup-benchmark': ('parflow_pywr_moea.startup', ),
+}
 
 # Instantiate the top level logger object where __name__ is the module's name
 # and here __name__ == cli
 logger = logging.getLogger(__name__)
 
 
+def register_components():
+    """ Register the custom Pywr parameters and recorders (by importing the
+        modules defining them) before a model is loaded from JSON """
+    for module in COMPONENT_MODULES:
+        importlib.import_module(module)
+
+
 # Define a function that creates (renders) a PyWr json model using data
 # with Jinja2
 def render_model(filename, **data):
     """ Populate PyWr model .json file with data
         Return a dictionary containing rendered json string defining the
         Pywr model """
+    from jinja2 import Environment, BaseLoader
+
     with open(filename) as file_handle:
         template_data = file_handle.read()
 
@@ -99,6 +122,8 @@ def cli(verbose):
 @click.option('-f', '--finish', type=int, default=365)
 def read_parflow_results(folder_name, config_file, result_file, start, finish):
     """Reads variables saved by Parflow to a local folder"""
+    import numpy as np
+    from .parflow_file_read_scripts import pf_read
 
     # Number of days to be used from the simulation time-series
     num_days = abs(finish - start) + 1
@@ -272,6 +297,9 @@ def read_parflow_results(folder_name, config_file, result_file, start, finish):
 @click.argument('json-config-file', type=click.Path(exists=True))
 @click.argument('results-csv-file', type=click.Path(exists=True))
 def run_parflow_batch(json_config_file, results_csv_file):
+    import pandas
+    from .parflow.manager import ParflowRunner
+
     # Read json config file and extract result ids and list of variables
     # representing landuse allocations in the 1D transsect
 
@@ -368,6 +396,13 @@ def run_parflow_batch(json_config_file, results_csv_file):
 def run(input_json_file, binout, textout, result_dump):
     """ Runs PyWr model using rendered Pywr model from json file.
         Saves results in the provided output file """
+    import numpy as np
+    import pandas
+    from pywr.model import Model
+    from pywr.recorders import TablesRecorder, CSVRecorder
+    from .moea import pop_prescreen_flags
+
+    register_components()
     # Check whether folders to save binout and textout files exist
     # (using e.g. Path(binout).resolve().parent will produce absolute path)
     dir_binout = Path(binout).parent
@@ -378,7 +413,7 @@ def run(input_json_file, binout, textout, result_dump):
     if not os.path.exists(dir_textout):
         os.makedirs(dir_textout)
     # Create a dictionary with json file containing rendered pywr model
-    data = render_model(input_json_file)
+    data, _ = pop_prescreen_flags(render_model(input_json_file))
     # Load data into Pywr model
     logger.info('Loading model from file: "{}"'.format(input_json_file))
     model = Model.load(data)
@@ -449,6 +484,10 @@ def run(input_json_file, binout, textout, result_dump):
 @click.option('-n', '--nodes_list', default=[
               'supply1', 'city1', 'reservoir1', 'turbine1', 'city1_release'])
 def plot(input_file, nodes_list):
+    import tables
+    import pandas
+    from matplotlib import pyplot as plt
+
     # Read the hdf5 file
     with tables.open_file(input_file) as h5:
         # Get the time vector and convert to pandas dataframe
@@ -494,15 +533,118 @@ def plot(input_file, nodes_list):
 @click.option('-w', '--work-directory',
               type=click.Path(dir_okay=True,
                               file_okay=False), default=None)
+@click.option('--staging-directory', type=str, default=None,
+              help='Node-local scratch directory (e.g. \'$TMPDIR\') to '
+                   'which the Parflow model is copied once per node; '
+                   'Parflow runs there instead of in the work directory')
 @click.option('--variable-control-curve', is_flag=True)
+@click.option('-bs', '--scenario-batch-size', type=int, default=None,
+              help='Evaluate solutions sharing a landuse vector in batches of '
+                   'this many Pywr scenarios (one Parflow run per batch)')
+@click.option('-fs', '--fidelity-schedule', type=click.Path(exists=True),
+              default=None,
+              help='JSON file with lower fidelity levels used to screen '
+                   'candidates before evaluating them with the full model')
+@click.option('--prescreen', is_flag=True,
+              help='Reject solutions violating Parflow-independent '
+                   'constraints before running Parflow')
+@click.option('-pe', '--prescreen-epsilons', multiple=True, type=float,
+              default=None,
+              help='Also reject solutions epsilon-dominated on the '
+                   'Parflow-independent objectives (implies --prescreen)')
+@click.option('-sf', '--surrogate-fraction', type=float, default=None,
+              help='Generate extra offspring and evaluate only this fraction '
+                   'with the best objectives predicted by a surrogate')
+@click.option('--surrogate-model', type=click.Choice(['ridge', 'knn']),
+              default='ridge')
+@click.option('--nested', is_flag=True,
+              help='Search over landuse designs and optimise the control '
+                   'curves of each design in an inner search with Pywr only')
+@click.option('--inner-evaluations', type=int, default=200)
+@click.option('--inner-pop-size', type=int, default=20)
+@click.option('--inner-grid', type=int, default=None,
+              help='Use a grid search with this many values of each control '
+                   'curve instead of the inner MOEA')
+@click.option('-cf', '--cache-file', type=click.Path(dir_okay=False),
+              default=None,
+              help='Memoise evaluations in this file and reuse the results '
+                   'of duplicate decision vectors (also across restarts)')
+@click.option('--unique-offspring', is_flag=True,
+              help='Resample offspring whose decision vectors were already '
+                   'proposed in the search')
+@click.option('--max-retries', type=int, default=10,
+              help='Number of times a duplicate offspring is resampled')
+@click.option('--asynchronous', is_flag=True,
+              help='Use a steady-state epsilon-MOEA which breeds a new '
+                   'offspring whenever an evaluation completes (the '
+                   'population size and epsilons are used)')
+@click.option('--speculative', is_flag=True,
+              help='Re-execute evaluations running much longer than the '
+                   'median on idle workers and use the first result')
+@click.option('--straggler-factor', type=float, default=2.0,
+              help='Evaluations running longer than this multiple of the '
+                   'median run time are re-executed')
+@click.option('-ci', '--checkpoint-interval', type=int, default=None,
+              help='Save the state of the search to checkpoint_<name>.pkl '
+                   'every this many evaluations')
+@click.option('--resume', is_flag=True,
+              help='Continue the search from checkpoint_<name>.pkl')
+@click.option('-si', '--snapshot-interval', type=int, default=None,
+              help='Write the non-dominated archive to archive_<name>.npz '
+                   'every this many evaluations')
+@click.option('-se', '--snapshot-epsilons', multiple=True, type=float,
+              default=None,
+              help='Keep an epsilon-box archive for the snapshots')
+@click.option('-mi', '--metrics-interval', type=float, default=None,
+              help='Append search telemetry to metrics_<name>.jsonl every '
+                   'this many seconds')
+@click.option('-rpe', '--ranks-per-evaluation', type=int, default=None,
+              help='With --mpi, evaluate each solution on a group of this '
+                   'many ranks running Parflow in parallel')
+@click.option('--parflow-topology', type=int, nargs=3, default=None,
+              help='Parflow process topology P Q R of each evaluation '
+                   '(default: ranks per evaluation x 1 x 1)')
+@click.option('--parflow-launcher', type=str, default=None,
+              help='Command starting the parallel Parflow processes; {np} '
+                   'and {hosts} are replaced by the number of processes and '
+                   'the hosts of the group (default: mpirun -np {np} -host '
+                   '{hosts})')
+@click.option('--autotune', is_flag=True,
+              help='Choose the number of concurrent evaluations and the '
+                   'cores of each Parflow run sharing --num-cpus cores by a '
+                   'calibration on the model')
+@click.option('--autotune-rounds', type=int, default=1,
+              help='Evaluations per worker in each calibrated combination')
+@click.option('--autotune-max-memory', type=float, default=0.9,
+              help='Largest fraction of the memory a combination may use')
+@click.option('-q', '--queue', type=click.Path(dir_okay=False), default=None,
+              help='Evaluate solutions with the workers ("parflow-pywr '
+                   'worker") of this work queue instead of a process pool')
+@click.option('-id', '--island-directory',
+              type=click.Path(dir_okay=True, file_okay=False), default=None,
+              help='Shared directory through which searches with different '
+                   'seeds exchange non-dominated solutions (island model)')
+@click.option('--migration-interval', type=int, default=1000,
+              help='Number of evaluations between two migrations')
+@click.option('--migrants', type=int, default=None,
+              help='Largest number of solutions imported per migration')
 @click.option('-i', '--input-json-file', type=click.Path(exists=True))
-def search(name, mpi, algorithm, pop_size, seed, num_cpus, no_evals, epsilons,
-           divisions_inner, divisions_outer, mongo_host, mongo_db,
-           mongo_drop_db, work_directory, variable_control_curve,
-           input_json_file):
+def search(name, mpi, algorithm, pop_size, seed, epsilons, divisions_inner,
+           divisions_outer, work_directory, staging_directory,
+           variable_control_curve, input_json_file, **options):
     """Perform MOEA runs with the integrated PyWR Parflow model"""
+    import platypus
+    from .moea import platypus_main, platypus_main_mpi
+    from .asynchronous import AsynchronousEpsMOEA
+    from .parflow.manager import ParflowRunner
+
+    register_components()
     logger.info('Parflow work directory: {}'.format(work_directory))
     logger.info('Variable control curve: {}'.format(variable_control_curve))
+    if staging_directory is not None:
+        logger.info('Node-local staging directory: {}'.format(
+            staging_directory))
+        ParflowRunner.default_staging_directory = staging_directory
     logger.info('Rendering model in file: "{}"'.format(input_json_file))
     data = render_model(input_json_file,
                         work_directory=work_directory,
@@ -513,6 +655,8 @@ def search(name, mpi, algorithm, pop_size, seed, num_cpus, no_evals, epsilons,
                                           if variable_control_curve else 'no-'),
     ]
 
+    search_options = _search_options(mpi, search_tags, options)
+
     # Initialise variables depending on the chosen MOEA algorithm
     if algorithm == 'NSGAII':
         algorithm_class = platypus.NSGAII
@@ -533,6 +677,13 @@ def search(name, mpi, algorithm, pop_size, seed, num_cpus, no_evals, epsilons,
     else:
         raise RuntimeError('Algorithm "{}" not supported.'.format(algorithm))
 
+    if options['asynchronous']:
+        logger.info('Asynchronous evaluation replaces algorithm {} by '
+                    'AsynchronousEpsMOEA'.format(algorithm))
+        algorithm_class = AsynchronousEpsMOEA
+        algorithm_kwargs = {
+            'population_size': pop_size, 'epsilons': epsilons}
+
     # Define seed for random number generation
     if seed is None:
         seed = random.randrange(sys.maxsize)
@@ -540,17 +691,118 @@ def search(name, mpi, algorithm, pop_size, seed, num_cpus, no_evals, epsilons,
 
     logger.info('Starting model search...')
 
+    main = platypus_main_mpi if mpi else platypus_main
+    main(name, data, seed, algorithm_class, search_options,
+         **algorithm_kwargs)
+
+
+def _search_options(mpi, search_tags, options):
+    """ Return the moea.SearchOptions set by the options of the search
+        command and add the tags of the features used to search_tags """
+    from .moea import SearchOptions
+
+    if options['fidelity_schedule'] is not None:
+        with open(options['fidelity_schedule']) as fh:
+            fidelity = json.load(fh)
+        search_tags.append('multi-fidelity')
+    else:
+        fidelity = None
+
+    if options['prescreen'] or options['prescreen_epsilons']:
+        prescreen = {'epsilons': list(options['prescreen_epsilons']) or None}
+        search_tags.append('prescreen')
+    else:
+        prescreen = None
+
+    if options['surrogate_fraction'] is not None:
+        surrogate = {'fraction': options['surrogate_fraction'],
+                     'regressor': options['surrogate_model']}
+        search_tags.append('surrogate')
+    else:
+        surrogate = None
+
+    if options['nested']:
+        if options['inner_grid'] is not None:
+            nested = {'grid': options['inner_grid']}
+        else:
+            nested = {'evaluations': options['inner_evaluations'],
+                      'population_size': options['inner_pop_size']}
+        search_tags.append('nested')
+    else:
+        nested = None
+
+    if options['cache_file'] is not None:
+        search_tags.append('cached')
+
+    if options['unique_offspring']:
+        unique = {'max_retries': options['max_retries']}
+        search_tags.append('unique-offspring')
+    else:
+        unique = None
+
+    if options['speculative']:
+        speculative = {'straggler_factor': options['straggler_factor']}
+        search_tags.append('speculative')
+    else:
+        speculative = None
+
+    if options['snapshot_interval'] is not None:
+        snapshots = {'interval': options['snapshot_interval'],
+                     'epsilons': list(options['snapshot_epsilons']) or None}
+    else:
+        snapshots = None
+
+    if options['ranks_per_evaluation'] is not None:
+        if not mpi:
+            raise click.UsageError('--ranks-per-evaluation requires --mpi')
+        search_tags.append('hierarchical-mpi')
+    launcher = options['parflow_launcher']
+    if launcher is not None:
+        launcher = shlex.split(launcher)
+
+    if options['autotune']:
+        if mpi:
+            raise click.UsageError('--autotune can not be used with --mpi')
+        autotune = {'rounds': options['autotune_rounds'],
+                    'max_memory': options['autotune_max_memory'],
+                    'launcher': launcher}
+        search_tags.append('autotuned')
+    else:
+        autotune = None
+
+    if options['queue'] is not None:
+        if mpi or autotune:
+            raise click.UsageError('--queue can not be used with --mpi or '
+                                   '--autotune')
+        search_tags.append('work-queue')
+
+    if options['island_directory'] is not None:
+        islands = {'directory': options['island_directory'],
+                   'interval': options['migration_interval'],
+                   'migrants': options['migrants']}
+        search_tags.append('islands')
+    else:
+        islands = None
+
+    search_options = SearchOptions(
+        mongo_url=options['mongo_host'], mongo_db=options['mongo_db'],
+        drop=options['mongo_drop_db'], extra_tags=search_tags,
+        no_evals=options['no_evals'],
+        batch_size=options['scenario_batch_size'], fidelity=fidelity,
+        prescreen=prescreen, surrogate=surrogate, nested=nested,
+        cache=options['cache_file'], unique=unique, speculative=speculative,
+        checkpoint_interval=options['checkpoint_interval'],
+        resume=options['resume'], snapshots=snapshots,
+        metrics_interval=options['metrics_interval'], islands=islands)
     if mpi:
-        platypus_main_mpi(name, data, seed, algorithm_class,
-                          mongo_url=mongo_host, mongo_db=mongo_db,
-                          drop=mongo_drop_db, extra_tags=search_tags,
-                          no_evals=no_evals, **algorithm_kwargs)
+        search_options.ranks_per_evaluation = options['ranks_per_evaluation']
+        search_options.topology = options['parflow_topology'] or None
+        search_options.launcher = launcher
     else:
-        platypus_main(name, data, seed, algorithm_class,
-                      mongo_url=mongo_host, mongo_db=mongo_db,
-                      drop=mongo_drop_db, extra_tags=search_tags,
-                      no_evals=no_evals, no_threads=num_cpus,
-                      **algorithm_kwargs)
+        search_options.no_threads = options['num_cpus']
+        search_options.autotune = autotune
+        search_options.queue = options['queue']
+    return search_options
 
 
 @cli.command('import-results')
@@ -562,6 +814,8 @@ def search(name, mpi, algorithm, pop_size, seed, num_cpus, no_evals, epsilons,
 def import_results(directory, mongo_host, mongo_db, mongo_drop_db):
     """Import MOEA search results from a specified directory that containts
        file 'search.json' """
+    import requests
+
     print(mongo_host, mongo_db)
 
     with open(os.path.join(directory, 'search.json')) as fh:
@@ -602,6 +856,90 @@ def import_results(directory, mongo_host, mongo_db, mongo_drop_db):
                     logger.info('Save complete!')
 
 
+@cli.command('archive-summary')
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+def archive_summary(filename):
+    """Print the size and the objective ranges of an archive snapshot
+       written during a search (archive_<name>.npz)"""
+    from .snapshots import load_snapshot
+
+    snapshot = load_snapshot(filename)
+    objectives = snapshot['objectives']
+    print('Evaluations: {}'.format(int(snapshot['nfe'])))
+    print('Non-dominated solutions: {}'.format(len(objectives)))
+    for i, column in enumerate(objectives.T):
+        print('Objective {}: min {:.6g}, max {:.6g}'.format(
+            i, column.min(), column.max()))
+
+
+@cli.command()
+@click.argument('queue', type=click.Path(dir_okay=False))
+@click.option('--lease-timeout', type=float, default=300.0,
+              help='Seconds after which the jobs of a worker which stopped '
+                   'renewing its leases are requeued')
+@click.option('--idle-timeout', type=float, default=None,
+              help='Stop after this many seconds without work')
+@click.option('--max-evaluations', type=int, default=None,
+              help='Stop after this many evaluations')
+@click.option('--poll-interval', type=float, default=5.0,
+              help='Seconds between two checks of an empty queue')
+@click.option('--staging-directory', type=str, default=None,
+              help='Node-local scratch directory to which the Parflow model '
+                   'is copied once per node')
+def worker(queue, lease_timeout, idle_timeout, max_evaluations,
+           poll_interval, staging_directory):
+    """Evaluate solutions of a search run with --queue QUEUE until the
+       search is finished"""
+    from .workqueue import run_worker
+    from .parflow.manager import ParflowRunner
+
+    register_components()
+    if staging_directory is not None:
+        ParflowRunner.default_staging_directory = staging_directory
+    run_worker(queue, lease_timeout=lease_timeout, idle_timeout=idle_timeout,
+               max_evaluations=max_evaluations, poll_interval=poll_interval)
+
+
+@cli.command('startup-benchmark')
+@click.option('-c', '--command', 'commands', multiple=True,
+              help='Subcommand to measure (all subcommands by default)')
+@click.option('-b', '--budget', 'budgets', multiple=True,
+              help='Startup budget COMMAND=SECONDS replacing the default '
+                   'budget of a subcommand')
+@click.option('-r', '--repeat', type=int, default=3,
+              help='Number of measurements of each subcommand (the shortest '
+                   'time is reported)')
+def startup_benchmark(commands, budgets, repeat):
+    """Measure the import time of the command line interface and of each
+       subcommand and fail if one exceeds its startup budget"""
+    from .startup import benchmark
+
+    unknown = set(commands) - set(COMMAND_IMPORTS) - {'--help'}
+    if unknown:
+        raise click.UsageError('Unknown subcommands: {}'.format(
+            ', '.join(sorted(unknown))))
+    command_imports = {command: modules
+                       for command, modules in COMMAND_IMPORTS.items()
+                       if not commands or command in commands}
+    try:
+        budgets = {command: float(seconds) for command, seconds in
+                   (budget.split('=', 1) for budget in budgets)}
+    except ValueError:
+        raise click.UsageError('Budgets must be given as COMMAND=SECONDS')
+
+    results = benchmark(command_imports, budgets, repeat)
+    if commands and '--help' not in commands:
+        results = [r for r in results if r['command'] != '--help']
+    for result in results:
+        seconds = '-' if result['seconds'] is None else \
+            '{:.3f}s'.format(result['seconds'])
+        print('{:<22} {:>8} (budget {:.2f}s) {}'.format(
+            result['command'], seconds, result['budget'],
+            result['error'] or 'ok'))
+    if any(result['error'] for result in results):
+        sys.exit(1)
+
+
 def start_cli():
     # Run cli with environment variables (if present)
     # e.g. export PARFLOW_PYWR_RUN_OUTPUT=outputs/file.h5
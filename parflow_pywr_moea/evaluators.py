@@ -0,0 +1,590 @@
+""" This module defines Platypus evaluators used in MOEA runs with the
+    integrated Pywr / Parflow model
+
+    Functions:
+    ---------------------------------
+    set_solution_result(solution, objectives, constraints): stores results
+        of an evaluation in a Platypus solution in the same way as
+        platypus.Problem does
+    mark_failed(solution): gives a solution whose evaluation failed the
+        worst objectives and marks it infeasible
+    is_failed(job): returns True if the evaluation of a job failed
+
+    Classes:
+    ---------------------------------
+    ScenarioBatchJob(Job): evaluates a batch of decision vectors sharing
+        the same landuse vector in one Pywr model run
+    ScenarioBatchEvaluator(Evaluator): groups solutions by landuse vector and
+        dispatches the groups as ScenarioBatchJobs to another evaluator
+    FidelityJob(Job): evaluates a decision vector at a given fidelity level
+    MultiFidelityEvaluator(Evaluator): screens solutions at low fidelity and
+        re-evaluates only the promising ones at higher fidelity levels
+    PrescreenEvaluator(Evaluator): rejects solutions on their
+        Parflow-independent objectives and constraints before running the
+        model
+    SurrogateTrainingEvaluator(Evaluator): trains a surrogate model on the
+        evaluated solutions and reports its accuracy
+    NestedJob(Job): optimises the control curves of a landuse design
+    NestedEvaluator(Evaluator): evaluates landuse designs with inner
+        control-curve searches and merges their Pareto sets into an archive
+    CachingEvaluator(Evaluator): returns cached results of duplicate
+        decision vectors without evaluating them again
+"""
+
+import sys
+import math
+import logging
+from collections import OrderedDict
+import numpy as np
+from platypus.core import Archive, Solution, nondominated_sort
+from platypus.evaluator import Evaluator, Job
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+
+def set_solution_result(solution, objectives, constraints=()):
+    """ Copy objectives and constraints into solution and mark it as
+        evaluated. Mirrors what platypus.Problem does after evaluation. """
+    solution.objectives[:] = objectives
+    solution.constraints[:] = constraints
+    solution.constraint_violation = sum(
+        [abs(f(x)) for (f, x) in zip(solution.problem.constraints,
+                                     solution.constraints)])
+    solution.feasible = solution.constraint_violation == 0.0
+    solution.evaluated = True
+
+
+def mark_failed(solution):
+    """ Give a solution whose evaluation failed (e.g. on a worker of a
+        work queue) the largest objective values (Pywr negates maximised
+        objectives, so all are minimised) and mark it infeasible (and with
+        failed set to True) so that the search continues without it """
+    problem = solution.problem
+    set_solution_result(solution, [sys.float_info.max] * problem.nobjs,
+                        [0.0] * problem.nconstrs)
+    solution.constraint_violation = 1.0
+    solution.feasible = False
+    solution.failed = True
+
+
+def is_failed(job):
+    """ Return True if the evaluation of job failed """
+    return getattr(job, 'failed', False)
+
+
+class ScenarioBatchJob(Job):
+    """ Job evaluating several decision vectors that share the same landuse
+        vector in one run of the wrapper's batched Pywr model """
+
+    def __init__(self, wrapper, variables):
+        super().__init__()
+        self.wrapper = wrapper
+        self.variables = variables
+        self.results = None
+
+    def run(self):
+        self.results = self.wrapper.evaluate_batch(self.variables)
+
+
+class ScenarioBatchEvaluator(Evaluator):
+    """ Evaluator grouping solutions which share the same landuse vector.
+
+        Each group is split into batches of at most batch_size solutions and
+        every batch is evaluated with a single Pywr run (and therefore a
+        single Parflow run) by the wrapped evaluator. Results for each
+        scenario of the batch are copied back to the individual solutions.
+
+        Methods:
+        ---------------------------------
+        evaluate_all(self, jobs): evaluates all jobs in batches
+        close(self): closes the wrapped evaluator
+    """
+
+    def __init__(self, evaluator, wrapper, batch_size):
+        super().__init__()
+        if batch_size < 1:
+            raise ValueError('Batch size must be a positive integer.')
+        self.evaluator = evaluator
+        self.wrapper = wrapper
+        self.batch_size = batch_size
+
+    def evaluate_all(self, jobs, **kwargs):
+        """ Evaluate the solutions of all jobs in landuse batches """
+        groups = OrderedDict()
+        for job in jobs:
+            key = self.wrapper.landuse_key(job.solution.variables)
+            groups.setdefault(key, []).append(job)
+
+        batch_jobs = []
+        batch_members = []
+        for group in groups.values():
+            for start in range(0, len(group), self.batch_size):
+                members = group[start:start + self.batch_size]
+                batch_jobs.append(ScenarioBatchJob(
+                    self.wrapper,
+                    [list(job.solution.variables) for job in members]))
+                batch_members.append(members)
+
+        logger.info('Evaluating {} solutions with {} unique landuse vectors '
+                    'in {} batched runs'.format(len(jobs), len(groups),
+                                                len(batch_jobs)))
+
+        results = self.evaluator.evaluate_all(batch_jobs, **kwargs)
+        for batch_job, members in zip(results, batch_members):
+            if is_failed(batch_job):
+                for job in members:
+                    mark_failed(job.solution)
+                continue
+            for job, (objectives, constraints) in zip(members,
+                                                      batch_job.results):
+                set_solution_result(job.solution, objectives, constraints)
+        return jobs
+
+    def close(self):
+        self.evaluator.close()
+
+
+class FidelityJob(Job):
+    """ Job evaluating a decision vector with the wrapper's model of the
+        given fidelity level """
+
+    def __init__(self, wrapper, variables, level):
+        super().__init__()
+        self.wrapper = wrapper
+        self.variables = variables
+        self.level = level
+        self.results = None
+
+    def run(self):
+        self.results = self.wrapper.evaluate_fidelity(self.variables,
+                                                      self.level)
+
+
+class MultiFidelityEvaluator(Evaluator):
+    """ Evaluator screening solutions on the wrapper's fidelity ladder.
+
+        All solutions are first evaluated at the lowest fidelity level. After
+        each level the non-dominated solutions of the evaluated set (and, if
+        promote_fraction is given, at least that fraction of the set, taken
+        in order of non-domination rank and crowding distance) are promoted
+        and re-evaluated at the next level, up to the full model. Solutions
+        which are not promoted keep the results of the highest level they
+        reached. These come from a shorter horizon and can not be compared
+        with full-model results, so such solutions are marked infeasible
+        (and with screened set to True) and their objectives take the worst
+        full-model value evaluated so far; the lower fidelity results are
+        kept in their screened_objectives attribute. The level is stored in
+        the fidelity attribute of each solution.
+
+        If screen_evaluations is given, screening stops once that many
+        solutions have been evaluated and all later solutions are evaluated
+        at full fidelity only.
+
+        Methods:
+        ---------------------------------
+        evaluate_all(self, jobs): evaluates all jobs on the fidelity ladder
+        promote(self, jobs): returns the jobs promoted to the next level
+        screen_out(self, solution): marks a solution which did not reach
+                                    the full model as infeasible
+        close(self): closes the wrapped evaluator
+    """
+
+    def __init__(self, evaluator, wrapper, promote_fraction=0.0,
+                 screen_evaluations=None):
+        super().__init__()
+        if not 0.0 <= promote_fraction <= 1.0:
+            raise ValueError('The promoted fraction must be between 0 and 1.')
+        self.evaluator = evaluator
+        self.wrapper = wrapper
+        self.promote_fraction = promote_fraction
+        self.screen_evaluations = screen_evaluations
+        self.nfe = 0
+        # Number of model runs made at each fidelity level
+        self.runs = [0] * wrapper.num_fidelities
+        self._worst = None
+
+    def evaluate_all(self, jobs, **kwargs):
+        """ Evaluate the solutions of all jobs, screening them at the lower
+            fidelity levels first """
+        full = self.wrapper.num_fidelities - 1
+        if self.screen_evaluations is not None and \
+                self.nfe >= self.screen_evaluations:
+            level = full
+        else:
+            level = 0
+
+        candidates = list(jobs)
+        while candidates:
+            results = self.evaluator.evaluate_all(
+                [FidelityJob(self.wrapper, list(job.solution.variables), level)
+                 for job in candidates], **kwargs)
+            for job, fidelity_job in zip(candidates, results):
+                if is_failed(fidelity_job):
+                    mark_failed(job.solution)
+                else:
+                    set_solution_result(job.solution, *fidelity_job.results)
+                    # A promoted solution may have failed at a lower level
+                    job.solution.failed = False
+                job.solution.fidelity = level
+            self.runs[level] += len(candidates)
+            if level == full:
+                objectives = [job.solution.objectives[:] for job in candidates
+                              if not getattr(job.solution, 'failed', False)]
+                if self._worst is not None:
+                    objectives.append(self._worst)
+                if objectives:
+                    self._worst = np.max(objectives, axis=0)
+                break
+            candidates = self.promote(candidates)
+            level += 1
+
+        for job in jobs:
+            if job.solution.fidelity < full and \
+                    not getattr(job.solution, 'failed', False):
+                self.screen_out(job.solution)
+        self.nfe += len(jobs)
+        logger.info('Model runs at each fidelity level: {}'.format(
+            self.runs))
+        return jobs
+
+    def promote(self, jobs):
+        """ Return the jobs whose solutions are promoted to the next level """
+        solutions = [job.solution for job in jobs]
+        nondominated_sort(solutions)
+        count = max(math.ceil(self.promote_fraction * len(jobs)),
+                    sum(1 for solution in solutions if solution.rank == 0))
+        order = sorted(range(len(jobs)), key=lambda i: (
+            solutions[i].rank, -solutions[i].crowding_distance))
+        return [jobs[i] for i in order[:count]]
+
+    def screen_out(self, solution):
+        """ Mark a solution evaluated only at a lower fidelity level as
+            infeasible so that it can not dominate full-model results """
+        solution.screened_objectives = solution.objectives[:]
+        # platypus ignores the constraint violation of problems without
+        # constraints, so the objectives must not be better either
+        solution.objectives[:] = list(self._worst)
+        solution.constraint_violation = max(solution.constraint_violation,
+                                            1.0)
+        solution.feasible = False
+        solution.screened = True
+
+    def close(self):
+        self.evaluator.close()
+
+
+class PrescreenEvaluator(Evaluator):
+    """ Evaluator pre-screening solutions on the objectives and constraints
+        which depend only on the landuse vector (see
+        PlatypusPyretoDBWrapper.evaluate_prescreen). These are computed on
+        the master process before any model run.
+
+        A solution is rejected without running Parflow and Pywr if it
+        violates a Parflow-independent constraint or, when epsilons are
+        given, if its epsilon box on the Parflow-independent objectives is
+        dominated by the box of a previously evaluated feasible solution.
+        The latter assumes the remaining objectives can not make up for
+        worse Parflow-independent objectives.
+
+        Rejected solutions are marked infeasible (and with rejected set to
+        True); objectives which need the model take the worst value
+        evaluated so far.
+
+        Methods:
+        ---------------------------------
+        evaluate_all(self, jobs): evaluates the jobs which pass the
+                                  pre-screen
+        close(self): closes the wrapped evaluator
+    """
+
+    def __init__(self, evaluator, wrapper, epsilons=None):
+        super().__init__()
+        self.evaluator = evaluator
+        self.wrapper = wrapper
+        self.objective_indices, _ = wrapper.prescreen_indices()
+        if epsilons is not None:
+            epsilons = np.broadcast_to(np.array(epsilons, dtype=np.float64),
+                                       (len(self.objective_indices),))
+        self.epsilons = epsilons
+        # Epsilon boxes of the evaluated feasible solutions which are not
+        # dominated on the Parflow-independent objectives
+        self._boxes = np.empty((0, len(self.objective_indices)))
+        self._worst = None
+        self.rejected = 0
+
+    def _box(self, objectives):
+        values = np.array([objectives[i] for i in self.objective_indices])
+        return np.floor(values / self.epsilons)
+
+    def _box_dominated(self, box):
+        better = np.all(self._boxes <= box, axis=1) & \
+            np.any(self._boxes < box, axis=1)
+        return bool(np.any(better))
+
+    def _archive(self, solution):
+        if self.epsilons is None or not solution.feasible:
+            return
+        box = self._box(solution.objectives)
+        if self._box_dominated(box):
+            return
+        keep = ~(np.all(box <= self._boxes, axis=1) &
+                 np.any(box < self._boxes, axis=1))
+        self._boxes = np.vstack([self._boxes[keep], box])
+
+    def _reject(self, solution, objectives, constraints):
+        problem = solution.problem
+        values = list(self._worst) if self._worst is not None \
+            else [0.0] * problem.nobjs
+        for i, value in objectives.items():
+            values[i] = value
+        set_solution_result(solution, values, [
+            constraints.get(i, 0.0) for i in range(problem.nconstrs)])
+        # Treat the solution as infeasible even if it only failed the
+        # epsilon-dominance test
+        solution.constraint_violation = max(solution.constraint_violation,
+                                            1.0)
+        solution.feasible = False
+        solution.rejected = True
+
+    def evaluate_all(self, jobs, **kwargs):
+        """ Pre-screen all jobs and evaluate the accepted ones """
+        accepted = []
+        rejected = []
+        for job in jobs:
+            solution = job.solution
+            objectives, constraints = self.wrapper.evaluate_prescreen(
+                list(solution.variables))
+            violation = sum(
+                abs(solution.problem.constraints[i](x))
+                for i, x in constraints.items())
+            dominated = self.epsilons is not None and \
+                self._box_dominated(self._box(objectives))
+            if violation > 0.0 or dominated:
+                rejected.append((job, objectives, constraints))
+            else:
+                accepted.append(job)
+
+        results = self.evaluator.evaluate_all(accepted, **kwargs)
+        for job in results:
+            self._archive(job.solution)
+            objectives = np.array(job.solution.objectives[:])
+            self._worst = objectives if self._worst is None \
+                else np.maximum(self._worst, objectives)
+        for job, objectives, constraints in rejected:
+            self._reject(job.solution, objectives, constraints)
+
+        self.rejected += len(rejected)
+        logger.info('Pre-screen rejected {} of {} solutions ({} in '
+                    'total)'.format(len(rejected), len(jobs), self.rejected))
+        evaluated = iter(results)
+        accepted_ids = set(id(job) for job in accepted)
+        return [next(evaluated) if id(job) in accepted_ids else job
+                for job in jobs]
+
+    def close(self):
+        self.evaluator.close()
+
+
+class SurrogateTrainingEvaluator(Evaluator):
+    """ Evaluator adding every evaluated solution to the training set of a
+        surrogate (see parflow_pywr_moea.surrogate.Surrogate).
+
+        Every report_every evaluations (e.g. once per generation) it logs the
+        rank correlation between the predicted and evaluated objectives of
+        the solutions screened by the SurrogateVariator and the share of
+        offspring the variator filtered out.
+
+        Methods:
+        ---------------------------------
+        evaluate_all(self, jobs): evaluates all jobs and trains the surrogate
+        close(self): closes the wrapped evaluator
+    """
+
+    def __init__(self, evaluator, surrogate, variator=None, report_every=1):
+        super().__init__()
+        self.evaluator = evaluator
+        self.surrogate = surrogate
+        self.variator = variator
+        self.report_every = report_every
+        self._predicted = []
+        self._evaluated = []
+        self._count = 0
+        self._generated = 0
+        self._kept = 0
+
+    def evaluate_all(self, jobs, **kwargs):
+        results = self.evaluator.evaluate_all(jobs, **kwargs)
+        solutions = [job.solution for job in results]
+        for solution in solutions:
+            predicted = getattr(solution, 'predicted_objectives', None)
+            if predicted is not None and solution.feasible:
+                self._predicted.append(predicted)
+                self._evaluated.append(list(solution.objectives))
+        self.surrogate.add(solutions)
+        self._count += len(jobs)
+        if self._count >= self.report_every:
+            self.report()
+        return results
+
+    def report(self):
+        """ Log the accuracy and filtering of the surrogate since the last
+            report """
+        if self._predicted:
+            logger.info('Surrogate rank correlation of each objective: '
+                        '{}'.format(self.surrogate.accuracy(
+                            self._predicted, self._evaluated)))
+        if self.variator is not None and \
+                self.variator.generated > self._generated:
+            generated = self.variator.generated - self._generated
+            kept = self.variator.kept - self._kept
+            logger.info('Surrogate filtered out {} of {} offspring '
+                        '({:.0%})'.format(generated - kept, generated,
+                                          (generated - kept) / generated))
+            self._generated = self.variator.generated
+            self._kept = self.variator.kept
+        self._predicted = []
+        self._evaluated = []
+        self._count = 0
+
+    def close(self):
+        self.evaluator.close()
+
+
+class NestedJob(Job):
+    """ Job running the inner control-curve search of a landuse design """
+
+    def __init__(self, wrapper, landuse, inner):
+        super().__init__()
+        self.wrapper = wrapper
+        self.landuse = landuse
+        self.inner = inner
+        self.results = None
+
+    def run(self):
+        self.results = self.wrapper.evaluate_nested(self.landuse, self.inner)
+
+
+class NestedEvaluator(Evaluator):
+    """ Evaluator of the outer (landuse) level of a bi-level search.
+
+        Each landuse design is evaluated by an inner search over the
+        control curves (see PlatypusPyretoDBWrapper.evaluate_nested). The
+        solutions of the inner Pareto set are added to archive, which holds
+        solutions of the full problem. The landuse design is assigned the
+        ideal point (best value of each objective) of the feasible members
+        of its inner Pareto set and the constraints of its least infeasible
+        member.
+
+        Methods:
+        ---------------------------------
+        evaluate_all(self, jobs): evaluates all landuse designs
+        close(self): closes the wrapped evaluator
+    """
+
+    def __init__(self, evaluator, wrapper, inner, archive=None):
+        super().__init__()
+        self.evaluator = evaluator
+        self.wrapper = wrapper
+        self.inner = inner
+        self.archive = Archive() if archive is None else archive
+
+    def evaluate_all(self, jobs, **kwargs):
+        results = self.evaluator.evaluate_all(
+            [NestedJob(self.wrapper, list(job.solution.variables), self.inner)
+             for job in jobs], **kwargs)
+        for job, nested_job in zip(jobs, results):
+            if is_failed(nested_job):
+                mark_failed(job.solution)
+                continue
+            members = []
+            for variables, objectives, constraints in nested_job.results:
+                solution = Solution(self.wrapper.problem)
+                solution.variables[:] = variables
+                set_solution_result(solution, objectives, constraints)
+                members.append(solution)
+            self.archive.extend(members)
+
+            feasible = [m for m in members if m.feasible] or members
+            ideal = np.min([m.objectives[:] for m in feasible], axis=0)
+            best = min(members, key=lambda m: m.constraint_violation)
+            set_solution_result(job.solution, list(ideal),
+                                best.constraints[:])
+            job.solution.inner_front = len(members)
+        logger.info('Evaluated {} landuse designs; {} solutions in the '
+                    'archive'.format(len(jobs), len(self.archive)))
+        return jobs
+
+    def close(self):
+        self.evaluator.close()
+
+
+class CachingEvaluator(Evaluator):
+    """ Evaluator memoising results in an EvaluationCache (see
+        parflow_pywr_moea.cache). It runs on the master process, so the
+        cache is shared by all workers of the wrapped evaluator (process
+        pool or MPI pool).
+
+        Cached solutions, and duplicates within the evaluated set, are not
+        passed to the wrapped evaluator. Solutions evaluated below
+        full_fidelity (see MultiFidelityEvaluator) are not cached.
+
+        Methods:
+        ---------------------------------
+        evaluate_all(self, jobs): evaluates the jobs not found in the cache
+        close(self): closes the wrapped evaluator
+    """
+
+    def __init__(self, evaluator, cache, full_fidelity=None):
+        super().__init__()
+        self.evaluator = evaluator
+        self.cache = cache
+        self.full_fidelity = full_fidelity
+
+    def evaluate_all(self, jobs, **kwargs):
+        pending = OrderedDict()
+        duplicates = []
+        for job in jobs:
+            variables = list(job.solution.variables)
+            result = self.cache.get(variables)
+            if result is not None:
+                set_solution_result(job.solution, *result)
+                if self.full_fidelity is not None:
+                    job.solution.fidelity = self.full_fidelity
+                continue
+            key = self.cache.key(variables)
+            if key in pending:
+                duplicates.append((job, pending[key]))
+            else:
+                pending[key] = job
+
+        misses = list(pending.values())
+        results = self.evaluator.evaluate_all(misses, **kwargs)
+        evaluated = {}
+        for job, result in zip(misses, results):
+            solution = result.solution
+            evaluated[id(job)] = result
+            fidelity = getattr(solution, 'fidelity', None)
+            if solution.evaluated and (fidelity is None or
+                                       fidelity == self.full_fidelity) and \
+                    not getattr(solution, 'failed', False):
+                self.cache.put(list(solution.variables),
+                               solution.objectives[:], solution.constraints[:])
+        for job, original in duplicates:
+            solution = evaluated[id(original)].solution
+            set_solution_result(job.solution, solution.objectives[:],
+                                solution.constraints[:])
+            # Keep the marks of screened-out, rejected or failed solutions
+            for attr in ('fidelity', 'rejected', 'screened',
+                         'screened_objectives', 'failed',
+                         'constraint_violation', 'feasible'):
+                if hasattr(solution, attr):
+                    setattr(job.solution, attr, getattr(solution, attr))
+
+        logger.info('Evaluation cache: {} hits, {} misses ({} results '
+                    'cached)'.format(self.cache.hits, self.cache.misses,
+                                     len(self.cache)))
+        return [evaluated.get(id(job), job) for job in jobs]
+
+    def close(self):
+        self.evaluator.close()
@@ -0,0 +1,116 @@
+""" This module defines the hierarchical MPI mode of MOEA searches
+
+    MPI_COMM_WORLD is split into groups of ranks. Rank 0 (the master running
+    the MOEA) forms a group of its own and every other group evaluates one
+    solution at a time: the first rank of a group (the group leader) is a
+    worker of the MPI pool and runs Parflow in parallel with a P x Q x R
+    process topology on the cores of its group. The other ranks of a group
+    reserve these cores; they sleep until the search is finished.
+
+    Classes:
+    ---------------------------------
+    EvaluationGroup: splits MPI_COMM_WORLD into evaluation groups and
+                     configures the Parflow runs of a group
+"""
+
+import time
+import logging
+from .parflow.manager import ParflowRunner
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+# Command launching Parflow on the ranks of an evaluation group. {np} is
+# replaced by the number of Parflow processes and {hosts} by the hosts of
+# the ranks of the group (Open MPI syntax; use e.g. "srun -n {np}" with
+# Slurm).
+DEFAULT_LAUNCHER = ('mpirun', '-np', '{np}', '-host', '{hosts}')
+
+# Seconds between two checks of the reserved ranks for the end of a search
+POLL_INTERVAL = 1.0
+
+
+class EvaluationGroup:
+    """ Group of MPI ranks evaluating one solution at a time.
+
+        Attributes:
+        -------------------------
+        ranks_per_evaluation: int
+            number of ranks in each group (except the master's)
+        topology: tuple
+            Parflow process topology (P, Q, R); P * Q * R must not exceed
+            ranks_per_evaluation
+        comm: mpi4py.MPI.Comm
+            communicator of the ranks of this group
+        pool_comm: mpi4py.MPI.Comm
+            communicator of the master and the group leaders, used by the
+            MPI pool (None on other ranks)
+
+        Methods:
+        -------------------------
+        is_leader(self): returns True on the master and the group leaders
+        wait(self): blocks the reserved ranks until the group is released
+        release(self): releases the reserved ranks of the group
+    """
+
+    def __init__(self, ranks_per_evaluation, topology=None, launcher=None):
+        from mpi4py import MPI
+
+        if topology is None:
+            topology = (ranks_per_evaluation, 1, 1)
+        topology = tuple(int(n) for n in topology)
+        if len(topology) != 3 or min(topology) < 1:
+            raise ValueError('The Parflow topology must be three positive '
+                             'integers (P, Q, R), not {}.'.format(topology))
+        nprocs = topology[0] * topology[1] * topology[2]
+        if nprocs > ranks_per_evaluation:
+            raise ValueError('The Parflow topology {} needs {} processes but '
+                             'there are {} ranks per evaluation.'.format(
+                                 topology, nprocs, ranks_per_evaluation))
+        world = MPI.COMM_WORLD
+        rank = world.Get_rank()
+        if (world.Get_size() - 1) % ranks_per_evaluation != 0 or \
+                world.Get_size() - 1 < ranks_per_evaluation:
+            raise ValueError('The number of MPI ranks ({}) must be one '
+                             '(the master) plus a multiple of the number of '
+                             'ranks per evaluation ({}).'.format(
+                                 world.Get_size(), ranks_per_evaluation))
+
+        self.ranks_per_evaluation = ranks_per_evaluation
+        self.topology = topology
+        # The master forms group 0 on its own
+        color = 0 if rank == 0 else (rank - 1) // ranks_per_evaluation + 1
+        self.comm = world.Split(color, rank)
+        self.pool_comm = world.Split(
+            0 if self.is_leader() else MPI.UNDEFINED, rank)
+        if self.pool_comm == MPI.COMM_NULL:
+            self.pool_comm = None
+        hosts = self.comm.allgather(MPI.Get_processor_name())
+
+        if self.is_leader() and rank != 0:
+            if launcher is None:
+                launcher = DEFAULT_LAUNCHER
+            # Parflow runners created by this process run on the group
+            ParflowRunner.default_topology = topology
+            ParflowRunner.default_launcher = tuple(
+                arg.replace('{hosts}', ','.join(hosts[:nprocs]))
+                for arg in launcher)
+            logger.info('Evaluation group {} runs Parflow with topology {} '
+                        'on {}'.format(color, topology,
+                                       ','.join(hosts[:nprocs])))
+
+    def is_leader(self):
+        """ Return True on the master and the group leaders """
+        return self.comm.Get_rank() == 0
+
+    def wait(self):
+        """ Block a reserved rank until its group is released. The rank
+            sleeps between checks so that its core is free for Parflow. """
+        request = self.comm.Ibarrier()
+        while not request.Test():
+            time.sleep(POLL_INTERVAL)
+
+    def release(self):
+        """ Release the reserved ranks of the group (called by the leader
+            once the pool is closed) """
+        self.comm.Ibarrier().Wait()
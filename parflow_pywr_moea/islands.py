@@ -0,0 +1,142 @@
+""" This module defines the island model of MOEA searches
+
+    Searches started with different seeds (e.g. the tasks of a job array)
+    are islands which exchange solutions through a shared directory. Every
+    migration interval, each island writes its non-dominated set to the
+    directory (in the snapshot format, see snapshots.py) and imports the
+    solutions exported by the other islands into its population. The
+    migrants keep their objectives and constraints, so they are not
+    evaluated again.
+
+    Functions:
+    ---------------------------------
+    island_filename(directory, island): returns the export file of an island
+
+    Classes:
+    ---------------------------------
+    MigrationExtension(Extension): exports and imports migrants during a run
+"""
+
+import os
+import glob
+import random
+import logging
+import platypus
+from platypus.algorithms import EpsMOEA
+from platypus.core import nondominated
+from platypus.extensions import Extension
+from .evaluators import set_solution_result
+from .snapshots import save_snapshot, load_snapshot
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+
+def island_filename(directory, island):
+    """ Return the name of the file exporting the migrants of an island """
+    return os.path.join(directory, 'island_{}.npz'.format(island))
+
+
+class MigrationExtension(Extension):
+    """ Platypus extension exchanging non-dominated solutions with the other
+        islands in directory every interval evaluations.
+
+        Migrants are added to the population: generational algorithms
+        (NSGAII, NSGAIII) truncate the enlarged population with the next
+        offspring, and epsilon-MOEAs add them as they add evaluated
+        offspring (to the population and the archive).
+
+        Attributes:
+        -------------------------
+        directory: str
+            directory shared by the islands
+        island: str
+            name of this island (the search name)
+        interval: int
+            number of evaluations between two migrations
+        migrants: int
+            largest number of solutions imported per migration (None for
+            all new solutions of the other islands)
+    """
+
+    def __init__(self, directory, island, interval, migrants=None):
+        super().__init__()
+        self.directory = directory
+        self.island = island
+        self.interval = interval
+        self.migrants = migrants
+        self.filename = island_filename(directory, island)
+        self.last_nfe = None
+        self._imported = set()
+
+    def start_run(self, algorithm):
+        os.makedirs(self.directory, exist_ok=True)
+        self.last_nfe = algorithm.nfe
+
+    def post_step(self, algorithm):
+        if algorithm.nfe - self.last_nfe >= self.interval:
+            self.migrate(algorithm)
+
+    def end_run(self, algorithm):
+        self.export(algorithm)
+
+    def migrate(self, algorithm):
+        """ Export the non-dominated set and import migrants """
+        self.export(algorithm)
+        migrants = self.receive(algorithm.problem)
+        if self.migrants is not None and len(migrants) > self.migrants:
+            migrants = random.sample(migrants, self.migrants)
+        self.inject(algorithm, migrants)
+        self.last_nfe = algorithm.nfe
+        logger.info('Migration after {} evaluations: imported {} '
+                    'solutions'.format(algorithm.nfe, len(migrants)))
+
+    def export(self, algorithm):
+        result = getattr(algorithm, 'result', None) or []
+        solutions = nondominated([s for s in result if s.evaluated])
+        # Solutions returning from other islands are not imported again
+        self._imported.update(tuple(s.variables) for s in solutions)
+        save_snapshot(solutions, self.filename, algorithm.nfe)
+
+    def receive(self, problem):
+        """ Return the solutions exported by the other islands which were
+            not imported before """
+        migrants = []
+        for filename in sorted(glob.glob(island_filename(self.directory,
+                                                         '*'))):
+            if os.path.abspath(filename) == os.path.abspath(self.filename):
+                continue
+            try:
+                snapshot = load_snapshot(filename)
+            except (OSError, ValueError) as error:
+                logger.warning('Could not read migrants from {}: {}'.format(
+                    filename, error))
+                continue
+            variables = snapshot['variables']
+            if len(variables) and variables.shape[1] != problem.nvars:
+                logger.warning('Island {} has {} variables, not {}'.format(
+                    filename, variables.shape[1], problem.nvars))
+                continue
+            for x, f, c in zip(variables, snapshot['objectives'],
+                               snapshot['constraints']):
+                key = tuple(x)
+                if key in self._imported:
+                    continue
+                self._imported.add(key)
+                solution = platypus.Solution(problem)
+                solution.variables[:] = list(x)
+                set_solution_result(solution, list(f), list(c))
+                migrants.append(solution)
+        return migrants
+
+    def inject(self, algorithm, migrants):
+        """ Add migrants to the population (and archive) of algorithm """
+        archive = getattr(algorithm, 'archive', None)
+        for solution in migrants:
+            if isinstance(algorithm, EpsMOEA) and \
+                    len(algorithm.population) >= algorithm.population_size:
+                algorithm._add_to_population(solution)
+            else:
+                algorithm.population.append(solution)
+            if archive is not None:
+                archive.add(solution)
@@ -1,18 +1,35 @@
 """ Defines PlatypusPyretoDB wrapper class inheriting from PlatypusWrapper
-    class and various functions for performing MOEA runs """
+    class and various functions for performing MOEA runs
+
+    The modules of the optional features of a search (autotuning, work
+    queue, checkpoints, snapshots, islands, surrogate, ...) and the database
+    clients are imported by the functions using them, so that a search only
+    imports what it uses.
+"""
 
 import sys
 import os
+import copy
 import uuid
+import itertools
 import logging
 import json
 import datetime
-import requests
+import concurrent.futures
+import numpy as np
 import platypus
-import mongoengine as me
-from pyreto_db import documents
 from .recorders import PyretoDBRequestRecorder, PyretoDBDirectRecorder, \
                        PyretoDBJSONRecorder
+# Import registers ScenarioBatchParameter used in batched models
+from .parameters import ScenarioBatchParameter
+from .evaluators import ScenarioBatchEvaluator, MultiFidelityEvaluator, \
+                        PrescreenEvaluator, SurrogateTrainingEvaluator, \
+                        NestedEvaluator, CachingEvaluator
+from .warmup import warm_up, warm_up_parflow, WarmProcessPoolEvaluator
+from .asynchronous import AsynchronousEpsMOEA, ProcessDispatcher, \
+                          MPIDispatcher, SpeculativeEvaluator
+from .variators import default_variator
+from .parflow.pywr_parameters import ParflowRunnerParameter
 from pywr.optimisation.platypus import PlatypusWrapper
 from platypus.core import nondominated_sort
 from platypus.core import nondominated
@@ -20,6 +37,26 @@ from platypus.core import nondominated
 # instantiate logger for logging errors, warnings and other communication
 logger = logging.getLogger(__name__)
 
+# Name of the Pywr scenario onto which batched control-curve candidates are
+# mapped
+BATCH_SCENARIO = 'moea_batch'
+
+# Batched Pywr models cached in each process and keyed by the wrapper's uid
+# (same approach as the model cache in pywr.optimisation)
+_BATCH_MODEL_CACHE = {}
+
+
+def pop_prescreen_flags(data):
+    """ Return a copy of the model definition without the "prescreen" flags
+        of its recorders (they are not Pywr keys) and a dictionary mapping
+        the names of the flagged recorders to their flags """
+    data = copy.deepcopy(data)
+    flags = {}
+    for name, recorder in data.get('recorders', {}).items():
+        if isinstance(recorder, dict) and 'prescreen' in recorder:
+            flags[name] = bool(recorder.pop('prescreen'))
+    return data, flags
+
 
 class PlatypusPyretoDBWrapper(PlatypusWrapper):
     """ Wrapper Class for Platypus Wrapper adding communication (Recorder)
@@ -28,19 +65,69 @@ class PlatypusPyretoDBWrapper(PlatypusWrapper):
         ------------------------------------
         customise_model(self,model): instantiatetes a recorder based on the
                                      type of protocol specified
+        landuse_key(self, variables): returns the landuse (integer) part of
+                                      a decision vector
+        make_batch_model(self): creates a copy of the model in which the
+                                control-curve variables vary along a batch
+                                scenario
+        evaluate_batch(self, batch): evaluates decision vectors sharing one
+                                     landuse vector in a single model run
+        make_fidelity_json(self, level): returns the model definition of a
+                                         lower fidelity level
+        fidelity_wrapper(self, level): returns the wrapper of the model of a
+                                       lower fidelity level
+        evaluate_fidelity(self, variables, level): evaluates a decision
+                                                   vector at a fidelity level
+        prescreen(self, recorder): returns True if the recorder does not
+                                   need the model run
+        prescreen_indices(self): returns the indices of objectives and
+                                 constraints which do not need Parflow
+        evaluate_prescreen(self, variables): evaluates only the objectives and
+                                             constraints which do not need
+                                             Parflow
+        landuse_problem(self): returns the Platypus problem of the landuse
+                               (integer) variables used by nested searches
+        evaluate_nested(self, landuse, inner): optimises the control curves
+                                               of a landuse design with Pywr
+                                               only and returns the inner
+                                               Pareto set
+
+        fidelity_levels is a list of lower fidelity levels (lowest first),
+        each a dictionary with the fraction of the simulated period to run
+        ("horizon") and pfset keys overriding the Parflow script
+        ("parflow_keys"), e.g. a larger TimeStep.Value or looser
+        solver tolerances. The full model is the last level.
+
+        A recorder with "prescreen": true in the model definition is
+        evaluated by evaluate_prescreen (its values must depend only on the
+        decision variables, not on the simulation); "prescreen": false
+        excludes it. Without the flag the PARFLOW_INDEPENDENT attribute of
+        the recorder's class is used.
     """
-    def __init__(self, *args, **kwargs):
+    def __init__(self, pywr_model_json, *args, **kwargs):
         self.search_id = kwargs.pop('search_id')
         # define how optimization results are stored (mongodb, http or files)
         self.pyreto_url = kwargs.pop('url', None)
         self.pyreto_db = kwargs.pop('db', None)
-        super().__init__(*args, **kwargs)
+        # maximum number of candidates evaluated in one batched model run
+        self.batch_size = kwargs.pop('batch_size', None)
+        # lower fidelity levels used to screen candidates (lowest first)
+        self.fidelity_levels = kwargs.pop('fidelity_levels', None) or []
+        # recorders flagged for (or excluded from) pre-screening
+        pywr_model_json, self.prescreen_flags = \
+            pop_prescreen_flags(pywr_model_json)
+        super().__init__(pywr_model_json, *args, **kwargs)
+        self._fidelity_wrappers = {}
 
     def customise_model(self, model):
         """ Instantiates a PyWr recorder based on the value of self.pyreto_url
         """
+        batched = BATCH_SCENARIO in [s.name for s in model.scenarios.scenarios]
         if self.pyreto_url is not None:
             protocol = self.pyreto_url.split(':')[0]
+            if batched and not protocol.startswith('file'):
+                raise ValueError('Scenario batching is only supported when '
+                                 'saving results to files.')
             # Instantiate a recorder based on the type of url provided
             # Results can be written into: a mongodb database, into the server
             # using http, or into files
@@ -51,12 +138,309 @@ class PlatypusPyretoDBWrapper(PlatypusWrapper):
                 PyretoDBRequestRecorder(model, search_id=self.search_id,
                                         url=self.pyreto_url, db=self.pyreto_db)
             elif protocol.startswith('file'):
-                PyretoDBJSONRecorder(model, search_id=self.search_id,
-                                     url=self.pyreto_url, db=self.pyreto_db)
+                PyretoDBJSONRecorder(
+                    model, search_id=self.search_id, url=self.pyreto_url,
+                    db=self.pyreto_db,
+                    batch_scenario=BATCH_SCENARIO if batched else None)
             else:
                 raise ValueError(
                     'Protocol "{}" not supported.'.format(protocol))
 
+    def _variable_slices(self):
+        """ Yield each model variable with its slice of the decision vector """
+        for ivar, var in enumerate(self.model_variables):
+            yield var, slice(self.model_variable_map[ivar],
+                             self.model_variable_map[ivar+1])
+
+    def landuse_key(self, variables):
+        """ Return the rounded integer (landuse) variables of a decision
+            vector as a tuple """
+        key = []
+        for var, j in self._variable_slices():
+            if var.integer_size > 0:
+                x = np.array(variables[j])[-var.integer_size:]
+                key.extend(int(v) for v in np.round(x))
+        return tuple(key)
+
+    def make_batch_model(self):
+        """ Create a copy of the model with a batch scenario of size
+            batch_size. Each double (control-curve) variable is replaced by
+            a ScenarioBatchParameter so that every scenario of the batch
+            evaluates a different candidate. """
+        data = copy.deepcopy(self.pywr_model_json)
+        if data.get('scenarios'):
+            raise ValueError('Scenario batching requires a model without '
+                             'scenarios.')
+        data['scenarios'] = [
+            {'name': BATCH_SCENARIO, 'size': self.batch_size}]
+
+        for var in self.model_variables:
+            if var.double_size == 0:
+                continue
+            param = data['parameters'].get(var.name)
+            if var.double_size != 1 or param is None or \
+                    not param['type'].lower().startswith('constant'):
+                raise ValueError('Variable "{}" can not be batched. Only '
+                                 'constant parameters are supported.'
+                                 .format(var.name))
+            data['parameters'][var.name] = {
+                'type': 'scenariobatch',
+                'scenario': BATCH_SCENARIO,
+                'values': [param.get('value', 0.0)] * self.batch_size,
+                'lower_bounds': param.get('lower_bounds', 0.0),
+                'upper_bounds': param.get('upper_bounds', np.inf),
+                'is_variable': True,
+            }
+
+        model = self.pywr_model_klass.load(data, **self.pywr_model_kwargs)
+        self.customise_model(model)
+        model.setup()
+        return model
+
+    @property
+    def batch_model(self):
+        try:
+            model = _BATCH_MODEL_CACHE[self.uid]
+        except KeyError:
+            model = self.make_batch_model()
+            _BATCH_MODEL_CACHE[self.uid] = model
+        return model
+
+    def evaluate_batch(self, batch):
+        """ Evaluate a list of decision vectors sharing the same landuse
+            vector in one run of the batched model. Returns a list of
+            (objectives, constraints) tuples, one for each decision vector.
+        """
+        if len(batch) > self.batch_size:
+            raise ValueError('Batch of {} solutions exceeds the batch size '
+                             '({}).'.format(len(batch), self.batch_size))
+        if len(set(self.landuse_key(v) for v in batch)) != 1:
+            raise ValueError('All solutions in a batch must share the same '
+                             'landuse vector.')
+        logger.info('Evaluating batch of {} solutions ...'.format(len(batch)))
+        model = self.batch_model
+        nbatch = len(batch)
+
+        for var, j in self._variable_slices():
+            x = np.array([variables[j] for variables in batch])
+            batch_var = model.parameters[var.name]
+            if var.double_size > 0:
+                # Unused members of the batch repeat the first candidate
+                batch_var.batch_values[:nbatch] = x[:, 0]
+                batch_var.batch_values[nbatch:] = x[0, 0]
+            if var.integer_size > 0:
+                ints = np.round(x[0, -var.integer_size:]).astype(np.int32)
+                batch_var.set_integer_variables(ints)
+
+        for recorder in model.recorders:
+            if isinstance(recorder, PyretoDBJSONRecorder):
+                recorder.active_members = nbatch
+
+        self.run_stats = model.run()
+
+        results = []
+        for member in range(nbatch):
+            objectives = []
+            for r in self.model_objectives:
+                sign = 1.0 if r.is_objective == 'minimise' else -1.0
+                value = np.array(model.recorders[r.name].values())[member]
+                objectives.append(sign * value)
+
+            constraints = []
+            for c in self.model_constraints:
+                x = np.array(model.recorders[c.name].values())[member]
+                if c.is_double_bounded_constraint:
+                    constraints.extend([x, x])
+                else:
+                    constraints.append(x)
+            results.append((objectives, constraints))
+        return results
+
+    @property
+    def num_fidelities(self):
+        """ Number of fidelity levels including the full model """
+        return len(self.fidelity_levels) + 1
+
+    def make_fidelity_json(self, level):
+        """ Return a copy of the model definition for the fidelity level. The
+            Pywr run ends after the fraction "horizon" of its time steps and
+            the Parflow runs are shortened by the same number of hours and
+            use the level's "parflow_keys". """
+        spec = self.fidelity_levels[level]
+        data = copy.deepcopy(self.pywr_model_json)
+        index = self.model.timestepper.datetime_index
+        nsteps = max(int(np.ceil(spec.get('horizon', 1.0) * len(index))), 1)
+        data['timestepper']['end'] = index[nsteps-1].strftime('%Y-%m-%d')
+        shorten_hours = (index[-1].start_time -
+                         index[nsteps-1].start_time).total_seconds() / 3600
+        for param in data['parameters'].values():
+            if isinstance(param, dict) and \
+                    param.get('type', '').lower() == 'parflowrunner':
+                param['parflow_keys'] = dict(param.get('parflow_keys', {}),
+                                             **spec.get('parflow_keys', {}))
+                param['shorten_hours'] = shorten_hours
+        return data
+
+    def fidelity_wrapper(self, level):
+        """ Return the wrapper evaluating the model of a lower fidelity level.
+            Results of screening runs are not saved. """
+        try:
+            return self._fidelity_wrappers[level]
+        except KeyError:
+            wrapper = PlatypusPyretoDBWrapper(
+                self.make_fidelity_json(level), search_id=self.search_id,
+                uid='{}-fidelity{}'.format(self.uid, level))
+            self._fidelity_wrappers[level] = wrapper
+            return wrapper
+
+    def evaluate_fidelity(self, variables, level):
+        """ Evaluate a decision vector at a fidelity level (the full model if
+            level is the last level). Returns objectives and constraints. """
+        if level >= len(self.fidelity_levels):
+            wrapper = self
+        else:
+            wrapper = self.fidelity_wrapper(level)
+        logger.info('Evaluating solution at fidelity level {} ...'.format(
+            level))
+        results = wrapper.evaluate(variables)
+        if self.model_constraints:
+            return results
+        return results, []
+
+    def prescreen(self, recorder):
+        """ Return True if the recorder is evaluated before the model runs:
+            its "prescreen" flag, or PARFLOW_INDEPENDENT of its class """
+        return self.prescreen_flags.get(
+            recorder.name, getattr(recorder, 'PARFLOW_INDEPENDENT', False))
+
+    def prescreen_indices(self):
+        """ Return the indices of objectives and of (Platypus) constraints
+            whose recorders can be evaluated without running the model (see
+            prescreen) """
+        objectives = [i for i, r in enumerate(self.model_objectives)
+                      if self.prescreen(r)]
+        constraints = []
+        ic = 0
+        for c in self.model_constraints:
+            size = 2 if c.is_double_bounded_constraint else 1
+            if self.prescreen(c):
+                constraints.extend(range(ic, ic + size))
+            ic += size
+        return objectives, constraints
+
+    def evaluate_prescreen(self, variables):
+        """ Evaluate the Parflow-independent objectives and constraints of a
+            decision vector without running the model. Returns dictionaries
+            mapping objective and constraint indices to values. """
+        for var, j in self._variable_slices():
+            x = np.array(variables[j])
+            if var.double_size > 0:
+                var.set_double_variables(x[:var.double_size])
+            if var.integer_size > 0:
+                ints = np.round(x[-var.integer_size:]).astype(np.int32)
+                var.set_integer_variables(ints)
+
+        objective_indices, constraint_indices = self.prescreen_indices()
+        objectives = {}
+        for i in objective_indices:
+            r = self.model_objectives[i]
+            sign = 1.0 if r.is_objective == 'minimise' else -1.0
+            objectives[i] = sign * r.aggregated_value()
+
+        constraints = {}
+        ic = 0
+        for c in self.model_constraints:
+            size = 2 if c.is_double_bounded_constraint else 1
+            if ic in constraint_indices:
+                x = c.aggregated_value()
+                for k in range(size):
+                    constraints[ic + k] = x
+            ic += size
+        return objectives, constraints
+
+    def _double_indices(self):
+        """ Return the indices of the double (control-curve) variables """
+        indices = []
+        for var, j in self._variable_slices():
+            indices.extend(range(j.start, j.start + var.double_size))
+        return indices
+
+    def _integer_indices(self):
+        """ Return the indices of the integer (landuse) variables """
+        indices = []
+        for var, j in self._variable_slices():
+            indices.extend(range(j.stop - var.integer_size, j.stop))
+        return indices
+
+    def landuse_problem(self):
+        """ Return a Platypus problem over the landuse (integer) variables
+            only, with the objectives and constraints of the full problem.
+            Its solutions are evaluated with NestedEvaluator. """
+        if not self._double_indices():
+            raise ValueError('A nested search requires control-curve '
+                             '(double) variables.')
+        indices = self._integer_indices()
+        problem = platypus.Problem(len(indices), self.problem.nobjs,
+                                   self.problem.nconstrs)
+        problem.types[:] = [self.problem.types[i] for i in indices]
+        problem.constraints[:] = list(self.problem.constraints)
+        problem.wrapper = self
+        return problem
+
+    def full_vector(self, landuse, curves):
+        """ Combine landuse and control-curve variables into a decision vector
+            of the full problem """
+        variables = [0.0] * self.problem.nvars
+        for i, x in zip(self._integer_indices(), landuse):
+            variables[i] = x
+        for i, x in zip(self._double_indices(), curves):
+            variables[i] = x
+        return variables
+
+    def evaluate_nested(self, landuse, inner):
+        """ Optimise the control curves of the landuse design with Pywr only.
+            Parflow runs once and its outputs are reused for all inner
+            evaluations. inner is a dictionary with either "grid" (number of
+            values of each control-curve variable) or the "evaluations" and
+            "population_size" of an inner NSGA-II search.
+
+            Returns the Pareto set of the inner search as a list of (decision
+            vector, objectives, constraints) tuples. """
+        indices = self._double_indices()
+        problem = platypus.Problem(len(indices), self.problem.nobjs,
+                                   self.problem.nconstrs)
+        problem.types[:] = [self.problem.types[i] for i in indices]
+        problem.constraints[:] = list(self.problem.constraints)
+        problem.function = lambda curves: self.evaluate(
+            self.full_vector(landuse, curves))
+
+        runners = [p for p in self.model.parameters
+                   if isinstance(p, ParflowRunnerParameter)]
+        for runner in runners:
+            runner.reuse_outputs = True
+        try:
+            if 'grid' in inner:
+                solutions = []
+                axes = [np.linspace(t.min_value, t.max_value, inner['grid'])
+                        for t in problem.types]
+                for curves in itertools.product(*axes):
+                    solution = platypus.Solution(problem)
+                    solution.variables[:] = list(curves)
+                    solution.evaluate()
+                    solutions.append(solution)
+            else:
+                algorithm = platypus.NSGAII(
+                    problem, population_size=inner.get('population_size', 20))
+                algorithm.run(inner.get('evaluations', 200))
+                solutions = algorithm.result
+        finally:
+            for runner in runners:
+                runner.release()
+                runner.reuse_outputs = False
+
+        return [(self.full_vector(landuse, s.variables), s.objectives[:],
+                 s.constraints[:]) for s in nondominated(solutions)]
+
 
 def create_new_search(**kwargs):
     """ Instantiates an environment for performing MOEA runs and returns
@@ -82,6 +466,8 @@ def create_new_search(**kwargs):
 
 def _create_new_search_direct(drop=True, **kwargs):
     """ Saves search results in **kwargs to a MongoDB database """
+    import mongoengine as me
+    from pyreto_db import documents
     url = kwargs.pop('url')
     db = kwargs.pop('db')
     client = me.connect(host=url, db=db)
@@ -104,6 +490,7 @@ def _create_new_search_direct(drop=True, **kwargs):
 def _create_new_search_request(**kwargs):
     """ Saves search results in **kwargs to a JSON file over via HTTP
         using requests Python library """
+    import requests
     url = kwargs.pop('url')
     db = kwargs.pop('db')
     drop = kwargs.pop('drop', None)
@@ -140,125 +527,574 @@ def _create_new_search_json(**kwargs):
     return search_id
 
 
-def platypus_main(search_name, data, seed, algorithm_class,
-                  mongo_url=None, mongo_db=None, drop=False, extra_tags=None,
-                  no_evals=1, no_threads=4, **algorithm_kwargs):
-    """ Function to run MOEA without MPI
-        data - dictionary containing json data describing Pywr model
+def record_search_configuration(configuration, url, db, search_id):
+    """ Add the configuration chosen for a search to its search.json file
+        (only for searches saved to files) """
+    if url is None or not url.startswith('file'):
+        logger.info('Search configuration: {}'.format(configuration))
+        return
+    fn = os.path.join(url.split('://', 1)[1], db, search_id, 'search.json')
+    with open(fn) as fh:
+        search = json.load(fh)
+    search['configuration'] = configuration
+    with open(fn, mode='w') as fh:
+        json.dump(search, fh)
+
+
+def _autotune(data, wrapper, cores, autotune, url=None, db=None,
+              search_id=None):
+    """ Calibrate the concurrency on a copy of the model which does not save
+        results, configure the Parflow runs of wrapper and record the
+        configuration. Returns the number of concurrent evaluations. """
+    from .autotune import calibrate, configure_parflow
+    calibration_wrapper = PlatypusPyretoDBWrapper(copy.deepcopy(data),
+                                                  search_id=None)
+    configuration = calibrate(calibration_wrapper, cores,
+                              autotune.get('rounds', 1),
+                              autotune.get('max_memory', 0.9),
+                              autotune.get('launcher'))
+    topology = tuple(configuration['topology']) \
+        if configuration['cores_per_run'] > 1 else None
+    configure_parflow(wrapper.model, topology, configuration['launcher'])
+    record_search_configuration(configuration, url, db, search_id)
+    return configuration['concurrency']
+
+
+def _fidelity_levels(fidelity):
+    """ Return the lower fidelity levels of a fidelity schedule """
+    if fidelity is None:
+        return None
+    return fidelity['levels']
+
+
+def _wrap_evaluator(evaluator, wrapper, batch_size=None, fidelity=None,
+                    prescreen=None, cache=None):
+    """ Wrap the evaluator for scenario batching, multi-fidelity screening,
+        memoisation of evaluated decision vectors and pre-screening on
+        Parflow-independent objectives """
+    if batch_size is not None and fidelity is not None:
+        raise ValueError('Scenario batching can not be combined with '
+                         'multi-fidelity evaluation.')
+    if batch_size is not None:
+        evaluator = ScenarioBatchEvaluator(evaluator, wrapper, batch_size)
+    if fidelity is not None:
+        evaluator = MultiFidelityEvaluator(
+            evaluator, wrapper,
+            promote_fraction=fidelity.get('promote_fraction', 0.0),
+            screen_evaluations=fidelity.get('screen_evaluations', None))
+    if cache is not None:
+        if isinstance(cache, str):
+            from .cache import EvaluationCache
+            cache = EvaluationCache.from_wrapper(wrapper, filename=cache)
+        full_fidelity = None if fidelity is None else \
+            wrapper.num_fidelities - 1
+        evaluator = CachingEvaluator(evaluator, cache,
+                                     full_fidelity=full_fidelity)
+    if prescreen is not None:
+        evaluator = PrescreenEvaluator(evaluator, wrapper,
+                                       epsilons=prescreen.get('epsilons'))
+    return evaluator
+
+
+def _add_surrogate(evaluator, wrapper, surrogate, algorithm_kwargs):
+    """ Set up surrogate pre-screening of offspring: the algorithm's
+        variator is wrapped in a SurrogateVariator and the evaluator trains
+        the surrogate. Returns the evaluator. """
+    if surrogate is None:
+        return evaluator
+    from .surrogate import Surrogate
+    from .variators import SurrogateVariator
+    model = Surrogate.from_wrapper(
+        wrapper, regressor=surrogate.get('regressor', 'ridge'),
+        min_samples=surrogate.get('min_samples', 20))
+    variator = algorithm_kwargs.get('variator') or \
+        default_variator(wrapper.problem)
+    variator = SurrogateVariator(variator, model, surrogate['fraction'])
+    algorithm_kwargs['variator'] = variator
+    return SurrogateTrainingEvaluator(
+        evaluator, model, variator=variator,
+        report_every=algorithm_kwargs.get('population_size', 1))
+
+
+def _add_unique(problem, unique, algorithm_kwargs):
+    """ Wrap the algorithm's variator in a UniqueVariator so that offspring
+        duplicating earlier decision vectors are resampled """
+    if unique is None:
+        return
+    from .cache import EvaluationCache
+    from .variators import UniqueVariator
+    wrapper = problem.wrapper
+    if problem is wrapper.problem:
+        key = EvaluationCache.from_wrapper(wrapper).key
+    else:
+        # Landuse problem of a nested search
+        key = EvaluationCache(range(problem.nvars)).key
+    variator = algorithm_kwargs.get('variator') or \
+        default_variator(problem)
+    algorithm_kwargs['variator'] = UniqueVariator(
+        variator, key, max_retries=unique.get('max_retries', 10),
+        report_every=algorithm_kwargs.get('population_size'))
+
+
+def _asynchronous_kwargs(dispatcher, wrapper, batch_size, fidelity,
+                         prescreen, surrogate, nested, cache,
+                         algorithm_kwargs, telemetry=None):
+    """ Set up the keyword arguments of AsynchronousEpsMOEA, which
+        dispatches single solutions instead of using an evaluator """
+    if any(option is not None for option in
+           (batch_size, fidelity, prescreen, surrogate, nested)):
+        raise ValueError('Asynchronous evaluation can only be combined with '
+                         'the evaluation cache and duplicate-free '
+                         'offspring.')
+    if isinstance(cache, str):
+        from .cache import EvaluationCache
+        cache = EvaluationCache.from_wrapper(wrapper, filename=cache)
+    algorithm_kwargs['dispatcher'] = dispatcher
+    algorithm_kwargs['cache'] = cache
+    algorithm_kwargs['telemetry'] = telemetry
+
+
+def _add_telemetry(evaluator, telemetry):
+    """ Record the metrics of the jobs evaluated by evaluator (which must be
+        the evaluator of the process or MPI pool) """
+    if telemetry is None:
+        return evaluator
+    from .telemetry import TelemetryEvaluator
+    return TelemetryEvaluator(evaluator, telemetry)
+
+
+def _setup_checkpoint(algorithm, search_name, checkpoint_interval=None,
+                      resume=False):
+    """ Restore the algorithm from the checkpoint of the search (if resume)
+        and save checkpoints every checkpoint_interval evaluations """
+    if not resume and checkpoint_interval is None:
+        return
+    from .checkpoint import CheckpointExtension, checkpoint_filename, \
+        load_checkpoint
+    filename = checkpoint_filename(search_name)
+    if resume:
+        if os.path.exists(filename):
+            load_checkpoint(algorithm, filename)
+        else:
+            logger.warning('No checkpoint {} found, starting a new '
+                           'search.'.format(filename))
+    if checkpoint_interval is not None:
+        algorithm.add_extension(
+            CheckpointExtension(filename, checkpoint_interval))
+
+
+def _add_snapshots(algorithm, search_name, snapshots, evaluator):
+    """ Write snapshots of the non-dominated archive of the search every
+        snapshots["interval"] evaluations """
+    if snapshots is None:
+        return
+    from .snapshots import ArchiveSnapshotExtension, snapshot_filename
+    source = None
+    if isinstance(evaluator, NestedEvaluator):
+        # Solutions of the full problem from the inner searches
+        source = lambda: evaluator.archive
+    algorithm.add_extension(ArchiveSnapshotExtension(
+        snapshot_filename(search_name), snapshots['interval'],
+        epsilons=snapshots.get('epsilons'), source=source))
+
+
+def _add_islands(algorithm, search_name, islands):
+    """ Exchange migrants with the other islands in islands["directory"]
+        every islands["interval"] evaluations """
+    if islands is None:
+        return
+    from .islands import MigrationExtension
+    algorithm.add_extension(MigrationExtension(
+        islands['directory'], search_name, islands['interval'],
+        migrants=islands.get('migrants')))
+
+
+class SearchOptions:
+    """ Options of a MOEA search shared by platypus_main and
+        platypus_main_mpi. Each option is documented once here; the
+        evaluation and feature options are disabled (None) by default.
+
+        Attributes:
+        -------------------------
+        mongo_url, mongo_db: str
+            url and database of the pyreto database in which the search and
+            its results are saved (not saved if mongo_url is None)
+        drop: bool
+            if True, the database is dropped when the search is created
+        extra_tags: list
+            tags added to the search in the database
+        no_evals: int
+            number of evaluations of the search
+        no_threads: int
+            number of worker processes (platypus_main only)
+        batch_size: int
+            solutions sharing a landuse vector are evaluated in batches of
+            up to batch_size Pywr scenarios
+        fidelity: dict
+            the lower fidelity "levels" and the options of
+            MultiFidelityEvaluator ("promote_fraction",
+            "screen_evaluations")
+        prescreen: dict
+            the options of PrescreenEvaluator ("epsilons"); solutions are
+            rejected on their Parflow-independent objectives and constraints
+            before Parflow runs
+        surrogate: dict
+            the "fraction" of offspring evaluated after surrogate screening
+            and optionally the "regressor" ('ridge' or 'knn') and
+            "min_samples"
+        nested: dict
+            the MOEA searches over landuse designs only and each design is
+            evaluated by an inner control-curve search configured by this
+            dictionary (see PlatypusPyretoDBWrapper.evaluate_nested); the
+            other evaluation options are not used
+        cache: str or EvaluationCache
+            file name (or EvaluationCache) in which results are memoised;
+            duplicate decision vectors are not evaluated again, including
+            those evaluated in earlier runs using the same file
+        unique: dict
+            the "max_retries" of UniqueVariator; offspring duplicating
+            earlier decision vectors are resampled
+        speculative: dict
+            the "straggler_factor" and "min_completed" options of
+            SpeculativeEvaluator; straggling evaluations are re-executed on
+            idle workers
+        checkpoint_interval: int
+            the state of the algorithm is saved to
+            checkpoint_<search_name>.pkl every checkpoint_interval
+            evaluations
+        resume: bool
+            if True, the search continues from its checkpoint; no_evals is
+            the total number of evaluations including those done before the
+            checkpoint
+        snapshots: dict
+            the "interval" (number of evaluations) at which the
+            non-dominated archive is written to archive_<search_name>.npz
+            and optionally the "epsilons" of an epsilon-box archive
+        metrics_interval: float
+            search telemetry (evaluation rate, latencies, worker
+            utilisation, cache hit rate) is appended to
+            metrics_<search_name>.jsonl every metrics_interval seconds
+        islands: dict
+            the shared "directory" of an island model, the migration
+            "interval" (number of evaluations) and optionally the largest
+            number of "migrants" imported per migration; the search
+            exchanges its non-dominated solutions with the other searches
+            (islands) using the same directory
+        ranks_per_evaluation: int
+            the ranks other than the master are split into groups of this
+            many ranks, each evaluating one solution with Parflow running in
+            parallel (platypus_main_mpi only)
+        topology: tuple
+            the process topology (P, Q, R) of these Parflow runs (default
+            (ranks_per_evaluation, 1, 1))
+        launcher: list
+            the command launching these Parflow runs (see
+            hierarchical.DEFAULT_LAUNCHER)
+        autotune: dict
+            the options of autotune.calibrate ("rounds", "max_memory",
+            "launcher"); the number of concurrent evaluations and the cores
+            of each Parflow run sharing no_threads cores are chosen by a
+            calibration on the model and recorded in the search
+            (platypus_main only)
+        queue: str
+            file name of a WorkQueue; solutions are evaluated by the workers
+            pulling jobs from the queue (started with "parflow-pywr
+            worker") instead of a process pool (platypus_main only)
     """
-    # from pudb import set_trace; set_trace()
-    #for key, value in algorithm_kwargs.items():
-    #    print(key, value)
-
-    # If the url to a Mongo database is provided
-    if mongo_url is not None:
-        tags = ['platypus', algorithm_class.__name__]
-        if extra_tags is not None:
-            tags.extend(extra_tags)
-        print("Mongo host is :" + mongo_url)  # Line added by Andrew Slaughter
-        search_id = create_new_search(
-            name=search_name, algorithm=algorithm_class.__name__,
-            tags=tags, drop=drop, url=mongo_url, db=mongo_db)
-        logger.info('Created a new search in the pyreto database with id: \
-                    {}'.format(search_id))
+
+    DEFAULTS = {
+        'mongo_url': None,
+        'mongo_db': None,
+        'drop': False,
+        'extra_tags': None,
+        'no_evals': 1,
+        'no_threads': 4,
+        'batch_size': None,
+        'fidelity': None,
+        'prescreen': None,
+        'surrogate': None,
+        'nested': None,
+        'cache': None,
+        'unique': None,
+        'speculative': None,
+        'checkpoint_interval': None,
+        'resume': False,
+        'snapshots': None,
+        'metrics_interval': None,
+        'islands': None,
+        'ranks_per_evaluation': None,
+        'topology': None,
+        'launcher': None,
+        'autotune': None,
+        'queue': None,
+    }
+
+    # Options used only without MPI / only with MPI
+    PROCESS_POOL_OPTIONS = ('autotune', 'queue')
+    MPI_OPTIONS = ('ranks_per_evaluation', 'topology', 'launcher')
+
+    def __init__(self, **options):
+        unknown = set(options) - set(self.DEFAULTS)
+        if unknown:
+            raise TypeError('Unknown search options: {}'.format(
+                ', '.join(sorted(unknown))))
+        for name, default in self.DEFAULTS.items():
+            setattr(self, name, options.get(name, default))
+
+    def check(self, mpi):
+        """ Raise a ValueError if an option of the other entry point (with
+            or without MPI) is set """
+        names = self.PROCESS_POOL_OPTIONS if mpi else self.MPI_OPTIONS
+        used = [name for name in names if getattr(self, name) is not None]
+        if used:
+            raise ValueError('Options {} can not be used {} MPI.'.format(
+                ', '.join(used), 'with' if mpi else 'without'))
+
+
+def _create_search(search_name, algorithm_class, options, default=None):
+    """ Create the search in the pyreto database (if options.mongo_url is
+        given) and return its id (default otherwise) """
+    if options.mongo_url is None:
+        return default
+    tags = ['platypus', algorithm_class.__name__]
+    if options.extra_tags is not None:
+        tags.extend(options.extra_tags)
+    print("Mongo host is :" + options.mongo_url)  # Line added by Andrew Slaughter
+    search_id = create_new_search(
+        name=search_name, algorithm=algorithm_class.__name__, tags=tags,
+        drop=options.drop, url=options.mongo_url, db=options.mongo_db)
+    logger.info('Created a new search in the pyreto database with id: \
+                {}'.format(search_id))
+    return search_id
+
+
+def _make_wrapper(data, search_id, options):
+    """ Instantiate the PlatypusPyretoDBWrapper of the search """
+    return PlatypusPyretoDBWrapper(
+        data, search_id=search_id, url=options.mongo_url,
+        db=options.mongo_db, batch_size=options.batch_size,
+        fidelity_levels=_fidelity_levels(options.fidelity))
+
+
+def _build_evaluator(evaluator, wrapper, algorithm_class, algorithm_kwargs,
+                     dispatcher, options, cache=None, telemetry=None):
+    """ Wrap evaluator (of the process pool, MPI pool or work queue) for the
+        evaluation options of the search, or set up the dispatcher of
+        AsynchronousEpsMOEA (dispatcher() returns the dispatcher to use if
+        evaluator has none). Returns the evaluator and the problem solved by
+        the algorithm. """
+    if issubclass(algorithm_class, AsynchronousEpsMOEA):
+        _asynchronous_kwargs(
+            getattr(evaluator, 'dispatcher', None) or dispatcher(), wrapper,
+            options.batch_size, options.fidelity, options.prescreen,
+            options.surrogate, options.nested, cache, algorithm_kwargs,
+            telemetry)
+        problem = wrapper.problem
+    elif options.nested is not None:
+        evaluator = NestedEvaluator(_add_telemetry(evaluator, telemetry),
+                                    wrapper, options.nested)
+        problem = wrapper.landuse_problem()
     else:
-        search_id = None
+        evaluator = _wrap_evaluator(_add_telemetry(evaluator, telemetry),
+                                    wrapper, options.batch_size,
+                                    options.fidelity, options.prescreen,
+                                    cache)
+        evaluator = _add_surrogate(evaluator, wrapper, options.surrogate,
+                                   algorithm_kwargs)
+        problem = wrapper.problem
+    _add_unique(problem, options.unique, algorithm_kwargs)
+    return evaluator, problem
+
+
+def _build_algorithm(search_name, seed, algorithm_class, algorithm_kwargs,
+                     problem, evaluator, options):
+    """ Instantiate the algorithm (restored from its checkpoint if
+        options.resume) with the extensions of the search options """
+    algorithm = algorithm_class(
+        problem, evaluator=evaluator, **algorithm_kwargs, seed=seed)
+    _setup_checkpoint(algorithm, search_name, options.checkpoint_interval,
+                      options.resume)
+    _add_snapshots(algorithm, search_name, options.snapshots, evaluator)
+    _add_islands(algorithm, search_name, options.islands)
+    return algorithm
 
-    # Instantiate PlatypusPyretoDBWrapper class object
-    wrapper = PlatypusPyretoDBWrapper(
-        data, search_id=search_id, url=mongo_url, db=mongo_db)
+
+def _save_nondominated(search_name, solutions, full_fidelity=None):
+    """ Calculate the final nondominated solutions and objectives and save
+        them into nondom_final_<search_name>.json. With multi-fidelity
+        screening, solutions not evaluated at full_fidelity are left out. """
+    if full_fidelity is not None:
+        full = [s for s in solutions
+                if getattr(s, 'fidelity', full_fidelity) == full_fidelity]
+        if len(full) < len(solutions):
+            logger.info('{} screened-only solutions left out of the final '
+                        'results'.format(len(solutions) - len(full)))
+        solutions = full
+    nondom_sol = nondominated(solutions)
+    nondom_sol_list = []
+    for i in nondom_sol:
+        nondom_sol_list.append(i.variables[:])
+    nondom_obj = (s.objectives[:] for s in nondom_sol)
+    # save nondom_obj list to json file
+    final_json_file = 'nondom_final_' + str(search_name) + '.json'
+    results = {
+        "nondom sol": list(nondom_sol_list),
+        "nondom obj": list(nondom_obj)
+    }
+    with open(final_json_file, 'w') as f:
+        json.dump(results, f)
+
+
+def _run_search(search_name, seed, algorithm_class, algorithm_kwargs,
+                wrapper, evaluator, dispatcher, options):
+    """ Run the search on the master process with evaluator and save its
+        non-dominated solutions (see _build_evaluator for dispatcher) """
+    cache = options.cache
+    if isinstance(cache, str):
+        from .cache import EvaluationCache
+        cache = EvaluationCache.from_wrapper(wrapper, filename=cache)
+    telemetry = None
+    if options.metrics_interval is not None:
+        from .telemetry import Telemetry, metrics_filename
+        telemetry = Telemetry(metrics_filename(search_name),
+                              options.metrics_interval, cache)
+
+    evaluator, problem = _build_evaluator(
+        evaluator, wrapper, algorithm_class, algorithm_kwargs, dispatcher,
+        options, cache, telemetry)
+    algorithm = _build_algorithm(search_name, seed, algorithm_class,
+                                 algorithm_kwargs, problem, evaluator,
+                                 options)
+    algorithm.run(max(options.no_evals - algorithm.nfe, 0))
+    if telemetry is not None:
+        telemetry.write()
+
+    if options.nested is not None:
+        # Solutions of the full problem from the inner searches
+        solutions = evaluator.archive
+    else:
+        solutions = algorithm.result
+    full_fidelity = None if options.fidelity is None else \
+        wrapper.num_fidelities - 1
+    _save_nondominated(search_name, solutions, full_fidelity)
+
+
+def platypus_main(search_name, data, seed, algorithm_class, options=None,
+                  **algorithm_kwargs):
+    """ Function to run MOEA without MPI
+        data - dictionary containing json data describing Pywr model
+        options - SearchOptions of the search (default options if None)
+        algorithm_class - AsynchronousEpsMOEA evaluates solutions
+                          asynchronously (only cache and unique can be
+                          used with it)
+        algorithm_kwargs - keyword arguments of algorithm_class
+    """
+    options = options or SearchOptions()
+    options.check(mpi=False)
+    search_id = _create_search(search_name, algorithm_class, options)
+    wrapper = _make_wrapper(data, search_id, options)
+    no_threads = options.no_threads
+    if options.autotune is not None:
+        no_threads = _autotune(data, wrapper, no_threads, options.autotune,
+                               options.mongo_url, options.mongo_db,
+                               search_id)
 
     # Originally, population size of 47 (hard-coded) and 10000 evaluations (hard-coded)
     # Old piece of code: with platypus.MapEvaluator() as evaluator:
     # Changed to 2 and 1000 (Andrew)
-    evaluator_class = platypus.ProcessPoolEvaluator
-    evaluator_args = (no_threads,)
-    logger.info('Running with multiprocessing on {} cores... '.format(
-                no_threads))
+    evaluator_class = WarmProcessPoolEvaluator
+    evaluator_args = (no_threads, wrapper)
+    if options.queue is not None:
+        from .workqueue import WorkQueue, QueueDispatcher, QueueEvaluator
+        evaluator_class = QueueEvaluator
+        evaluator_args = (WorkQueue(options.queue),)
+        logger.info('Evaluating with the workers of queue {}'.format(
+            options.queue))
+    else:
+        logger.info('Running with multiprocessing on {} cores... '.format(
+                    no_threads))
+        # The worker processes forked from this process share the compiled
+        # base model
+        warm_up_parflow(wrapper.model)
+    if options.speculative is not None:
+        evaluator_class = SpeculativeEvaluator
+        if options.queue is not None:
+            dispatcher = QueueDispatcher(WorkQueue(options.queue))
+        else:
+            dispatcher = ProcessDispatcher(
+                concurrent.futures.ProcessPoolExecutor(
+                    no_threads, initializer=warm_up, initargs=(wrapper,)),
+                no_threads)
+        evaluator_args = (dispatcher,
+                          options.speculative.get('straggler_factor', 2.0),
+                          options.speculative.get('min_completed', 0.5))
     with evaluator_class(*evaluator_args) as evaluator:
-        algorithm = algorithm_class(
-            wrapper.problem, evaluator=evaluator, **algorithm_kwargs,
-            seed=seed)
-        algorithm.run(no_evals)
-
-        # Calculate final nondominated results and objectives and save them
-        # into a text file
-        nondom_sol = nondominated(algorithm.result)
-        nondom_sol_list = []
-        for i in nondom_sol:
-            nondom_sol_list.append(i.variables)
-        nondom_obj = (s.objectives[:] for s in nondom_sol)
-        # save nondom_obj list to json file
-        final_json_file = 'nondom_final_' + str(search_name) + '.json'
-        with open(final_json_file, 'w') as f:
-            json.dump({
-                "nondom sol": list(nondom_sol_list),
-                "nondom obj": list(nondom_obj)
-            }, f)
-
-
-def platypus_main_mpi(search_name, data, seed, algorithm_class,
-                      mongo_url=None, mongo_db=None,
-                      drop=False, extra_tags=None, no_evals=1,
+        _run_search(search_name, seed, algorithm_class, algorithm_kwargs,
+                    wrapper, evaluator,
+                    lambda: ProcessDispatcher(evaluator.executor, no_threads),
+                    options)
+
+
+def platypus_main_mpi(search_name, data, seed, algorithm_class, options=None,
                       **algorithm_kwargs):
     """ Function to run MOEA with MPI
         data - dictionary containing json data describing Pywr model
+        options - SearchOptions of the search (default options if None)
+        algorithm_class - AsynchronousEpsMOEA evaluates solutions
+                          asynchronously (only cache and unique can be
+                          used with it)
+        algorithm_kwargs - keyword arguments of algorithm_class
     """
     from platypus.mpipool import MPIPool
 
-    # Initialize the MPI pool (of parallel processes)
-    pool = MPIPool()
+    options = options or SearchOptions()
+    options.check(mpi=True)
+    ranks_per_evaluation = options.ranks_per_evaluation
+    if ranks_per_evaluation is not None and ranks_per_evaluation > 1:
+        from .hierarchical import EvaluationGroup
+        group = EvaluationGroup(ranks_per_evaluation, options.topology,
+                                options.launcher)
+        if not group.is_leader():
+            # Reserve the cores of this rank for the Parflow runs of the
+            # group leader
+            group.wait()
+            sys.exit(0)
+        pool = MPIPool(comm=group.pool_comm)
+    else:
+        group = None
+        # Initialize the MPI pool (of parallel processes)
+        pool = MPIPool()
     # Parallel computing using distributed memory and processes with MPI
     evaluator_class = platypus.PoolEvaluator
     evaluator_args = (pool,)
 
     if pool.is_master():
-        if mongo_url is not None:
-            tags = ['platypus', algorithm_class.__name__]
-            if extra_tags is not None:
-                tags.extend(extra_tags)
-            print("Mongo host is :" + mongo_url)
-            search_id = create_new_search(
-                name=search_name, algorithm=algorithm_class.__name__,
-                tags=tags, drop=drop, url=mongo_url, db=mongo_db)
-            logger.info('Created a new search in the pyreto database with id: \
-                        {}'.format(search_id))
-        else:
-            search_id = uuid.uuid4().hex
+        search_id = _create_search(search_name, algorithm_class, options,
+                                   default=uuid.uuid4().hex)
     else:
         search_id = None
 
     # Broadcast the search id to all nodes
     search_id = pool.bcast(search_id, root=0)
 
-    # Instantiate PlatypusPyretoDBWrapper class object
-    wrapper = PlatypusPyretoDBWrapper(data, search_id=search_id,
-                                      url=mongo_url, db=mongo_db)
+    wrapper = _make_wrapper(data, search_id, options)
 
     # only run the algorithm on the master process
     if not pool.is_master():
+        warm_up(wrapper)
         pool.wait()
+        if group is not None:
+            group.release()
         sys.exit(0)
 
+    if options.speculative is not None:
+        evaluator_class = SpeculativeEvaluator
+        evaluator_args = (MPIDispatcher(pool),
+                          options.speculative.get('straggler_factor', 2.0),
+                          options.speculative.get('min_completed', 0.5))
+
     with evaluator_class(*evaluator_args) as evaluator:
-        algorithm = algorithm_class(
-            wrapper.problem, evaluator=evaluator, **algorithm_kwargs,
-            seed=seed)
-        algorithm.run(no_evals)
-
-        # Calculate final nondominated results and objectives and save them
-        # into a text file
-        nondom_sol = nondominated(algorithm.result)
-        nondom_sol_list = []
-        for i in nondom_sol:
-            nondom_sol_list.append(i.variables)
-        nondom_obj = (s.objectives[:] for s in nondom_sol)
-        # save nondom_obj list to json file
-        final_json_file = 'nondom_final_' + str(search_name) + '.json'
-        with open(final_json_file, 'w') as f:
-            json.dump({
-                "nondom sol": list(nondom_sol_list),
-                "nondom obj": list(nondom_obj)
-            }, f)
+        _run_search(search_name, seed, algorithm_class, algorithm_kwargs,
+                    wrapper, evaluator, lambda: MPIDispatcher(pool), options)
 
     pool.close()
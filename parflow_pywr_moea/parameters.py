@@ -0,0 +1,70 @@
+""" This module provides custom Pywr parameters that are used by the MOEA
+    wrappers (rather than by the Parflow coupling itself)
+
+    ScenarioBatchParameter(Parameter): constant parameter taking a different
+                                       value in each member of a batch
+                                       scenario
+"""
+import numpy as np
+from pywr.parameters import Parameter
+
+
+class ScenarioBatchParameter(Parameter):
+    """ Class inheriting from Pywr Parameter Class holding one value per
+        member of a (batch) scenario. Used to evaluate several candidate
+        values of a decision variable in a single Pywr model run.
+
+        The parameter reports itself as a variable with double_size of one so
+        that recorders can write the value for each member of the batch.
+
+        Methods:
+        -------------------------------------
+        setup(self): finds the position of the batch scenario in the model
+        value(self, ts, scenario_index): returns the value for the member of
+                                         the batch given in scenario_index
+        load(cls, model, data): loads the parameter from JSON
+    """
+    def __init__(self, model, scenario, values, *args, **kwargs):
+        lower_bounds = kwargs.pop('lower_bounds', 0.0)
+        upper_bounds = kwargs.pop('upper_bounds', np.inf)
+        super().__init__(model, *args, **kwargs)
+        if scenario.size != len(values):
+            raise ValueError('The number of values ({}) must equal the size '
+                             'of the scenario ({}).'.format(len(values),
+                                                            scenario.size))
+        self.scenario = scenario
+        self.batch_values = np.array(values, dtype=np.float64)
+        self.double_size = 1
+        self._lower_bounds = np.array([lower_bounds], dtype=np.float64)
+        self._upper_bounds = np.array([upper_bounds], dtype=np.float64)
+        self._scenario_index = None
+
+    def setup(self):
+        super().setup()
+        self._scenario_index = self.model.scenarios.get_scenario_index(
+            self.scenario)
+
+    def value(self, ts, scenario_index):
+        """ Returns the value for the batch member in scenario_index """
+        # called once per timestep for each scenario
+        return self.batch_values[scenario_index.indices[self._scenario_index]]
+
+    def get_double_variables(self):
+        return self.batch_values[:1]
+
+    def get_double_lower_bounds(self):
+        return self._lower_bounds
+
+    def get_double_upper_bounds(self):
+        return self._upper_bounds
+
+    # create an instance of the parameter from JSON
+    @classmethod
+    def load(cls, model, data):
+        scenario = model.scenarios[data.pop('scenario')]
+        values = data.pop('values')
+        return cls(model, scenario, values, **data)
+
+
+# register the name so it can be loaded from JSON
+ScenarioBatchParameter.register()
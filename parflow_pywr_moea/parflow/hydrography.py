@@ -5,6 +5,9 @@
     --------------------------------------
     find_slope_files: returns tuples with slope files in x and y directions in
                       a given directory matching a pattern out.slope_{}
+    read_slopes: reads the x and y slope files in a given directory
+    discharge_from_pressure: calculates discharge from a single Parflow
+                             pressure field
     read_discharge: calculated discharge from Parflow output pressure in slope
                     files in a specified directory for given coordinates and a
                     given Manning's coefficient
@@ -68,18 +71,14 @@ def find_slope_files(directory, suffix='out.slope_{}'):
     return slope_x, slope_y
 
 
-# List of parameters in the read_discharge function and with a coma and
-# blank space, fix it
-def read_discharge(directory, coordinates, start_from, channel_width=100,
-                   mannings=8.333e-6, ):
-    """ Discover and read Parflow results inside `directory`.
+def read_slopes(directory):
+    """ Read the x and y slope files in directory.
 
-    This function calculates discharge from Parflow based on the
-    values of ponding depth in cell 0,0,0.
-    Uses default Manning's coefficient of 8.333e-6 h/(m^(1/3)) which should
-    be equal to the value set in Parflow in the profile.tcl script
+        Returns
+        -----------------------------------
+        slpx, slpy, delta
+            Slopes in x and y directions and the grid spacing
     """
-
     slope_x_filename, slope_y_filename = find_slope_files(directory)
     slpx, deltax = read(os.path.join(directory, slope_x_filename))
     slpy, deltay = read(os.path.join(directory, slope_y_filename))
@@ -91,6 +90,49 @@ def read_discharge(directory, coordinates, start_from, channel_width=100,
         raise ValueError(
             'Grid sizes from slope files is not the same shape. '
             'x: {}, y: {}'.format(slpx.shape, slpy.shape))
+    return slpx, slpy, deltax
+
+
+def discharge_from_pressure(data, slpx, slpy, coordinates, channel_width=100,
+                            mannings=8.333e-6):
+    """ Calculate discharge (m3/d) for each of the coordinates from a single
+        pressure field data using Manning's formula.
+
+        Returns a dictionary with the same keys as coordinates.
+    """
+    discharge = {}
+    # TODO can this loop be vectorised?
+    for key, (oi, oj, ok) in coordinates.items():
+        #print("ponding depth: {}".format(data[oi, oj, ok]))
+        # Calculate discharge using Manning's formula (in m3/h)
+        q = channel_width * (abs(slpx[oi, oj, 0])) ** (1.0 / 2.0) / \
+            mannings * max(data[oi, oj, ok], 0) ** (5.0 / 3.0)
+        q += channel_width * (abs(slpy[oi, oj, 0])) ** (1.0 / 2.0) / \
+            mannings * max(data[oi, oj, ok], 0) ** (5.0 / 3.0)
+        # Convert units from m3/hr (Parflow) to m3/day
+        q *= 24
+        discharge[key] = q
+        # print("discharge, m3/d: {}".format(q))
+    return discharge
+
+
+# List of parameters in the read_discharge function and with a coma and
+# blank space, fix it
+def read_discharge(directory, coordinates, start_from, channel_width=100,
+                   mannings=8.333e-6, slopes=None):
+    """ Discover and read Parflow results inside `directory`.
+
+    This function calculates discharge from Parflow based on the
+    values of ponding depth in cell 0,0,0.
+    Uses default Manning's coefficient of 8.333e-6 h/(m^(1/3)) which should
+    be equal to the value set in Parflow in the profile.tcl script.
+    slopes are the (slpx, slpy, deltax) returned by read_slopes; they are
+    read from directory if not given.
+    """
+
+    if slopes is None:
+        slopes = read_slopes(directory)
+    slpx, slpy, deltax = slopes
     nx, ny, nz = slpx.shape
     # dx, dy, dz = deltax
     n_obs = 9
@@ -118,19 +160,11 @@ def read_discharge(directory, coordinates, start_from, channel_width=100,
         if deltax != deltap:
             raise ValueError(
                 'Grid sizes from pressure file ("{}") is not the same shape. '
-                'x: {}, y: {}'.format(filename, deltax.shape, deltay.shape))
-        # TODO can this loop be vectorised?
-        for key, (oi, oj, ok) in coordinates.items():
-            #print("ponding depth: {}".format(data[oi, oj, ok]))
-            # Calculate discharge using Manning's formula (in m3/h)
-            q = channel_width * (abs(slpx[oi, oj, 0])) ** (1.0 / 2.0) / \
-                mannings * max(data[oi, oj, ok], 0) ** (5.0 / 3.0)
-            q += channel_width * (abs(slpy[oi, oj, 0])) ** (1.0 / 2.0) / \
-                mannings * max(data[oi, oj, ok], 0) ** (5.0 / 3.0)
-            # Convert units from m3/hr (Parflow) to m3/day
-            q *= 24
+                'x: {}, y: {}'.format(filename, deltax, deltap))
+        for key, q in discharge_from_pressure(
+                data, slpx, slpy, coordinates, channel_width=channel_width,
+                mannings=mannings).items():
             discharge[key][t] = q
-            # print("discharge, m3/d: {}".format(q))
     print("Discharge characteristics: ")
     logger.info("Mean flow: {} m3/d".format(np.mean(discharge[key])))
     logger.info("Median flow: {} m3/d".format(np.median(discharge[key])))
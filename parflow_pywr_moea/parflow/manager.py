@@ -5,15 +5,58 @@
 """
 
 import os
+import math
+import re
+import glob
+import atexit
 import shutil
+import socket
+import hashlib
+import contextlib
 import subprocess
 import logging
 import numpy as np
 from .vegetation import VegetationTileFractionalCoverage
+from .pf_read import read
+from .spinup import porosity_value, relative_change, subsurface_storage
 
 logger = logging.getLogger(__name__)
 
 
+@contextlib.contextmanager
+def file_lock(filename):
+    """ Hold an exclusive lock on filename (shared by all processes and
+        threads of a node) in the block """
+    import fcntl
+    with open(filename, 'a') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def content_key(path):
+    """ Return a short hash of path and of the relative names, sizes and
+        modification times of the files at path (a file or a directory), so
+        that a copy of a changed file or directory gets a different key """
+    path = os.path.abspath(path)
+    stamp = hashlib.sha1(path.encode())
+    if os.path.isdir(path):
+        filenames = sorted(
+            os.path.join(root, filename)
+            for root, _, filenames in os.walk(path)
+            for filename in filenames)
+    else:
+        filenames = [path] if os.path.exists(path) else []
+    for filename in filenames:
+        stat = os.stat(filename)
+        stamp.update('{}:{}:{}'.format(
+            os.path.relpath(filename, path), stat.st_size,
+            stat.st_mtime_ns).encode())
+    return stamp.hexdigest()[:12]
+
+
 class ParflowRunner:
     """ Class to manage the setup and execution of parflow runs.
         Methods:
@@ -25,18 +68,81 @@ class ParflowRunner:
                             Parflow/PyWr model
         remove_environment: removes the directory and the files after successful
                             execution of the model
+        stage: copies the base model to node-local scratch once per node
+        stage_file: returns a node-local copy of a file
+        warm_up: prepares the precompiled base model and the vegetation
+                 template before the first run of a worker process
+        vegetation_template: returns the parsed vegetation coverage file of
+                             the base model
         rewrite_vegetation_coverage: writes sparse_fractional_coverage into
                                      Parflow's vegetation coverage file
+        replace_forcing: replaces the meteorological forcing file of an
+                         environment with another file
+        base_keys: returns the values of pfset keys in the base model script
+        timestep: returns the length of the Parflow time step
+        set_keys: rewrites values of pfset keys in the script of an
+                  environment
+        save_state: copies the pressure field and CLM restart files of an
+                    environment to another directory
+        load_state: initialises an environment from a saved state
+        use_clm_restart: switches CLM to start from its restart files
+        set_start: sets the start time and output numbering of a run
+        restart: continues the previous run of an environment from a dump
+        spinup: spins up the model in chunks until the state converges
+        compile: recompiles the Parflow .tcl script into a .pfidb file
+        start: starts Parflow as a subprocess without waiting for it
         run: executes Parflow as a subprocess
+
+        Parflow runs in parallel when a process topology (P, Q, R) is given:
+        the Process.Topology keys are set before the script is compiled (so
+        that pfdist distributes the input files accordingly) and Parflow is
+        started with the launcher command, in which {np} is replaced by
+        P * Q * R. Runners created without a topology use default_topology
+        and default_launcher (set by the hierarchical MPI mode).
+
+        With a staging_directory (e.g. "$TMPDIR"), the base model and the
+        forcing files are copied once per node into node-local scratch, the
+        Parflow database of the base model is precompiled there, and the
+        environments are created and run in the node-local directory.
+        The staging areas are keyed by the path and the content stamp (names,
+        sizes and modification times of the files) of the base model and of
+        each forcing file, so that a changed base model or forcing file is
+        staged again instead of reusing an outdated copy.
     """
 
+    default_topology = None
+    default_launcher = None
+    default_staging_directory = None
+
     def __init__(self, input_script, run_args, base_model_directory,
-                 work_directory, vegetation_coverage_filename=None):
+                 work_directory, vegetation_coverage_filename=None,
+                 topology=None, launcher=None, staging_directory=None):
         self.input_script = input_script
         self.run_args = run_args
         self.base_model_directory = base_model_directory
         self.work_directory = work_directory
         self.vegetation_coverage_filename = vegetation_coverage_filename
+        self.topology = tuple(topology) if topology is not None \
+            else self.default_topology
+        self.launcher = tuple(launcher) if launcher is not None \
+            else self.default_launcher
+        if staging_directory is None:
+            staging_directory = self.default_staging_directory
+        self.staging_root = None
+        self._precompiled = False
+        self._vegetation_template = None
+        if staging_directory is not None:
+            # One staging area per version of the base model on each node
+            self.staging_root = os.path.join(
+                os.path.expandvars(staging_directory),
+                'parflow_{}'.format(content_key(base_model_directory)))
+            self.work_directory = os.path.join(self.staging_root, 'work')
+
+    def number_of_processes(self):
+        """ Returns the number of Parflow processes of a run """
+        if self.topology is None:
+            return 1
+        return int(np.prod(self.topology))
 
     def model_directory(self, name):
         """ Returns full path of the directory for the model given in name """
@@ -47,6 +153,8 @@ class ParflowRunner:
             run the Pywr/Parflow model. Writes fractional vegetation
             fractional_coverage if specified as an argument """
         #from pudb import set_trace; set_trace()
+        if self.staging_root is not None and not self._precompiled:
+            self.stage()
         directory = self.model_directory(name)
         # Copy the contents of the base model
         shutil.copytree(self.base_model_directory, directory)
@@ -55,6 +163,113 @@ class ParflowRunner:
         if sparse_fractional_coverage is not None:
             self.rewrite_vegetation_coverage(name, sparse_fractional_coverage)
 
+    def stage(self):
+        """ Copy the base model to the node-local staging directory (only
+            the first process of a node copies it, under a file lock) and
+            create environments from the local copy """
+        os.makedirs(self.staging_root, exist_ok=True)
+        staged = os.path.join(self.staging_root, 'base')
+        with file_lock(os.path.join(self.staging_root, 'stage.lock')):
+            if not os.path.exists(staged):
+                logger.info('Staging Parflow model {} to {}'.format(
+                    self.base_model_directory, staged))
+                tmp_directory = staged + '.tmp'
+                shutil.rmtree(tmp_directory, ignore_errors=True)
+                shutil.copytree(self.base_model_directory, tmp_directory)
+                self._precompile(tmp_directory)
+                os.rename(tmp_directory, staged)
+        self.base_model_directory = staged
+        os.makedirs(self.work_directory, exist_ok=True)
+        self._precompiled = True
+
+    def warm_up(self):
+        """ Prepare the base model once per worker process: stage it (with
+            staging) or precompile a private copy of it in the work
+            directory, so that environments whose script is unchanged are
+            not compiled again, and parse the vegetation template """
+        if not self._precompiled:
+            if self.staging_root is not None:
+                self.stage()
+            else:
+                template = os.path.join(
+                    self.work_directory, 'template_{}_{}'.format(
+                        socket.gethostname(), os.getpid()))
+                shutil.rmtree(template, ignore_errors=True)
+                shutil.copytree(self.base_model_directory, template)
+                self._precompile(template)
+                self.base_model_directory = template
+                self._precompiled = True
+                atexit.register(shutil.rmtree, template, True)
+        if self.vegetation_coverage_filename is not None:
+            self.vegetation_template()
+
+    def vegetation_template(self):
+        """ Return the template of the vegetation coverage file (read from
+            the base model on first use) """
+        if self._vegetation_template is None:
+            self._vegetation_template = \
+                VegetationTileFractionalCoverage.read_template(os.path.join(
+                    self.base_model_directory,
+                    self.vegetation_coverage_filename))
+        return self._vegetation_template
+
+    def stage_file(self, filename):
+        """ Return a node-local copy of filename (copied on first use) or
+            filename itself without staging """
+        if self.staging_root is None:
+            return filename
+        path = os.path.abspath(filename)
+        directory = os.path.join(self.staging_root, 'files')
+        staged = os.path.join(directory, '{}_{}'.format(
+            content_key(path), os.path.basename(path)))
+        os.makedirs(directory, exist_ok=True)
+        with file_lock(os.path.join(self.staging_root, 'stage.lock')):
+            if not os.path.exists(staged):
+                shutil.copyfile(path, staged + '.tmp')
+                os.rename(staged + '.tmp', staged)
+        return staged
+
+    def _precompile(self, directory):
+        """ Compile the Parflow database (and distribute the input files) of
+            the staged base model so that unchanged environments need not be
+            compiled again """
+        if self.topology is not None:
+            self._set_script_keys(self.script_filename(directory),
+                                  self._topology_keys())
+        try:
+            self._compile_directory(directory)
+        except RuntimeError as error:
+            logger.warning('The staged model could not be precompiled; '
+                           'every run compiles its script: {}'.format(error))
+
+    def _is_precompiled(self, directory):
+        """ Return True if the database of the precompiled base model is
+            valid for the environment in directory: its script and initial
+            pressure are those of the base model """
+        if not self._precompiled:
+            return False
+        base = self.base_model_directory
+        database = self.input_script + '.pfidb'
+        if not os.path.exists(os.path.join(base, database)) or \
+                not os.path.exists(os.path.join(directory, database)):
+            return False
+        with open(self.script_filename(base)) as fh:
+            base_script = fh.read()
+        with open(self.script_filename(directory)) as fh:
+            if fh.read() != base_script:
+                return False
+        # Restarts replace the initial pressure, which must be distributed
+        # again
+        for filename in ('press.ini.pfb',):
+            base_file = os.path.join(base, filename)
+            if os.path.exists(base_file):
+                local = os.stat(os.path.join(directory, filename))
+                original = os.stat(base_file)
+                if (local.st_size, local.st_mtime) != \
+                        (original.st_size, original.st_mtime):
+                    return False
+        return True
+
     def remove_environment(self, name):
         """ Remove the directory with files generated in a combined Pywr/Parflow
             run """
@@ -66,22 +281,234 @@ class ParflowRunner:
         """ Rewrite the vegetation coverage file for this environment.
             Initialises VegetationTileFractionalCoverage with
             dense_fractional_coverage and writes it to the Parflow's/CLM's
-            vegetation file"""
-        dense_fractional_coverage = []
-        for data in sparse_fractional_coverage:
-            # Make an list of zeros
-            coverage = np.zeros(VegetationTileFractionalCoverage.NUM_CLASSES)
-            # Assign values to the dense array as required.
-            for iclass, value in data.items():
-                coverage[iclass] = value
-            # Now, normalise data.
-            coverage /= coverage.sum()
-            dense_fractional_coverage.append(coverage)
+            vegetation file. The coverage is either a list with a dictionary
+            of the coverage of each class for each tile or a (tiles, classes)
+            array."""
+        if isinstance(sparse_fractional_coverage, np.ndarray):
+            dense_fractional_coverage = np.array(sparse_fractional_coverage,
+                                                 dtype=np.float64)
+        else:
+            # Tile, class and value of every non-zero fractional coverage
+            entries = [(tile, iclass, value) for tile, data in
+                       enumerate(sparse_fractional_coverage)
+                       for iclass, value in data.items()]
+            tiles, classes, values = np.array(entries).T if entries else \
+                np.empty((3, 0))
+            dense_fractional_coverage = np.zeros(
+                (len(sparse_fractional_coverage),
+                 VegetationTileFractionalCoverage.NUM_CLASSES))
+            np.add.at(dense_fractional_coverage,
+                      (tiles.astype(int), classes.astype(int)), values)
+        # Now, normalise data.
+        dense_fractional_coverage /= dense_fractional_coverage.sum(
+            axis=1, keepdims=True)
 
         filename = os.path.join(self.model_directory(name),
                                 self.vegetation_coverage_filename)
         VegetationTileFractionalCoverage(
-            dense_fractional_coverage).rewrite_to(filename)
+            dense_fractional_coverage).rewrite_to(
+                filename, template=self.vegetation_template())
+
+    def replace_forcing(self, name, forcing_filename, met_filename):
+        """ Copy forcing_filename into the environment given in name under the
+            name met_filename (Solver.CLM.MetFileName in the Parflow script)
+        """
+        destination = os.path.join(self.model_directory(name), met_filename)
+        shutil.copyfile(self.stage_file(forcing_filename), destination)
+
+    def script_filename(self, directory):
+        """ Returns full path of the Parflow .tcl script in directory """
+        return os.path.join(directory, self.input_script + '.tcl')
+
+    def base_keys(self):
+        """ Return a dictionary with the (string) values of all keys set with
+            pfset in the base model script """
+        keys = {}
+        with open(self.script_filename(self.base_model_directory)) as fh:
+            for line in fh:
+                tokens = line.split()
+                if len(tokens) >= 3 and tokens[0] == 'pfset':
+                    keys[tokens[1]] = tokens[2]
+        return keys
+
+    def timestep(self, keys=None):
+        """ Return the length of the Parflow time step (hours) set in keys
+            (the keys of the base model script by default) """
+        if keys is None:
+            keys = self.base_keys()
+        return float(keys.get('TimeStep.Value', 1.0))
+
+    def set_keys(self, name, keys):
+        """ Set values of pfset keys in the script of the environment given
+            in name. Keys which are not in the script are added before the
+            database is written (pfwritedb). """
+        self._set_script_keys(
+            self.script_filename(self.model_directory(name)), keys)
+
+    def _set_script_keys(self, filename, keys):
+        """ Set values of pfset keys in the script filename """
+        with open(filename) as fh:
+            script = fh.read()
+        for key, value in keys.items():
+            pattern = re.compile(r'^(\s*pfset\s+{}\s+)\S+'.format(
+                re.escape(key)), re.MULTILINE)
+            script, count = pattern.subn(
+                lambda match: match.group(1) + str(value), script)
+            if count == 0:
+                line = 'pfset {} {}\n'.format(key, value)
+                match = re.search(r'^\s*pfwritedb', script, re.MULTILINE)
+                if match is None:
+                    script += line
+                else:
+                    script = script[:match.start()] + line + \
+                        script[match.start():]
+        with open(filename, 'w') as fh:
+            fh.write(script)
+
+    def save_state(self, name, dump_number, destination):
+        """ Copy the pressure field of the dump given in dump_number and the
+            CLM restart files of the environment given in name to the
+            directory destination """
+        directory = self.model_directory(name)
+        os.makedirs(destination, exist_ok=True)
+        pressure = '{}.out.press.{:05d}.pfb'.format(self.input_script,
+                                                     dump_number)
+        shutil.copyfile(os.path.join(directory, pressure),
+                        os.path.join(destination, 'press.ini.pfb'))
+        for filename in glob.glob(os.path.join(directory, 'clm.rst.*')) + \
+                glob.glob(os.path.join(directory, 'clm_restart.tcl')):
+            shutil.copy(filename, destination)
+
+    def load_state(self, name, source, clm_input_filename='drv_clmin.dat'):
+        """ Initialise the environment given in name from the state saved
+            with save_state in the directory source: the saved pressure field
+            becomes the initial pressure and CLM starts from its restart
+            files """
+        directory = self.model_directory(name)
+        for filename in os.listdir(source):
+            shutil.copy(os.path.join(source, filename), directory)
+        self.use_clm_restart(name, clm_input_filename)
+
+    def use_clm_restart(self, name, clm_input_filename='drv_clmin.dat'):
+        """ Switch CLM of the environment given in name to start from its
+            restart files """
+        # 1=restart file
+        filename = os.path.join(self.model_directory(name), clm_input_filename)
+        with open(filename) as fh:
+            clm_input = fh.read()
+        clm_input = re.sub(r'^((?:startcode|clm_ic)\s+)\d+', r'\g<1>1',
+                           clm_input, flags=re.MULTILINE)
+        with open(filename, 'w') as fh:
+            fh.write(clm_input)
+
+    def set_start(self, name, dump_number, hours, timestep=1.0):
+        """ Make the run of the environment given in name start at time hours
+            with the output numbering continuing from dump_number. timestep
+            is the length of the Parflow (and CLM) time step in hours. """
+        self.set_keys(name, {
+            'TimingInfo.StartCount': dump_number,
+            'TimingInfo.StartTime': hours,
+            'Solver.CLM.IstepStart': int(round(hours / timestep)) + 1,
+        })
+
+    def restart(self, name, dump_number, hours, timestep=1.0):
+        """ Prepare the environment given in name to continue its previous
+            run from the dump given in dump_number (at time hours) """
+        directory = self.model_directory(name)
+        pressure = '{}.out.press.{:05d}.pfb'.format(self.input_script,
+                                                     dump_number)
+        shutil.copyfile(os.path.join(directory, pressure),
+                        os.path.join(directory, 'press.ini.pfb'))
+        self.use_clm_restart(name)
+        self.set_start(name, dump_number, hours, timestep)
+
+    def spinup(self, name, hours, chunk_hours=None, tolerance=None,
+               measure='pressure', mode='parflow', period=None):
+        """ Spin up the model of the environment given in name for at most
+            hours. The spin-up runs in restartable chunks of chunk_hours and
+            stops early once the relative change of the convergence measure
+            between the ends of two chunks is below tolerance. measure is
+            'pressure' (norm of the pressure field) or 'storage' (total
+            subsurface storage). Without a tolerance the spin-up runs for
+            the full length in one chunk.
+
+            If period is given (e.g. 8760 hours for a forcing repeated every
+            year), a spin-up which converges early continues up to the next
+            multiple of period, so that the run restarted from its end sees
+            the same part of the forcing cycle whatever the length of the
+            spin-up. hours must then be a multiple of period. period is
+            ignored by a spin-up of fixed length.
+
+            Returns the length of the spin-up (hours) and the number of the
+            dump at its end. """
+        keys = self.base_keys()
+        dump_interval = float(keys['TimingInfo.DumpInterval'])
+        timestep = self.timestep(keys)
+        if tolerance is None or chunk_hours is None:
+            # A spin-up of fixed length always ends at the same time
+            chunk_hours = hours
+            period = None
+        if chunk_hours % dump_interval != 0:
+            raise ValueError('The spin-up chunk ({} hours) is not a multiple '
+                             'of the dump interval ({} hours).'.format(
+                                 chunk_hours, dump_interval))
+        if period is not None and (hours % period != 0 or
+                                   period % dump_interval != 0):
+            raise ValueError('The spin-up length ({} hours) must be a '
+                             'multiple of the forcing period ({} hours), and '
+                             'the period a multiple of the dump interval ({} '
+                             'hours).'.format(hours, period, dump_interval))
+        # CLM writes its restart file at the end of every chunk
+        chunk_keys = {'Solver.CLM.CLMDumpInterval':
+                      int(round(chunk_hours / timestep))}
+        if measure == 'storage':
+            chunk_keys['Solver.PrintSaturation'] = 'True'
+            porosity = porosity_value(keys)
+        elif measure != 'pressure':
+            raise ValueError('Unknown spin-up convergence measure: '
+                             '"{}"'.format(measure))
+
+        directory = self.model_directory(name)
+        elapsed = 0.0
+        dump_number = 0
+        previous = None
+        while elapsed < hours:
+            if elapsed > 0:
+                self.restart(name, dump_number, elapsed, timestep)
+            stop = min(elapsed + chunk_hours, hours)
+            self.set_keys(name, dict(chunk_keys,
+                                     **{'TimingInfo.StopTime': stop}))
+            self.run(name, mode)
+            elapsed = stop
+            dump_number = int(round(elapsed / dump_interval))
+            if tolerance is None:
+                continue
+            if measure == 'storage':
+                data, deltax = read(os.path.join(directory, '{}.out.satur.'
+                                                 '{:05d}.pfb'.format(
+                                                     self.input_script,
+                                                     dump_number)))
+                current = subsurface_storage(data, porosity, deltax)
+            else:
+                data, _ = read(os.path.join(directory, '{}.out.press.'
+                                            '{:05d}.pfb'.format(
+                                                self.input_script,
+                                                dump_number)))
+                current = data
+            if previous is not None:
+                change = relative_change(previous, current)
+                logger.info('Spin-up change of {} after {} hours: {}'.format(
+                    measure, elapsed, change))
+                if change <= tolerance:
+                    logger.info('Spin-up converged after {} hours'.format(
+                        elapsed))
+                    if period is None or elapsed % period == 0:
+                        break
+                    # Run on to the end of the forcing period
+                    hours = math.ceil(elapsed / period) * period
+                    tolerance = None
+            previous = current
+        return elapsed, dump_number
 
     # Run parflow using TCLSH shell
     # def run(self, name):
@@ -92,44 +519,83 @@ class ParflowRunner:
     #                    cwd=self.model_directory(name))
     #     logger.debug('Parflow model run complete.')
 
-    def run(self, name, mode='parflow'):
-        """ Run parflow installed in the path '$PARFLOW_DIR/bin/parflow' """
+    def parflow_command(self, mode='parflow'):
+        """ Return the command used to execute Parflow """
+        if mode == 'tclsh':
+            # Run parflow by executing the .tcl Parflow script
+            # The script needs to include pfrun command in its body to execute
+            # Parflow
+            return ['tclsh', self.input_script + '.tcl']
+        # Generate Parflow run command defined as: parflow <parflow.pfidb>
+        # <list of run arguments>
         parflow = os.environ['PARFLOW_DIR'] + '/bin/parflow'
         # parflow = "/home/pbzep/pfdir/parflow" - Anrew Slaughter
+        command = [parflow, self.input_script] + list(self.run_args)
+        nprocs = self.number_of_processes()
+        if nprocs > 1 and self.launcher:
+            # Start the Parflow processes with the MPI launcher
+            command = [arg.replace('{np}', str(nprocs))
+                       for arg in self.launcher] + command
+        return command
+
+    def compile(self, name):
+        """ Recompile the .tcl file into the .pfidb file in the environment
+            given in name """
+        if self.topology is not None:
+            # pfdist in the script distributes the input files for this
+            # topology
+            self.set_keys(name, self._topology_keys())
+        directory = self.model_directory(name)
+        if self._is_precompiled(directory):
+            logger.debug('Using the database precompiled on this node')
+            return
+        self._compile_directory(directory)
 
+    def _topology_keys(self):
+        """ Returns the pfset keys of the Parflow process topology """
+        return dict(zip(['Process.Topology.P', 'Process.Topology.Q',
+                         'Process.Topology.R'], self.topology))
+
+    def _compile_directory(self, directory):
+        """ Compile the .tcl file in directory into the .pfidb file """
+        recompile_tcl_command = ['tclsh', self.input_script + '.tcl']
+        try:
+            subprocess.run(recompile_tcl_command, check=True,
+                           stdout=subprocess.PIPE, cwd=directory)
+            logger.info(self.input_script + ".tcl compiled into: " +
+                        self.input_script + ".pfidb")
+        except subprocess.CalledProcessError as call_error:
+            raise RuntimeError("Command '{}' return with error (code {}): \
+                               {}".format(call_error.cmd,
+                                          call_error.returncode,
+                                          call_error.output))
+
+    def start(self, name, mode='parflow'):
+        """ Start Parflow in the environment given in name without waiting
+            for it to finish. Standard output is written to parflow.stdout in
+            the environment. Returns the subprocess.Popen object. """
         logger.info("Parflow results will be written to: " +
                     self.model_directory(name))
+        if mode != 'tclsh':
+            self.compile(name)
+        command = self.parflow_command(mode)
+        logger.debug('Starting Parflow with the following command: '
+                     '"{}"'.format(" ".join(command)))
+        stdout_filename = os.path.join(self.model_directory(name),
+                                       'parflow.stdout')
+        with open(stdout_filename, 'w') as stdout:
+            return subprocess.Popen(command, stdout=stdout,
+                                    cwd=self.model_directory(name))
 
-        if mode == 'tclsh':
-            # Run parflow by executing the .tcl Parflow script
-            # The script needs to include pfrun command in its body to execute
-            # Parflow
-            command = ['tclsh', self.input_script + '.tcl']
-        else: # if 'parflow'
-            # Generate Parflow run command defined as: parflow <parflow.pfidb>
-            # <list of run arguments>
-            logger.info(self.input_script)
-            command = [parflow, self.input_script] + list(self.run_args)
+    def run(self, name, mode='parflow'):
+        """ Run parflow installed in the path '$PARFLOW_DIR/bin/parflow' """
+        logger.info("Parflow results will be written to: " +
+                    self.model_directory(name))
+
+        if mode != 'tclsh':
             # First, recompile the .tcl file into pfidb file
-            # Run a new subprocess
-            recompile_tcl_command = ['tclsh', self.input_script + '.tcl']
-            cwd_rel = self.model_directory(name)
-            try:
-                sub1 = subprocess.run(recompile_tcl_command, check=True,
-                                      stdout=subprocess.PIPE,
-                                      cwd=cwd_rel)
-                #sub1 = subprocess.Popen(recompile_tcl_command,
-                #                        stdout=subprocess.PIPE,
-                #                        cwd=self.model_directory(name))
-                #proc_stdout = sub1.communicate()[0]
-                logger.info(self.input_script + ".tcl compiled into: " +
-                            self.input_script + ".pfidb")
-            except subprocess.CalledProcessError as call_error:
-                raise RuntimeError("Command '{}' return with error (code {}): \
-                                   {}".format(call_error.cmd,
-                                              call_error.returncode,
-                                              call_error.output))
-            # TODO: WRITE THE COMMAND TO RUN THE TCLSH SCRIPT
+            self.compile(name)
+        command = self.parflow_command(mode)
 
         logger.debug('Running Parflow with the following \
                      command: "{}"'.format(" ".join(command)))
@@ -137,18 +603,8 @@ class ParflowRunner:
         # as self.model_directory(name). Opens a standard output stdout as a
         # pipe (subprocess.PIPE)
         try:
-            logger.debug("Trying to run command: ", command)
-            logger.debug("Executing in directory: ", self.model_directory(name))
-            logger.debug("Executing script ", self.input_script)
-            cwd_abs = os.path.abspath(self.model_directory(name))
-            sub2 = subprocess.run(command, check=True, stdout=subprocess.PIPE,
-                                  cwd=cwd_rel)
-            #subprocess.run(command, check=True, stdout=subprocess.PIPE,
-            #               cwd=self.model_directory(name))
-            #print('absolute path: ', os.path.abspath(self.model_directory(name)))
-            #print(type(self.model_directory(name)))
-            #sub2 = subprocess.Popen([self.model_directory(name),command])
-            #subprocess.run('echo shit's not working, check=True, shell=True)
+            subprocess.run(command, check=True, stdout=subprocess.PIPE,
+                           cwd=self.model_directory(name))
         except subprocess.CalledProcessError as call_error:
             raise RuntimeError("Command '{}' return with error (code {}): \
                                {}".format(call_error.cmd, call_error.returncode,
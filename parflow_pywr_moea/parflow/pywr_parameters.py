@@ -7,13 +7,20 @@
 
 
 # from .nc_read import read_discharge, read_et
+import os
 import uuid
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from pywr.parameters import Parameter, load_parameter
 from .manager import ParflowRunner
-from .hydrography import read_discharge
+from .vegetation import VegetationTileFractionalCoverage
+from .hydrography import read_discharge, read_slopes, discharge_from_pressure
 from .et import read_et
+from .pf_read import read
+from .stream import output_filename, wait_for_output
+from .spinup import SpinupLibrary
+from ..telemetry import timer
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +34,21 @@ class ParflowRunnerParameter(Parameter):
         reset(self): run Parflow before each evaluation of Pywr
         finish(self):removes the working directory with input/output files
         directory(self): returns model directory
+        directories(self): returns model directories of all ensemble members
+        member_index(self, scenario_index): returns the forcing ensemble
+                                            member used in a scenario
+        first_dump(self, member): returns the number of the first Parflow
+                                  dump of an ensemble member's run
+        release(self): removes the environments of the last Parflow runs
         load(cls,model,data): loads Parflow's data from JSON file
+
+        If forcing_files and forcing_scenario are given, one Parflow run is
+        made for each forcing file (each member of the Pywr scenario) and up
+        to max_parallel_runs of these runs are executed concurrently.
+
+        If streaming is true, reset() only starts Parflow and the discharge
+        and evapotranspiration parameters wait (wait_for_output) for each
+        output file as Pywr needs it, so Pywr runs while Parflow computes.
     """
 
     def __init__(self, model, runner, *args, **kwargs):
@@ -36,14 +57,94 @@ class ParflowRunnerParameter(Parameter):
         self.remove_environments = kwargs.pop("remove_environments", True)
         # TODO read this directly from the Parflow input script (TCL)
         self.dump_interval = kwargs.pop("dump_interval", None)
+        # Ensemble of meteorological forcing files mapped to a Pywr scenario
+        self.forcing_scenario = kwargs.pop("forcing_scenario", None)
+        self.forcing_files = kwargs.pop("forcing_files", None)
+        self.met_filename = kwargs.pop("met_filename", "narr_1hr.wet.txt")
+        self.max_parallel_runs = kwargs.pop("max_parallel_runs",
+                                            os.cpu_count())
+        # Streaming coupling: Pywr consumes outputs while Parflow is running
+        self.streaming = kwargs.pop("streaming", False)
+        self.poll_interval = kwargs.pop("poll_interval", 0.5)
+        self.stream_timeout = kwargs.pop("stream_timeout", None)
+        # Library of spun-up states; runs restart from the end of the spin-up
+        self.spinup_library = kwargs.pop("spinup_library", None)
+        self.spinup_hours = kwargs.pop("spinup_hours", None)
+        # Adaptive spin-up: stop once the change between chunks is below
+        # the tolerance (a fixed spin-up of spinup_hours without tolerance)
+        self.spinup_chunk = kwargs.pop("spinup_chunk", None)
+        self.spinup_tolerance = kwargs.pop("spinup_tolerance", None)
+        self.spinup_measure = kwargs.pop("spinup_measure", "pressure")
+        # Period (hours) of the forcing cycle: an adaptive spin-up stops at a
+        # multiple of it, so restarted runs start at the same point of the
+        # cycle (e.g. the same day of the year)
+        self.spinup_period = kwargs.pop("spinup_period", 8760)
+        # Lower fidelity runs: pfset keys overriding the base script (e.g.
+        # a larger TimeStep.Value or looser solver tolerances)
+        # and the number of hours removed from the end of the run
+        self.parflow_keys = kwargs.pop("parflow_keys", {})
+        self.shorten_hours = kwargs.pop("shorten_hours", 0)
+        # Keep the Parflow outputs and reuse them in the next Pywr runs while
+        # the landuse vector does not change (e.g. when only reservoir
+        # control curves change between runs)
+        self.reuse_outputs = kwargs.pop("reuse_outputs", False)
         super().__init__(model, *args, **kwargs)
         self.runner = runner
-        self.env_name = None
+        self.env_names = []
+        self.processes = []
+        # Number of the first Parflow dump of each run (non-zero when the
+        # run restarts from a spin-up state)
+        self.first_dumps = []
+        # Number of Parflow runs made (readers cache values per run)
+        self.run_count = 0
+        self._landuse_run = None
+        self._forcing_scenario_index = None
+
+        if (self.forcing_files is None) != (self.forcing_scenario is None):
+            raise ValueError('Both forcing_files and forcing_scenario are '
+                             'required to run a forcing ensemble.')
+        if self.forcing_files is not None and \
+                len(self.forcing_files) != self.forcing_scenario.size:
+            raise ValueError('The number of forcing files ({}) must equal the '
+                             'size of the scenario ({}).'.format(
+                                 len(self.forcing_files),
+                                 self.forcing_scenario.size))
+        if self.streaming and self.reuse_outputs:
+            raise ValueError('Parflow outputs can not be reused in streaming '
+                             'mode.')
+        if self.spinup_library is not None and self.spinup_hours is None:
+            raise ValueError('The length of the spin-up (hours) is required '
+                             'to use a spin-up library.')
+        if self.spinup_tolerance is not None and \
+                self.spinup_period is not None and \
+                self.spinup_hours % self.spinup_period != 0:
+            raise ValueError('The length of an adaptive spin-up ({} hours) '
+                             'must be a multiple of the forcing period ({} '
+                             'hours).'.format(self.spinup_hours,
+                                              self.spinup_period))
+        if self.parflow_keys:
+            # A key missing from the script would be added without effect
+            unknown = set(self.parflow_keys) - set(runner.base_keys())
+            if unknown:
+                raise ValueError('Parflow keys {} are not set in the base '
+                                 'Parflow script.'.format(sorted(unknown)))
 
         if vegetation_param is not None:
             vegetation_param.parents.add(self)
         self.vegetation_param = vegetation_param
 
+    @property
+    def env_name(self):
+        """ Name of the environment of the first (or only) Parflow run """
+        return self.env_names[0] if self.env_names else None
+
+    @property
+    def num_members(self):
+        """ Number of Parflow runs made in each Pywr run """
+        if self.forcing_files is None:
+            return 1
+        return len(self.forcing_files)
+
     @property
     def resample_size(self):
         """ Calculate the size of any resampling needed to align Parflow output
@@ -66,22 +167,191 @@ class ParflowRunnerParameter(Parameter):
         # Return the integer resampling size.
         return timestep // self.dump_interval
 
+    def setup(self):
+        super().setup()
+        if self.forcing_scenario is not None:
+            self._forcing_scenario_index = \
+                self.model.scenarios.get_scenario_index(self.forcing_scenario)
+
     def reset(self):
         """ Run parflow before each evaluation of Pywr. Called for every run
             at the start of a model run before the first timestep """
         # called before each PyWr run
-        self.env_name = uuid.uuid4().hex
-        # Run parflow
-        self.runner.create_environment(self.env_name)
+        if self.reuse_outputs:
+            if self.env_names and self._landuse_run == self.landuse:
+                logger.info('Reusing Parflow outputs of the same landuse')
+                return
+            self.release()
+        self.env_names = [uuid.uuid4().hex for _ in range(self.num_members)]
+        self.first_dumps = [0] * self.num_members
+        self.run_count += 1
+        # Landuse of the outputs kept for reuse
+        self._landuse_run = self.landuse if self.reuse_outputs else None
         if self.vegetation_param is not None:
-            self.runner.rewrite_vegetation_coverage(
-                self.env_name,
-                self.vegetation_param.to_sparse_fractional_coverage())
-        self.runner.run(self.env_name)
+            coverage = self.vegetation_param.to_dense_fractional_coverage()
+        else:
+            coverage = None
+        for member, env_name in enumerate(self.env_names):
+            self._prepare_environment(env_name, member, coverage)
+            self._set_fidelity(env_name)
+        if self.spinup_library is not None:
+            # Spin-up runs (if any are needed) use the same cores as the
+            # production runs
+            self._map_members(
+                lambda member: self._restart_from_spinup(member, coverage))
+        # Run parflow (concurrently for each member of the forcing ensemble)
+        if self.streaming:
+            # Only start Parflow; outputs are read as they are written
+            self.processes = [self.runner.start(env_name)
+                              for env_name in self.env_names]
+        else:
+            with timer('parflow'):
+                self._map_members(
+                    lambda member: self.runner.run(self.env_names[member]))
+
+    def _prepare_environment(self, env_name, member, coverage):
+        """ Create the environment of an ensemble member with the vegetation
+            coverage and forcing of the current evaluation """
+        self.runner.create_environment(env_name)
+        if coverage is not None:
+            self.runner.rewrite_vegetation_coverage(env_name, coverage)
+        if self.forcing_files is not None:
+            self.runner.replace_forcing(
+                env_name, self.forcing_files[member], self.met_filename)
+
+    def _set_fidelity(self, env_name):
+        """ Apply the fidelity settings (parflow_keys and shorten_hours) to
+            an environment. Spin-up runs always use the base settings. """
+        keys = dict(self.parflow_keys)
+        if self.shorten_hours:
+            keys['TimingInfo.StopTime'] = self.stop_time()
+        if keys:
+            self.runner.set_keys(env_name, keys)
+
+    def stop_time(self):
+        """ Return the end (hours) of the Parflow runs """
+        base_keys = self.runner.base_keys()
+        return float(base_keys['TimingInfo.StopTime']) - self.shorten_hours
+
+    def timestep(self):
+        """ Return the length of the Parflow time step (hours) """
+        keys = self.runner.base_keys()
+        keys.update(self.parflow_keys)
+        return self.runner.timestep(keys)
+
+    def _map_members(self, func):
+        """ Call func for each ensemble member, concurrently on up to
+            max_parallel_runs cores """
+        if self.num_members == 1:
+            func(0)
+            return
+        max_workers = min(self.num_members, self.max_parallel_runs)
+        logger.info('Running {} Parflow forcing ensemble members on {} '
+                    'cores'.format(self.num_members, max_workers))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # list() re-raises the first error from a failed run
+            list(executor.map(func, range(self.num_members)))
+
+    @property
+    def landuse(self):
+        """ Landuse vector of the current evaluation (empty without a
+            vegetation parameter) """
+        if self.vegetation_param is None:
+            return []
+        return list(self.vegetation_param.get_integer_variables())
+
+    def forcing_label(self, member):
+        """ Label of the forcing of an ensemble member used in the keys of
+            the spin-up library """
+        if self.forcing_files is None:
+            return ''
+        return os.path.basename(self.forcing_files[member])
+
+    def _spinup(self, member, coverage):
+        """ Run the spin-up of an ensemble member in its own environment and
+            store the end-of-spin-up state in the library """
+        env_name = uuid.uuid4().hex
+        self._prepare_environment(env_name, member, coverage)
+        try:
+            logger.info('Spinning up Parflow for up to {} hours in '
+                        'environment {}'.format(self.spinup_hours, env_name))
+            hours, dump_number = self.runner.spinup(
+                env_name, self.spinup_hours, chunk_hours=self.spinup_chunk,
+                tolerance=self.spinup_tolerance,
+                measure=self.spinup_measure, period=self.spinup_period)
+            return self.spinup_library.store(
+                self.landuse, self.forcing_label(member), self.runner,
+                env_name, dump_number, hours)
+        finally:
+            if self.remove_environments:
+                self.runner.remove_environment(env_name)
+
+    def _restart_from_spinup(self, member, coverage):
+        """ Initialise the environment of an ensemble member from the
+            library's spin-up state of the current landuse (spinning up
+            first if the library has no suitable state). The run then only
+            simulates the period after the spin-up. """
+        state = self.spinup_library.lookup(self.landuse,
+                                           self.forcing_label(member))
+        if state is None:
+            state = self._spinup(member, coverage)
+        if self.spinup_period is not None and \
+                (state.hours - self.spinup_hours) % self.spinup_period != 0:
+            raise ValueError('The spin-up state in {} ends after {} hours, '
+                             'which is not at the same point of the forcing '
+                             'period ({} hours) as the spin-up of {} '
+                             'hours.'.format(state.path, state.hours,
+                                             self.spinup_period,
+                                             self.spinup_hours))
+        env_name = self.env_names[member]
+        self.runner.load_state(env_name, state.path)
+        # Simulate the rest of the base run after the nominal spin-up
+        remaining = self.stop_time() - self.spinup_hours
+        self.runner.set_start(env_name, state.dump_number, state.hours,
+                              self.timestep())
+        self.runner.set_keys(env_name,
+                             {'TimingInfo.StopTime': state.hours + remaining})
+        self.first_dumps[member] = state.dump_number
 
     def finish(self):
-        if self.remove_environments:
-            self.runner.remove_environment(self.env_name)
+        for env_name, process in zip(self.env_names, self.processes):
+            if process.poll() is None:
+                # Pywr has all the data it needs; stop the remaining run
+                logger.info('Stopping Parflow in environment {}'.format(
+                    env_name))
+                process.terminate()
+                process.wait()
+            elif process.returncode != 0:
+                logger.warning('Parflow in environment {} exited with error '
+                               '(code {})'.format(env_name,
+                                                  process.returncode))
+        self.processes = []
+        if self.remove_environments and not self.reuse_outputs:
+            for env_name in self.env_names:
+                self.runner.remove_environment(env_name)
+
+    def release(self):
+        """ Remove the environments kept for reuse (if remove_environments
+            is set) """
+        if self.remove_environments and self._landuse_run is not None:
+            for env_name in self.env_names:
+                self.runner.remove_environment(env_name)
+        self.env_names = []
+        self._landuse_run = None
+
+    def wait_for_output(self, member, variable, number):
+        """ Block until the Parflow output file of a variable (e.g. press)
+            with the given dump number has been written by the run of the
+            ensemble member. Returns the full path to the file. """
+        script = self.runner.input_script
+        with timer('parflow'):
+            return wait_for_output(
+                self.directories[member],
+                output_filename(script, variable, number),
+                self.processes[member],
+                next_filename=output_filename(script, variable, number + 1),
+                poll_interval=self.poll_interval,
+                timeout=self.stream_timeout)
 
     def value(self, ts, scenario_index):
         # called once per timestep for each scenario
@@ -92,6 +362,27 @@ class ParflowRunnerParameter(Parameter):
     def directory(self):
         return self.runner.model_directory(self.env_name)
 
+    @property
+    def directories(self):
+        """ Model directories of all members of the forcing ensemble """
+        return [self.runner.model_directory(env_name)
+                for env_name in self.env_names]
+
+    def member_index(self, scenario_index):
+        """ Return the index of the forcing ensemble member (and model
+            directory) used in the scenario given in scenario_index """
+        if self._forcing_scenario_index is None:
+            return 0
+        return scenario_index.indices[self._forcing_scenario_index]
+
+    def first_dump(self, member):
+        """ Return the number of the first Parflow dump (output file) of the
+            run of an ensemble member; zero unless it restarted from a
+            spin-up state """
+        if not self.first_dumps:
+            return 0
+        return self.first_dumps[member]
+
     # Create an instance of the parameter from JSON
     @classmethod
     def load(cls, model, data):
@@ -103,10 +394,17 @@ class ParflowRunnerParameter(Parameter):
         parflow_args = data.pop("arguments", [])
         vegetation_coverage_filename = data.pop(
             "vegetation_coverage_filename", None)
+        # Optional parallel Parflow runs: [P, Q, R] and the MPI launcher
+        topology = data.pop("topology", None)
+        launcher = data.pop("launcher", None)
+        # Optional node-local scratch directory, e.g. "$TMPDIR"
+        staging_directory = data.pop("staging_directory", None)
         parflow_runner = ParflowRunner(
             parflow_script, parflow_args, parflow_directory,
             parflow_work_directory,
-            vegetation_coverage_filename=vegetation_coverage_filename)
+            vegetation_coverage_filename=vegetation_coverage_filename,
+            topology=topology, launcher=launcher,
+            staging_directory=staging_directory)
 
         if "vegetation_param" in data:
             # Load parameter from JSON
@@ -115,6 +413,22 @@ class ParflowRunnerParameter(Parameter):
         else:
             vegetation_param = None
 
+        if "forcing_scenario" in data:
+            data["forcing_scenario"] = model.scenarios[
+                data.pop("forcing_scenario")]
+
+        if "spinup" in data:
+            spinup = data.pop("spinup")
+            data["spinup_library"] = SpinupLibrary(
+                spinup["library"],
+                seed_from_nearest=spinup.get("seed_from_nearest", False),
+                max_distance=spinup.get("max_distance", None))
+            data["spinup_hours"] = spinup["hours"]
+            data["spinup_chunk"] = spinup.get("chunk_hours", None)
+            data["spinup_tolerance"] = spinup.get("tolerance", None)
+            data["spinup_measure"] = spinup.get("measure", "pressure")
+            data["spinup_period"] = spinup.get("period", 8760)
+
         return cls(model, parflow_runner,
                    vegetation_param=vegetation_param, **data)
 
@@ -129,6 +443,9 @@ class ParflowDischargeParameter(Parameter):
         Methods:
         -------------------------------------
         reset(self): read Parflow discharge before every PyWr run
+        slopes(self, directory): returns the slopes of the Parflow model
+        first_dump(self, member): returns the number of the first Parflow
+                                  dump read for an ensemble member
         value(self, ts, scenario_index): returns discharge from Parflow for a
                                          given timestep ts and scanario
         load(cls, model, data): loads the parameter from JSON
@@ -136,7 +453,9 @@ class ParflowDischargeParameter(Parameter):
     def __init__(self, model, runner_param, coordinates, *args, **kwargs):
         # called once when the parameter is created
         self.offset = kwargs.pop("offset", 0)
-        self.start_from = kwargs.pop("start_from")
+        # Number of the first Parflow dump used; if None, the first dump
+        # after the runner's spin-up (the start of the run without spin-up)
+        self.start_from = kwargs.pop("start_from", None)
 
         super().__init__(model, *args, **kwargs)
 
@@ -144,27 +463,90 @@ class ParflowDischargeParameter(Parameter):
         self.runner_param = runner_param
         self.coordinates = coordinates
         self.values = None
+        # Values already read from the outputs of a streamed run
+        self._loaded = None
+        self._slopes = None
+        # The slopes do not change between runs of the model
+        self._static_slopes = None
+        self._run_count = None
 
     def reset(self):
         """ Read Parflow discharge before every PyWr run before the first
-            time step """
+            time step. One row of values is read for each member of the
+            runner's forcing ensemble. """
         # called before each PyWr run
-        parflow_directory = self.runner_param.directory
-
-        for _, array in read_discharge(
-                parflow_directory, {self.name: self.coordinates},
-                self.start_from).items():
-                # resample_size=self.runner_param.resample_size).items():
-            self.values = array
-
-            #logger.info('Flow array: {}'.format(array))
+        if self.runner_param.streaming:
+            self._reset_streaming()
+            return
+        if self._run_count == self.runner_param.run_count:
+            return  # Parflow outputs reused; values already read
+        self._run_count = self.runner_param.run_count
+        values = []
+        for member, parflow_directory in enumerate(
+                self.runner_param.directories):
+            # Output files of restarted runs begin after the spin-up
+            start_from = max(
+                self.first_dump(member) - self.runner_param.first_dump(member),
+                0)
+            with timer('read'):
+                discharge = read_discharge(
+                    parflow_directory, {self.name: self.coordinates},
+                    start_from, slopes=self.slopes(parflow_directory))
+            for _, array in discharge.items():
+                    # resample_size=self.runner_param.resample_size).items():
+                values.append(array)
+
+                #logger.info('Flow array: {}'.format(array))
+        self.values = np.array(values)
 
     def value(self, ts, scenario_index):
         """Returns the value of the parameter, i.e. discharge from the Parflow
            model at a given timestep (ts) for a given scenario (scenario_index)
         """
         # called once per timestep for each scenario
-        return self.values[ts.index+self.offset]
+        member = self.runner_param.member_index(scenario_index)
+        index = ts.index+self.offset
+        if self.runner_param.streaming and not self._loaded[member, index]:
+            self.values[member, index] = self._read_streaming(member, index)
+            self._loaded[member, index] = True
+        return self.values[member, index]
+
+    def slopes(self, directory):
+        """ Return the slopes written by Parflow (read from directory on the
+            first call) """
+        if self._static_slopes is None:
+            self._static_slopes = read_slopes(directory)
+        return self._static_slopes
+
+    def first_dump(self, member):
+        """ Return the number of the first Parflow dump read for the run of
+            an ensemble member """
+        if self.start_from is None:
+            return self.runner_param.first_dump(member)
+        return self.start_from
+
+    def _reset_streaming(self):
+        """ Wait for the first pressure file of each run and read the slopes
+            (written by Parflow before the first time step) """
+        self._slopes = []
+        for member, directory in enumerate(self.runner_param.directories):
+            self.runner_param.wait_for_output(
+                member, 'press', self.runner_param.first_dump(member))
+            with timer('read'):
+                self._slopes.append(self.slopes(directory))
+        nt = len(self.model.timestepper) + self.offset
+        self.values = np.full((self.runner_param.num_members, nt), np.nan)
+        self._loaded = np.zeros(self.values.shape, dtype=bool)
+
+    def _read_streaming(self, member, index):
+        """ Wait for and read discharge from a single pressure file """
+        filename = self.runner_param.wait_for_output(
+            member, 'press', self.first_dump(member) + index)
+        with timer('read'):
+            data, _ = read(filename)
+        slpx, slpy, _ = self._slopes[member]
+        return discharge_from_pressure(
+            data, slpx, slpy, {self.name: self.coordinates})[self.name]
 
     # Create an instance of the parameter from JSON
     @classmethod
@@ -185,25 +567,73 @@ class ParflowEvapoTranspirationParameter(Parameter):
         Methods:
         -------------------------------------
         reset(self): read evapotranspiration before every PyWr run
+        first_dump(self, member): returns the number of the Parflow dump
+                                  the series of an ensemble member starts at
         value(self, ts, scenario_index): returns evapotranspiration for a
                                          given timestep ts and scanario
         load(cls, model, data): loads the parameter from JSON
+
+        As for discharge, start_from is the number of the Parflow dump the
+        series starts at (the first value sums the following dump interval)
+        and offset counts time steps from there. A start_from before the end
+        of the runner's spin-up can not be read from a restarted run and is
+        rejected.
     """
     def __init__(self, model, runner_param, *args, **kwargs):
         # called once when the parameter is created
         self.offset = kwargs.pop("offset", 0)
+        # Number of the Parflow dump the series starts at; if None, the end
+        # of the runner's spin-up (the start of the run without spin-up)
+        self.start_from = kwargs.pop("start_from", None)
         super().__init__(model, *args, **kwargs)
         runner_param.parents.add(self)
         self.runner_param = runner_param
         self.values = None
+        # Values already read from the outputs of a streamed run
+        self._loaded = None
+        self._run_count = None
+
+    # Number of the first evapotranspiration output (sums over the first dump
+    # interval)
+    FIRST_DUMP = 1
 
     def reset(self):
-        """ Read evapotranspiration before every PyWr run """
+        """ Read evapotranspiration before every PyWr run (for each member
+            of the runner's forcing ensemble) """
         # called before each PyWr run
-        parflow_directory = self.runner_param.directory
-        self.values = read_et(parflow_directory)
+        if self.runner_param.streaming:
+            for member in range(self.runner_param.num_members):
+                self.first_dump(member)  # check start_from
+            nt = len(self.model.timestepper) + self.offset
+            self.values = np.full((self.runner_param.num_members, nt), np.nan)
+            self._loaded = np.zeros(self.values.shape, dtype=bool)
+            return
+        if self._run_count == self.runner_param.run_count:
+            return  # Parflow outputs reused; values already read
+        self._run_count = self.runner_param.run_count
+        values = []
+        for member, parflow_directory in enumerate(
+                self.runner_param.directories):
+            # Output files of restarted runs begin after the spin-up
+            start = self.first_dump(member) - \
+                self.runner_param.first_dump(member)
+            with timer('read'):
+                values.append(read_et(parflow_directory)[start:])
+        self.values = np.array(values)
         # , resample_size=self.runner_param.resample_size)
 
+    def first_dump(self, member):
+        """ Return the number of the Parflow dump the series of an
+            ensemble member starts at """
+        first = self.runner_param.first_dump(member)
+        if self.start_from is None:
+            return first
+        if self.start_from < first:
+            raise ValueError('Evapotranspiration can not start from dump {} '
+                             'of a run restarted after a spin-up ending at '
+                             'dump {}.'.format(self.start_from, first))
+        return self.start_from
+
     def value(self, ts, scenario_index):
         """Returns the value of the parameter at a given timestep (ts) for a
            given scenario (scenario_index)"""
@@ -213,7 +643,17 @@ class ParflowEvapoTranspirationParameter(Parameter):
         #print("ts value: {}".format(ts))
         #print("ts index value: {}".format(ts.index))
         #print("self.values length: {}".format(len(self.values)))
-        return self.values[ts.index+self.offset]
+        member = self.runner_param.member_index(scenario_index)
+        index = ts.index+self.offset
+        if self.runner_param.streaming and not self._loaded[member, index]:
+            filename = self.runner_param.wait_for_output(
+                member, 'evaptranssum',
+                self.first_dump(member) + self.FIRST_DUMP + index)
+            with timer('read'):
+                data, _ = read(filename)
+            self.values[member, index] = np.sum(data)
+            self._loaded[member, index] = True
+        return self.values[member, index]
 
     # Create an instance of the ParflowEvapoTranspirationParameter from JSON
     @classmethod
@@ -230,17 +670,67 @@ ParflowEvapoTranspirationParameter.register()
 class ParflowVegetationParameter(Parameter):
     """ Class inheriting from Pywr Parameter Class defining a custom
         parameter used for reading vegetation info from parflow
+
+        Each decision variable is the index (in land_use_classes) of the
+        landuse of a management zone. By default every land surface tile is
+        a zone of its own. The tiles can be given as a 2-D grid matching
+        Parflow's NX x NY layout (grid) and grouped into zones with a map of
+        the zone of each cell (zones); the landuse of the cells is then
+        found from the decision variables by NumPy indexing.
+
+        Attributes:
+        -------------------------------------
+        land_use_classes: list
+            Parflow/CLM vegetation classes (1 to 18) which can be allocated
+        zones: numpy.ndarray
+            zone (decision variable) of each tile in the order of Parflow's
+            vegetation file (x varies fastest)
+        grid: tuple
+            (NX, NY) of the land surface grid, or None for a profile
+
         Methods:
         -------------------------------------
-        num_variable_tiles(self): returns and sets the number of tiles in Parflow
+        num_variable_tiles(self): returns and sets the number of zones
+        num_tiles(self): returns the number of land surface tiles
+        landuse_map(self): returns the landuse class of each tile
+        to_dense_fractional_coverage(self): returns the coverage of each
+                                            vegetation class for each tile
         to_sparse_fractional_coverage(self): returns a list with coverage values
         load(cls, model, data): loads the parameter from JSON
     """
-    def __init__(self, model, land_use_classes, num_variable_tiles, *args, **kwargs):
+    def __init__(self, model, land_use_classes, num_variable_tiles=None,
+                 grid=None, zones=None, *args, **kwargs):
         # called once when the parameter is created
         super().__init__(model, *args, **kwargs)
         self.land_use_classes = land_use_classes
-        self.num_variable_tiles = num_variable_tiles  # This sets integer_size
+        # Landuse classes (at most 18) are stored as int8
+        self._classes = np.asarray(land_use_classes, dtype=np.int8)
+        self.grid = tuple(grid) if grid is not None else None
+        if zones is not None:
+            zones = np.asarray(zones)
+            if self.grid is not None and \
+                    zones.shape != (self.grid[1], self.grid[0]):
+                raise ValueError('The zones map must have NY x NX = {} x {} '
+                                 'cells, not {}.'.format(
+                                     self.grid[1], self.grid[0], zones.shape))
+            zones = zones.ravel().astype(np.intp)
+            if zones.min() < 0:
+                raise ValueError('Zones must be numbered from zero.')
+            num_zones = int(zones.max()) + 1
+        else:
+            num_zones = self.grid[0] * self.grid[1] \
+                if self.grid is not None else num_variable_tiles
+            if num_zones is None:
+                raise ValueError('Either num_variable_tiles, grid or zones '
+                                 'must be given.')
+            zones = np.arange(num_zones)
+        if num_variable_tiles is not None and \
+                num_variable_tiles != num_zones:
+            raise ValueError('num_variable_tiles ({}) does not match the {} '
+                             'zones of the landuse grid.'.format(
+                                 num_variable_tiles, num_zones))
+        self.zones = zones
+        self.num_variable_tiles = num_zones  # This sets integer_size
         self.double_size = 0
         self._values = np.zeros(self.integer_size, dtype=np.int32)
 
@@ -252,20 +742,35 @@ class ParflowVegetationParameter(Parameter):
     def num_variable_tiles(self, value):
         self.integer_size = value
 
+    @property
+    def num_tiles(self):
+        """ Number of land surface tiles (rows of the vegetation file) """
+        return len(self.zones)
+
+    def landuse_map(self):
+        """ Return the landuse class of each tile (int8 array, NY x NX for a
+            grid) """
+        landuse = self._classes[self._values][self.zones]
+        if self.grid is not None:
+            landuse = landuse.reshape(self.grid[1], self.grid[0])
+        return landuse
+
+    def to_dense_fractional_coverage(self):
+        """ Returns the (num_tiles, 18) fractional coverage of each tile """
+        landuse = self._classes[self._values][self.zones]
+        coverage = np.zeros((self.num_tiles,
+                             VegetationTileFractionalCoverage.NUM_CLASSES))
+        # Use zero based indexing for writing the files
+        coverage[np.arange(self.num_tiles), landuse - 1] = 1.0
+        logger.debug('Allocated land classes (class: tiles): {}'.format(
+            dict(zip(*[v.tolist() for v in np.unique(landuse,
+                                                     return_counts=True)]))))
+        return coverage
+
     def to_sparse_fractional_coverage(self):
         """ Returns a list with coverage values for each tile """
-        coverage = []
-        print("Number of land surface tiles: "
-              + str(self.num_variable_tiles))
-        print("Number of land use classes: "
-              + str(len(self.land_use_classes)))
-        for i in range(self.num_variable_tiles):
-            land_use_class = self.land_use_classes[self._values[i]]
-            print("Allocated land class for tile {}: {}".
-                  format(i+1, land_use_class))
-            land_use_class -= 1  # Use zero based indexing for writing the files
-            coverage.append({land_use_class: 1.0})
-        return coverage
+        landuse = self._classes[self._values][self.zones] - 1
+        return [{land_use_class: 1.0} for land_use_class in landuse.tolist()]
 
     def set_integer_variables(self, values):
         self._values[...] = np.array(values, dtype=np.int32)
@@ -288,7 +793,14 @@ class ParflowVegetationParameter(Parameter):
     # create an instance of the parameter from JSON
     @classmethod
     def load(cls, model, data):
-        return cls(model, **data)
+        zones = data.pop("zones", None)
+        if isinstance(zones, str):
+            # Map of the zones in a .npy or text file
+            if zones.endswith('.npy'):
+                zones = np.load(zones)
+            else:
+                zones = np.loadtxt(zones, dtype=np.intp, ndmin=2)
+        return cls(model, zones=zones, **data)
 
 
 # register the name so it can be loaded from JSON
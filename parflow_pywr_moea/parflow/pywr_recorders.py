@@ -24,6 +24,10 @@ class ParflowVegetationDiversityRecorder(Recorder):
 
     """
 
+    # Values depend only on the landuse vector and can be computed before
+    # Parflow and Pywr run (used to pre-screen MOEA candidates)
+    PARFLOW_INDEPENDENT = True
+
     def __init__(self, model, vegetation_param, *args, **kwargs):
         super().__init__(model, *args, **kwargs)
         vegetation_param.parents.add(self)
@@ -31,17 +35,13 @@ class ParflowVegetationDiversityRecorder(Recorder):
 
     def values(self):
         """ Return diversity score. Diversity is the number of different landuse
-            types allocated to the model excluding non-green landuse types.
+            types allocated to the land surface cells of the model excluding
+            non-green landuse types.
 
             Identical for each scenario (JTomlinson)
         """
         # What is model.scenarios.combinations (ncomb)?
         ncomb = len(self.model.scenarios.combinations)
-        # Get vegetation types of int for all surface tiles
-        # The elements are indices of corresponding elements in landuse_classes
-        landuse_indices = self.vegetation_param.get_integer_variables()
-        # Get the list of landuse classes
-        landuse_classes = self.vegetation_param.land_use_classes
         # Define a list of land types which should not be featured in diversity
         # 13 - urban/built-up lands
         # 15 - snow and ice
@@ -49,8 +49,9 @@ class ParflowVegetationDiversityRecorder(Recorder):
         # 17 - water bodies
         # 18 - bare soil
         non_green_types = [13, 15, 16, 17, 18]
-        # Calculate a list of landuse types from the list of landuse indices
-        landuse_vector = [landuse_classes[i] for i in landuse_indices]
+        # Landuse class of every land surface tile (cell), so that zones
+        # without cells are not counted
+        landuse_vector = self.vegetation_param.landuse_map().ravel().tolist()
         # Number of distinct green landuse types on the arable surface of
         # the domain
         landuse_vector_green = [landuse for landuse in landuse_vector if
@@ -87,6 +88,9 @@ ParflowVegetationDiversityRecorder.register()
 
 class ParflowCropLandTypeNumberRecorder(Recorder):
 
+    # Depends only on the landuse vector
+    PARFLOW_INDEPENDENT = True
+
     def __init__(self, model, vegetation_param, *args, **kwargs):
         super().__init__(model, *args, **kwargs)
         vegetation_param.parents.add(self)
@@ -95,21 +99,17 @@ class ParflowCropLandTypeNumberRecorder(Recorder):
         self.crop_vals = [12]
 
     def values(self):
-        """ Return diversity score. Diversity is the number of different landuse
-            types allocated to the model.
+        """ Return the number of land surface tiles (cells, not management
+            zones) allocated to crops.
 
             Identical for each scenario (JTomlinson)
         """
         # What is model.scenarios.combinations (ncomb)?
         ncomb = len(self.model.scenarios.combinations)
 
-        # Get vegetation types of int for all surface tiles
-        # Returns a list with indices of vegetation_param.land_use_classes
-        landuse_types = self.vegetation_param.get_integer_variables()
-
-        # Find a list of landuse_classes from landuse_types (list of indices)
-        landuse_classes = [self.vegetation_param.land_use_classes[ind]
-                           for ind in landuse_types]
+        # Landuse class of every land surface tile (cell). With management
+        # zones, a zone of many cells counts once for each of its cells.
+        landuse_classes = self.vegetation_param.landuse_map().ravel().tolist()
 
         # Number of crop fields on the arable surface of the domain
         score = len(list(filter(lambda x: x in self.crop_vals,
@@ -148,6 +148,9 @@ ParflowCropLandTypeNumberRecorder.register()
 
 class ParflowBareSoilLandTypeNumberRecorder(Recorder):
 
+    # Depends only on the landuse vector
+    PARFLOW_INDEPENDENT = True
+
     def __init__(self, model, vegetation_param, *args, **kwargs):
         super().__init__(model, *args, **kwargs)
         vegetation_param.parents.add(self)
@@ -156,21 +159,17 @@ class ParflowBareSoilLandTypeNumberRecorder(Recorder):
         self.crop_vals = [18]
 
     def values(self):
-        """ Return diversity score. Diversity is the number of different landuse
-            types allocated to the model.
+        """ Return the number of land surface tiles (cells, not management
+            zones) allocated to bare soil.
 
             Identical for each scenario (JTomlinson)
         """
         # What is model.scenarios.combinations (ncomb)?
         ncomb = len(self.model.scenarios.combinations)
 
-        # Get vegetation types of int for all surface tiles
-        # Returns a list with indices of vegetation_param.land_use_classes
-        landuse_types = self.vegetation_param.get_integer_variables()
-
-        # Find a list of landuse_classes from landuse_types (list of indices)
-        landuse_classes = [self.vegetation_param.land_use_classes[ind]
-                           for ind in landuse_types]
+        # Landuse class of every land surface tile (cell). With management
+        # zones, a zone of many cells counts once for each of its cells.
+        landuse_classes = self.vegetation_param.landuse_map().ravel().tolist()
 
         # Number of crop fields on the arable surface of the domain
         score = len(list(filter(lambda x: x in self.crop_vals,
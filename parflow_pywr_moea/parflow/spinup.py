@@ -0,0 +1,170 @@
+""" This module defines SpinupLibrary class and functions measuring the
+    convergence of Parflow spin-up
+
+    SpinupLibrary class stores end-of-spin-up states (pressure field and CLM
+    restart files) of Parflow runs so that later evaluations of the same
+    landuse design can start from the spun-up state instead of simulating
+    the spin-up period again.
+
+    Functions:
+    ---------------------------------
+    porosity_value(keys): returns the (constant) porosity of the domain
+    subsurface_storage(saturation, porosity, deltax): returns total
+                                                      subsurface water storage
+    relative_change(previous, current): returns relative change of a
+                                        convergence measure
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+from collections import namedtuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# A state found in the library.
+# path: directory with the state files
+# hours: length of the spin-up that produced the state (in hours)
+# dump_number: number of the Parflow dump at the end of the spin-up
+# distance: number of tiles in which the landuse differs from the one
+#           requested (zero for an exact match)
+SpinupState = namedtuple('SpinupState', ['path', 'hours', 'dump_number',
+                                         'distance'])
+
+
+def porosity_value(keys):
+    """ Return the porosity of the domain from the pfset keys of a Parflow
+        script. Only a constant porosity is supported. """
+    if keys.get('Geom.domain.Porosity.Type') != 'Constant':
+        raise ValueError('Storage convergence requires a constant porosity '
+                         '(Geom.domain.Porosity.Type Constant).')
+    return float(keys['Geom.domain.Porosity.Value'])
+
+
+def subsurface_storage(saturation, porosity, deltax):
+    """ Return the total subsurface water storage (m^3) given the saturation
+        field and the grid spacing (dx, dy, dz) """
+    dx, dy, dz = deltax
+    return np.sum(saturation) * porosity * dx * dy * dz
+
+
+def relative_change(previous, current):
+    """ Return the relative change between two values (storage) or fields
+        (pressure) of a spin-up convergence measure """
+    previous = np.asarray(previous, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
+    scale = np.linalg.norm(previous)
+    if scale == 0:
+        scale = 1.0
+    return float(np.linalg.norm(current - previous) / scale)
+
+
+class SpinupLibrary:
+    """ Library of end-of-spin-up states keyed on the landuse vector (and
+        the meteorological forcing used for the spin-up).
+
+        Attributes:
+        -------------------------
+        directory: str
+            directory holding one subdirectory per stored state
+        seed_from_nearest: bool
+            if True, designs without a stored state are started from the
+            state of the nearest stored design (Hamming distance between
+            landuse vectors)
+        max_distance: int
+            largest distance at which a neighbour's state is used (None
+            means no limit)
+
+        Methods:
+        -------------------------
+        key(landuse, forcing): returns the key of a state
+        lookup(landuse, forcing): returns a SpinupState or None
+        store(landuse, forcing, runner, name, dump_number, hours): saves the
+            state of a Parflow environment into the library
+    """
+
+    # Name of the file with the metadata of each state
+    METADATA_FILENAME = 'spinup.json'
+
+    def __init__(self, directory, seed_from_nearest=False, max_distance=None):
+        self.directory = directory
+        self.seed_from_nearest = seed_from_nearest
+        self.max_distance = max_distance
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(landuse, forcing=''):
+        """ Return the key (hex digest) of the state of a landuse vector
+            spun up with the given forcing """
+        text = '{}|{}'.format(','.join(str(int(v)) for v in landuse), forcing)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _read_metadata(self, path):
+        with open(os.path.join(path, self.METADATA_FILENAME)) as fh:
+            return json.load(fh)
+
+    def _entries(self, forcing):
+        """ Yield (landuse, path) for all states spun up with forcing """
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            try:
+                metadata = self._read_metadata(path)
+            except (OSError, ValueError):
+                continue  # temporary directory or incomplete entry
+            if metadata['forcing'] == forcing:
+                yield metadata['landuse'], path
+
+    def _state(self, path, distance):
+        metadata = self._read_metadata(path)
+        return SpinupState(path, metadata['hours'], metadata['dump_number'],
+                           distance)
+
+    def lookup(self, landuse, forcing=''):
+        """ Return the SpinupState of landuse, the state of its nearest
+            neighbour (if seed_from_nearest) or None """
+        path = os.path.join(self.directory, self.key(landuse, forcing))
+        if os.path.exists(os.path.join(path, self.METADATA_FILENAME)):
+            return self._state(path, 0)
+        if not self.seed_from_nearest:
+            return None
+
+        landuse = np.asarray(landuse)
+        nearest = None
+        for other, other_path in self._entries(forcing):
+            other = np.asarray(other)
+            if other.shape != landuse.shape:
+                continue
+            distance = int(np.count_nonzero(other != landuse))
+            if nearest is None or distance < nearest[0]:
+                nearest = (distance, other_path)
+        if nearest is None or (self.max_distance is not None and
+                               nearest[0] > self.max_distance):
+            return None
+        logger.info('Seeding spin-up state from a design {} tiles '
+                    'away'.format(nearest[0]))
+        return self._state(nearest[1], nearest[0])
+
+    def store(self, landuse, forcing, runner, name, dump_number, hours):
+        """ Save the state at dump_number of the Parflow environment name
+            (managed by runner) as the state of landuse. Returns the stored
+            SpinupState. """
+        path = os.path.join(self.directory, self.key(landuse, forcing))
+        # Write into a temporary directory first so that other processes
+        # never see an incomplete state
+        tmp_path = tempfile.mkdtemp(dir=self.directory)
+        runner.save_state(name, dump_number, tmp_path)
+        with open(os.path.join(tmp_path, self.METADATA_FILENAME), 'w') as fh:
+            json.dump({'landuse': [int(v) for v in landuse],
+                       'forcing': forcing, 'hours': hours,
+                       'dump_number': dump_number}, fh)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process stored the same state in the meantime
+            shutil.rmtree(tmp_path)
+        logger.info('Stored spin-up state in {}'.format(path))
+        return self._state(path, 0)
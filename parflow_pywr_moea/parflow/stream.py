@@ -0,0 +1,81 @@
+""" Functions for consuming Parflow output files while Parflow is still
+    running (streaming coupling between Parflow and Pywr)
+
+    Functions:
+    --------------------------------------
+    output_filename: returns the name of a numbered Parflow output file
+    wait_for_output: blocks until a Parflow output file has been completely
+                     written by a running Parflow process
+"""
+
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def output_filename(input_script, variable, number):
+    """ Return the name of the Parflow output file for a variable and a
+        dump number, e.g. profile.out.press.00365.pfb """
+    return '{}.out.{}.{:05d}.pfb'.format(input_script, variable, number)
+
+
+def wait_for_output(directory, filename, process, next_filename=None,
+                    poll_interval=0.5, timeout=None):
+    """ Wait until Parflow has finished writing filename in directory.
+
+        Parameters
+        -----------------------------------
+        directory : str
+            Directory in which Parflow writes its outputs
+        filename : str
+            Name of the output file to wait for
+        process : subprocess.Popen
+            The running Parflow process
+        next_filename : str
+            Name of the file written after filename. Once it exists filename
+            is known to be complete. If None, filename is only considered
+            complete when Parflow has finished.
+        poll_interval : float
+            Time in seconds between checks of the directory
+        timeout : float
+            Maximum time in seconds to wait (None waits indefinitely)
+
+        Returns
+        -----------------------------------
+        path : str
+            Full path of the complete output file
+
+        Raises
+        -----------------------------------
+        RuntimeError
+            If Parflow exits with an error before the file is complete
+        FileNotFoundError
+            If Parflow finishes without writing the file
+        TimeoutError
+            If the file is not complete within timeout
+    """
+    path = os.path.join(directory, filename)
+    t0 = time.time()
+    while True:
+        if next_filename is not None and \
+                os.path.exists(os.path.join(directory, next_filename)):
+            return path
+        returncode = process.poll()
+        if returncode is not None:
+            if returncode != 0:
+                raise RuntimeError(
+                    'Parflow exited with error (code {}) in directory "{}" '
+                    'before writing "{}"'.format(returncode, directory,
+                                                 filename))
+            if not os.path.exists(path):
+                raise FileNotFoundError(
+                    'Parflow finished without writing "{}" in directory '
+                    '"{}"'.format(filename, directory))
+            return path
+        if timeout is not None and time.time() - t0 > timeout:
+            raise TimeoutError('Timed out after {}s waiting for "{}" in '
+                               'directory "{}"'.format(timeout, filename,
+                                                       directory))
+        time.sleep(poll_interval)
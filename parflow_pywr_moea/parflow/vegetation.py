@@ -2,8 +2,16 @@
 
     VegetationTileFractionalCoverage class contains methods to read fractional
     coverage in the Parflow/CLM model from and to the parflow DAT file.
+
+    The fractional coverage is held in an (ntiles, NUM_CLASSES) NumPy array.
+    The header lines and the leading columns of the DAT file (coordinates and
+    soil properties), which do not change between Parflow runs, are read
+    once into a template from which the file is written in one formatting
+    pass.
 """
 
+import numpy as np
+
 
 class VegetationTileFractionalCoverage:
     """ Wrapper around the DAT file specifying vegetation for Parflow tiles.
@@ -12,9 +20,12 @@ class VegetationTileFractionalCoverage:
         -------------------------
         NUM_CLASSES: int
             number of vegetation classes in the Parflow/CLM model (currently 18)
-        fractional_coverage: list
-            a list of fractional coverage numbers (between zero and one) for
-            each vegetation class and each tile in the Parflow modelling
+        VALUE_FORMAT: bytes
+            format of the fractional coverage values written to the DAT file
+        fractional_coverage: numpy.ndarray
+            (ntiles, NUM_CLASSES) array of fractional coverage numbers
+            (between zero and one) for each tile in the Parflow modelling and
+            each vegetation class
 
         Methods:
         -------------------------
@@ -22,23 +33,29 @@ class VegetationTileFractionalCoverage:
             reads fractional coverage from the .dat file, returns
             initialized instance of VegetationTileFractionalCoverage
             with fractional_coverage values from the .dat files
-        rewrite_to(self, filename)
+        read_template(cls, filename)
+            reads the header lines and leading columns of the .dat file
+        rewrite_to(self, filename, template=None)
             writes fractional_coverage to the DAT file specified in filename
     """
 
     # Number of vegetation classes in the Parflow/CLM model
     NUM_CLASSES = 18
 
+    # Format of the fractional coverage values
+    VALUE_FORMAT = b'%.12g'
+
     # Initialise VegetationTileFractionalCoverage class object with a vector of
     # values specified in fractional_coverage
     def __init__(self, fractional_coverage):
-        self.fractional_coverage = fractional_coverage
+        self.fractional_coverage = np.asarray(fractional_coverage,
+                                              dtype=np.float64)
         """
         Parameters
         --------------------
-        fractional_coverage: list
-            Two-dimensional list with fractional coverage for each vegetation
-            class and for each segment of the profile
+        fractional_coverage: array_like
+            Two-dimensional array with fractional coverage for each segment of
+            the profile (tile) and for each vegetation class
         """
 
     # Class method that belongs to the class, not the object of the class
@@ -57,20 +74,36 @@ class VegetationTileFractionalCoverage:
         Instantiated VegetationTileFractionalCoverage class object with
         fractional coverage read from the file
         """
+        with open(filename, 'rb') as fh:
+            # Skip two header lines in the .dat file
+            rows = fh.readlines()[2:]
+        # Fractional coverage is given in the final NUM_CLASSES columns
+        fractional_coverage = np.array(
+            [row.split()[-cls.NUM_CLASSES:] for row in rows], dtype=np.float64)
+        return cls(fractional_coverage.reshape(len(rows), cls.NUM_CLASSES))
+
+    @classmethod
+    def read_template(cls, filename):
+        """ Read the parts of a .dat file which rewrite_to keeps.
+
+        Parameters
+        --------------------
+        filename: str
+            name of the .dat file
 
-        fractional_coverage = []
-        with open(filename) as fh:
-            for i, row in enumerate(fh.readlines()):
-                if i < 2:  # Skip two header lines in the .dat file
-                    continue
-                # Fractional coverage is given in the final NUM_CLASSES columns
-                data = row.split()[-cls.NUM_CLASSES:]
-                # convert to floats
-                data = [float(v) for v in data]
-                fractional_coverage.append(data)
-        return cls(fractional_coverage)
-
-    def rewrite_to(self, filename):
+        Returns
+        --------------------
+        Tuple of the two header lines (bytes) and an array (of bytes objects)
+        with the columns before the fractional coverage of each row
+        """
+        with open(filename, 'rb') as fh:
+            rows = fh.readlines()
+        leading = np.empty(len(rows) - 2, dtype=object)
+        leading[:] = [b' '.join(row.split()[:-cls.NUM_CLASSES])
+                      for row in rows[2:]]
+        return b''.join(rows[:2]), leading
+
+    def rewrite_to(self, filename, template=None):
         """ Writes fractional coverage data into a .dat file specified in filename
 
         Parameters
@@ -78,6 +111,9 @@ class VegetationTileFractionalCoverage:
         filename: str
             name of the .dat file which will have fractional coverage data
             written to
+        template: tuple
+            header lines and leading columns of the file returned by
+            read_template (read from filename if not given)
 
         Raises
         --------------------
@@ -87,25 +123,27 @@ class VegetationTileFractionalCoverage:
         Value Error
             If total fractional coverage is not equal 1.0
         """
-        with open(filename) as fh:
-            rows = list(fh.readlines())
+        if template is None:
+            template = self.read_template(filename)
+        headers, leading = template
+        coverage = self.fractional_coverage
 
-        if len(rows) - 2 != len(self.fractional_coverage):
+        if len(leading) != len(coverage):
             raise ValueError("Mismatch length of new fractional coverage \
                              data({}) and existing fractional"
                              "coverage data ({})."
-                             .format(len(rows)-2,
-                                     len(self.fractional_coverage)))
-
-        with open(filename, 'w') as fh:
-            # write headers
-            for i in range(2):
-                fh.write(rows[i])
-            for i, (row, fc) in enumerate(zip(rows[2:],
-                                              self.fractional_coverage)):
-                if abs(sum(fc) - 1.0) > 1e-6:
-                    raise ValueError('Total fractional coverage does not equal \
-                                     1.0.')
-                # Use new data for writing data lines
-                data = row.split()[:-self.NUM_CLASSES] + [str(v) for v in fc]
-                fh.write(' '.join(data) + '\n')
+                             .format(len(leading), len(coverage)))
+        if np.any(np.abs(coverage.sum(axis=1) - 1.0) > 1e-6):
+            raise ValueError('Total fractional coverage does not equal \
+                             1.0.')
+
+        # Table of the leading columns and the values of each row, formatted
+        # with a single format string repeated for every row
+        table = np.empty((len(coverage), self.NUM_CLASSES + 1), dtype=object)
+        table[:, 0] = leading
+        table[:, 1:] = coverage
+        row_format = b' '.join([b'%s'] + [self.VALUE_FORMAT] *
+                               self.NUM_CLASSES) + b'\n'
+        with open(filename, 'wb') as fh:
+            fh.write(headers)
+            fh.write(row_format * len(coverage) % tuple(table.ravel()))
@@ -3,16 +3,19 @@
 
     Instantiates/return a reference to a LOGGER object with name specified as
     __name__, i.e. module's name
+
+    The database clients (mongoengine and pyreto_db, requests) are imported
+    by the recorders using them, so that registering the recorders does not
+    import them.
 """
 import logging
 import json
 import uuid
 import os
 import datetime
-import requests
+import numpy as np
 from pywr.recorders import Recorder
-from pyreto_db import documents
-import mongoengine as me
+from .telemetry import timer
 
 # instantiate logger for logging errors, warnings and other communication
 logger = logging.getLogger(__name__)
@@ -26,6 +29,8 @@ class PyretoDBDirectRecorder(Recorder):
         self.db = kwargs.pop('db')
         super().__init__(*args, **kwargs)
         self.created_at = None
+        self._client = None
+        self._search = None
 
         # Make this recorder dependent on all existing components
         for component in self.model.components:
@@ -40,8 +45,19 @@ class PyretoDBDirectRecorder(Recorder):
             'db': self.db
         }
 
+    def connect(self):
+        """ Open a connection to the database kept by this process for all
+            the individuals it saves (otherwise each save connects) """
+        import mongoengine as me
+        from pyreto_db import documents
+        if self._client is None:
+            self._client = me.connect(**self.connection_kwargs)
+            self._search = documents.Search.objects(
+                id=self.search_id).first()
+
     def _generate_variable_documents(self):
         """ """
+        from pyreto_db import documents
         for variable in self.model.variables:
 
             if variable.double_size > 0:
@@ -66,6 +82,7 @@ class PyretoDBDirectRecorder(Recorder):
 
     def _generate_metric_documents(self):
         """ """
+        from pyreto_db import documents
         for recorder in self.model.recorders:
 
             try:
@@ -94,15 +111,21 @@ class PyretoDBDirectRecorder(Recorder):
         if self.created_at is None:
             self.created_at = datetime.datetime.now()
 
+    @timer('save')
     def finish(self):
         """ """
         import time
+        import mongoengine as me
+        from pyreto_db import documents
         logger.info('Saving individual to MongoDB.')
         t0 = time.time()
 
-        # Connect to the database
-        client = me.connect(**self.connection_kwargs)
-        search = documents.Search.objects(id=self.search_id).first()
+        # Connect to the database (unless a connection is kept open)
+        if self._client is not None:
+            client, search = None, self._search
+        else:
+            client = me.connect(**self.connection_kwargs)
+            search = documents.Search.objects(id=self.search_id).first()
 
         evaluated_at = datetime.datetime.now()
         # TODO runtime statistics
@@ -116,7 +139,8 @@ class PyretoDBDirectRecorder(Recorder):
 
         individual.save()
         logger.info('Save complete in {:.2f}s'.format(time.time() - t0))
-        client.close()
+        if client is not None:
+            client.close()
 
 
 # register the name so it can be loaded from JSON
@@ -131,12 +155,20 @@ class PyretoDBRequestRecorder(Recorder):
         self.db = kwargs.pop('db')
         super().__init__(*args, **kwargs)
         self.created_at = None
+        self._session = None
 
         # Make this recorder dependent on all existing components
         for component in self.model.components:
             if component is not self:
                 self.children.add(component)
 
+    def connect(self):
+        """ Open an HTTP session kept by this process for all the
+            individuals it saves (otherwise each save connects) """
+        import requests
+        if self._session is None:
+            self._session = requests.Session()
+
     def _generate_variable_documents(self):
         """ """
         for variable in self.model.variables:
@@ -197,9 +229,11 @@ class PyretoDBRequestRecorder(Recorder):
         return '{}/{}/searches/{}/individuals'.format(
             self.url, self.db, self.search_id)
 
+    @timer('save')
     def finish(self):
         """ """
         import time
+        import requests
         url = self._make_insert_url()
         logger.info('Saving individual to PyretoDB via HTTP: {}'.format(url))
         t0 = time.time()
@@ -213,7 +247,7 @@ class PyretoDBRequestRecorder(Recorder):
             evaluated_at=evaluated_at.isoformat(),
         )
 
-        response = requests.post(url, json=individual)
+        response = (self._session or requests).post(url, json=individual)
         if response.status_code != 200:
             logger.error('Failed to save individual to PyretoDB. Status code:\
                          {}'.format(response.status_code))
@@ -232,28 +266,40 @@ PyretoDBRequestRecorder.register()
 
 
 class PyretoDBJSONRecorder(Recorder):
-    """ Recorder used to save MOEA search results to JSON files """
+    """ Recorder used to save MOEA search results to JSON files
+
+        If batch_scenario is given, every member of that scenario is a
+        separate individual (see ScenarioBatchParameter) and one file is
+        written per member.
+    """
     # This recorder is currently in use in our simulation runs
     def __init__(self, *args, **kwargs):
         self.search_id = kwargs.pop('search_id')
         self.url = kwargs.pop('url')
         self.db = kwargs.pop('db')
+        self.batch_scenario = kwargs.pop('batch_scenario', None)
         super().__init__(*args, **kwargs)
         self.created_at = None
+        # Number of batch members holding real individuals (the remaining
+        # members only pad the batch and are not saved)
+        self.active_members = None
 
         # Make this recorder dependent on all existing components
         for component in self.model.components:
             if component is not self:
                 self.children.add(component)
 
-    def _generate_variable_documents(self):
+    def _generate_variable_documents(self, member=None):
         """ """
         for variable in self.model.variables:
 
             if variable.double_size > 0:
                 upper = variable.get_double_upper_bounds()
                 lower = variable.get_double_lower_bounds()
-                values = variable.get_double_variables()
+                if member is not None and hasattr(variable, 'batch_values'):
+                    values = variable.batch_values[member:member+1]
+                else:
+                    values = variable.get_double_variables()
                 for i in range(variable.double_size):
                     yield dict(
                         name='{}[d{}]'.format(variable.name, i),
@@ -270,17 +316,22 @@ class PyretoDBJSONRecorder(Recorder):
                         value=int(values[i]), upper_bounds=int(upper[i]),
                         lower_bounds=int(lower[i]))
 
-    def _generate_metric_documents(self):
+    def _generate_metric_documents(self, member=None):
         """ """
         for recorder in self.model.recorders:
 
             try:
-                value = float(recorder.aggregated_value())
+                if member is None:
+                    value = float(recorder.aggregated_value())
+                else:
+                    value = float(np.array(recorder.values())[member])
             except NotImplementedError:
                 value = None
 
             try:
                 df = recorder.to_dataframe()
+                if member is not None:
+                    df = df.iloc[:, [member]]
                 df = df.to_json(orient='split')
             except AttributeError:
                 df = None
@@ -306,28 +357,40 @@ class PyretoDBJSONRecorder(Recorder):
         return os.path.join(self.url.split('://', 1)[1], self.db,
                             self.search_id, uuid.uuid4().hex+'.json')
 
+    def _members(self):
+        """ Return the batch members to save (None if not in batch mode) """
+        if self.batch_scenario is None:
+            return [None]
+        size = self.model.scenarios[self.batch_scenario].size
+        if self.active_members is not None:
+            size = min(size, self.active_members)
+        return list(range(size))
+
+    @timer('save')
     def finish(self):
         """ """
         import time
-        fn = self._make_filename()
-        logger.info('Saving individual to PyretoDB to JSON: {}'.format(fn))
         t0 = time.time()
 
         evaluated_at = datetime.datetime.now()
 
-        # TODO runtime statistics
-        individual = dict(
-            variables=list(self._generate_variable_documents()),
-            metrics=list(self._generate_metric_documents()),
-            created_at=self.created_at.isoformat(),
-            evaluated_at=evaluated_at.isoformat(),
-        )
+        for member in self._members():
+            fn = self._make_filename()
+            logger.info('Saving individual to PyretoDB to JSON: {}'.format(fn))
+
+            # TODO runtime statistics
+            individual = dict(
+                variables=list(self._generate_variable_documents(member)),
+                metrics=list(self._generate_metric_documents(member)),
+                created_at=self.created_at.isoformat(),
+                evaluated_at=evaluated_at.isoformat(),
+            )
 
-        # Make sure directory exists
-        os.makedirs(os.path.split(fn)[0], exist_ok=True)
+            # Make sure directory exists
+            os.makedirs(os.path.split(fn)[0], exist_ok=True)
 
-        with open(fn, mode='w') as fh:
-            json.dump(individual, fh)
+            with open(fn, mode='w') as fh:
+                json.dump(individual, fh)
         logger.info('Save complete in {:.2f}s'.format(time.time() - t0))
 
 
@@ -0,0 +1,119 @@
+""" This module defines snapshots of the non-dominated archive written while
+    a MOEA search is running
+
+    The archive is updated incrementally on the master process after every
+    step of the algorithm. Snapshots are written in a columnar NumPy format
+    (.npz with "variables", "objectives", "constraints" and "nfe" arrays) so
+    that the convergence of a search can be monitored without exporting the
+    results of individual evaluations.
+
+    Functions:
+    ---------------------------------
+    snapshot_filename(search_name): returns the snapshot file of a search
+    save_snapshot(solutions, filename, nfe): writes a snapshot atomically
+    load_snapshot(filename): reads a snapshot into a dictionary of arrays
+
+    Classes:
+    ---------------------------------
+    ArchiveSnapshotExtension(Extension): keeps the non-dominated archive of
+        a run and writes snapshots of it
+"""
+
+import os
+import logging
+import numpy as np
+from platypus.core import Archive, EpsilonBoxArchive
+from platypus.extensions import Extension
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+
+def snapshot_filename(search_name):
+    """ Return the name of the archive snapshot file of a search """
+    return 'archive_{}.npz'.format(search_name)
+
+
+def save_snapshot(solutions, filename, nfe):
+    """ Write the variables, objectives and constraints of solutions to
+        filename. The file is replaced atomically. """
+    def columns(attr):
+        return np.array([list(getattr(s, attr)) for s in solutions],
+                        dtype=np.float64)
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as fh:
+        np.savez_compressed(fh, variables=columns('variables'),
+                            objectives=columns('objectives'),
+                            constraints=columns('constraints'),
+                            nfe=np.array(nfe))
+    os.replace(tmp_filename, filename)
+
+
+def load_snapshot(filename):
+    """ Return the arrays of a snapshot as a dictionary """
+    with np.load(filename) as data:
+        return {key: data[key] for key in data.files}
+
+
+class ArchiveSnapshotExtension(Extension):
+    """ Platypus extension keeping an (optionally epsilon-box) archive of the
+        non-dominated solutions found in a run. The solutions of the
+        algorithm's result (or those returned by source, if given) are added
+        after every step and a snapshot is written every interval
+        evaluations and at the end of the run. Solutions offered in the
+        previous step or already in the archive are not offered again, so
+        that the memory used does not grow with the length of the run.
+
+        Attributes:
+        -------------------------
+        archive: Archive or EpsilonBoxArchive
+            non-dominated feasible and infeasible solutions found so far
+    """
+
+    def __init__(self, filename, interval, epsilons=None, source=None):
+        super().__init__()
+        self.filename = filename
+        self.interval = interval
+        self.source = source
+        if epsilons:
+            self.archive = EpsilonBoxArchive(epsilons)
+        else:
+            self.archive = Archive()
+        self.last_nfe = None
+        self._offered = set()
+
+    def start_run(self, algorithm):
+        self.last_nfe = algorithm.nfe
+
+    def post_step(self, algorithm):
+        if self.source is not None:
+            solutions = self.source()
+        else:
+            solutions = getattr(algorithm, 'result', None) or []
+        archived = set(map(self._key, self.archive))
+        offered = set()
+        for solution in solutions:
+            if not solution.evaluated:
+                continue
+            key = self._key(solution)
+            offered.add(key)
+            if key not in self._offered and key not in archived:
+                archived.add(key)
+                self.archive.add(solution)
+        self._offered = offered
+        if algorithm.nfe - self.last_nfe >= self.interval:
+            self.save(algorithm.nfe)
+
+    def end_run(self, algorithm):
+        self.save(algorithm.nfe)
+
+    @staticmethod
+    def _key(solution):
+        return (tuple(solution.variables), tuple(solution.objectives))
+
+    def save(self, nfe):
+        save_snapshot(list(self.archive), self.filename, nfe)
+        self.last_nfe = nfe
+        logger.info('Archive snapshot after {} evaluations: {} solutions '
+                    '({})'.format(nfe, len(self.archive), self.filename))
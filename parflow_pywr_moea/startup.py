@@ -0,0 +1,90 @@
+""" This module defines the startup benchmark of the command line interface
+
+    The subcommands of the command line interface import the modules they
+    use when they run (see cli.COMMAND_IMPORTS). The benchmark measures, in
+    a fresh interpreter for each subcommand, the time spent importing the
+    command line interface and the modules of the subcommand, and compares
+    it with the startup budget of the subcommand. "--help" measures the
+    command line interface on its own.
+
+    Functions:
+    ---------------------------------
+    import_time(modules, repeat): returns the shortest time of importing
+                                  modules in a fresh interpreter
+    benchmark(command_imports, budgets, repeat): measures the startup time
+        of each subcommand
+"""
+
+import sys
+import subprocess
+
+# Startup budgets (seconds) of the subcommands. The MOEA search, the
+# worker and the Pywr run load Pywr, Platypus and the database clients;
+# the other subcommands must start quickly.
+DEFAULT_BUDGETS = {
+    '--help': 0.25,
+    'read-parflow-results': 0.5,
+    'run-parflow-batch': 1.5,
+    'run': 4.0,
+    'plot': 3.0,
+    'search': 4.0,
+    'import-results': 1.0,
+    'archive-summary': 1.5,
+    'worker': 4.0,
+    'startup-benchmark': 0.5,
+}
+
+# Budget of subcommands missing from the budgets
+DEFAULT_BUDGET = 1.0
+
+# Script printing the time spent importing the modules given as arguments
+_SCRIPT = '''
+import sys, time, importlib
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    importlib.import_module(module)
+print(time.perf_counter() - start)
+'''
+
+
+def import_time(modules, repeat=3):
+    """ Return the shortest time (seconds) of importing modules in a fresh
+        interpreter among repeat measurements. Raises ImportError if a
+        module can not be imported. """
+    times = []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-c', _SCRIPT] +
+                                 list(modules), capture_output=True,
+                                 text=True)
+        if process.returncode != 0:
+            lines = process.stderr.strip().splitlines()
+            raise ImportError(lines[-1] if lines else 'exit code {}'.format(
+                process.returncode))
+        times.append(float(process.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+
+def benchmark(command_imports, budgets=None, repeat=3):
+    """ Measure the startup time of the command line interface ("--help")
+        and of each subcommand in command_imports (a dictionary of the
+        modules imported by each subcommand). Returns a list of dictionaries
+        with the "command", its "seconds" (None if a module could not be
+        imported), its "budget" and an "error" message (None if the startup
+        time is within the budget). """
+    budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+    commands = [('--help', ())] + sorted(command_imports.items())
+    results = []
+    for command, modules in commands:
+        budget = budgets.get(command, DEFAULT_BUDGET)
+        result = {'command': command, 'seconds': None, 'budget': budget,
+                  'error': None}
+        try:
+            result['seconds'] = import_time(
+                ('parflow_pywr_moea.cli', ) + tuple(modules), repeat)
+        except ImportError as error:
+            result['error'] = str(error)
+        else:
+            if result['seconds'] > budget:
+                result['error'] = 'over budget'
+        results.append(result)
+    return results
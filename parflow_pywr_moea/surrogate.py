@@ -0,0 +1,204 @@
+""" This module defines surrogate models used to pre-screen MOEA offspring
+    before they are evaluated with the integrated Pywr / Parflow model
+
+    Classes:
+    ---------------------------------
+    RidgeRegressor: linear least-squares regressor with L2 regularisation
+    NearestNeighboursRegressor: k-nearest neighbours regressor
+    Surrogate: predicts objectives from decision vectors, trained on the
+               evaluated solutions of the search
+
+    Both regressors follow the scikit-learn interface (fit(X, y) and
+    predict(X)), so any scikit-learn regressor supporting multiple outputs
+    can be used in their place.
+"""
+
+import logging
+import numpy as np
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+
+class RidgeRegressor:
+    """ Ridge regression solved with NumPy (no intercept penalty) """
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.coef_ = None
+        self.intercept_ = None
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        x_mean = X.mean(axis=0)
+        y_mean = y.mean(axis=0)
+        Xc = X - x_mean
+        A = Xc.T @ Xc + self.alpha * np.eye(X.shape[1])
+        self.coef_ = np.linalg.solve(A, Xc.T @ (y - y_mean))
+        self.intercept_ = y_mean - x_mean @ self.coef_
+        return self
+
+    def predict(self, X):
+        return np.asarray(X, dtype=np.float64) @ self.coef_ + self.intercept_
+
+
+class NearestNeighboursRegressor:
+    """ Predicts the distance-weighted mean of the k nearest training
+        points """
+
+    def __init__(self, n_neighbors=5):
+        self.n_neighbors = n_neighbors
+        self._X = None
+        self._y = None
+
+    def fit(self, X, y):
+        self._X = np.asarray(X, dtype=np.float64)
+        self._y = np.asarray(y, dtype=np.float64)
+        return self
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        k = min(self.n_neighbors, len(self._X))
+        distances = np.sqrt(((X[:, None, :] - self._X[None, :, :])**2).sum(
+            axis=2))
+        nearest = np.argsort(distances, axis=1)[:, :k]
+        weights = 1.0 / (np.take_along_axis(distances, nearest, axis=1) +
+                         1e-12)
+        weights /= weights.sum(axis=1, keepdims=True)
+        return np.einsum('ij,ijk->ik', weights, self._y[nearest])
+
+
+def _nondominated(objectives):
+    """ Return the rows of objectives (minimised) not dominated by another
+        row """
+    dominated = np.zeros(len(objectives), dtype=bool)
+    for i, row in enumerate(objectives):
+        dominated[i] = np.any(np.all(objectives <= row, axis=1) &
+                              np.any(objectives < row, axis=1))
+    return objectives[~dominated]
+
+
+REGRESSORS = {
+    'ridge': RidgeRegressor,
+    'knn': NearestNeighboursRegressor,
+}
+
+
+class Surrogate:
+    """ Surrogate of the objectives of the integrated model.
+
+        Decision vectors are encoded with one-hot landuse classes for the
+        integer (landuse) variables and scaled values for the real
+        (control-curve) variables. The regressor is refitted on all
+        evaluated feasible solutions whenever new ones have been added.
+
+        Attributes:
+        -------------------------
+        regressor: object
+            scikit-style regressor with fit and predict methods
+        min_samples: int
+            number of evaluated solutions required before predicting
+
+        Methods:
+        -------------------------
+        from_wrapper(cls, wrapper, regressor, min_samples): creates a
+            surrogate for the decision variables of a Pywr optimisation
+            wrapper
+        encode(self, variables): returns the features of decision vectors
+        add(self, solutions): adds evaluated solutions to the training set
+        ready(self): returns True if the surrogate can predict
+        front(self): returns the non-dominated objectives of the training set
+        predict(self, variables): returns predicted objectives
+        accuracy(predicted, evaluated): returns the rank correlation between
+            predicted and evaluated values of each objective
+    """
+
+    def __init__(self, lower, upper, integer, regressor='ridge',
+                 min_samples=20):
+        self.lower = np.asarray(lower, dtype=np.float64)
+        self.upper = np.asarray(upper, dtype=np.float64)
+        self.integer = np.asarray(integer, dtype=bool)
+        if isinstance(regressor, str):
+            regressor = REGRESSORS[regressor]()
+        self.regressor = regressor
+        self.min_samples = min_samples
+        self._X = []
+        self._y = []
+        self._fitted = 0
+        self._front = np.empty((0, 0))
+
+    @classmethod
+    def from_wrapper(cls, wrapper, regressor='ridge', min_samples=20):
+        """ Create a surrogate for the decision vector of wrapper """
+        lower, upper, integer = [], [], []
+        for var in wrapper.model_variables:
+            if var.double_size > 0:
+                lower.extend(var.get_double_lower_bounds())
+                upper.extend(var.get_double_upper_bounds())
+                integer.extend([False] * var.double_size)
+            if var.integer_size > 0:
+                lower.extend(var.get_integer_lower_bounds())
+                upper.extend(var.get_integer_upper_bounds())
+                integer.extend([True] * var.integer_size)
+        return cls(lower, upper, integer, regressor=regressor,
+                   min_samples=min_samples)
+
+    def encode(self, variables):
+        """ Return the feature matrix of a list of decision vectors """
+        x = np.atleast_2d(np.asarray(variables, dtype=np.float64))
+        span = np.where(self.upper > self.lower, self.upper - self.lower, 1.0)
+        features = [(x[:, ~self.integer] - self.lower[~self.integer]) /
+                    span[~self.integer]]
+        for i in np.flatnonzero(self.integer):
+            classes = np.arange(self.lower[i], self.upper[i] + 1)
+            features.append(np.round(x[:, i:i+1]) == classes[None, :])
+        return np.hstack(features).astype(np.float64)
+
+    def add(self, solutions):
+        """ Add evaluated feasible solutions to the training set """
+        for solution in solutions:
+            if solution.evaluated and solution.feasible:
+                self._X.append(list(solution.variables))
+                self._y.append(list(solution.objectives))
+
+    def ready(self):
+        """ Return True if the surrogate has enough data to predict """
+        if len(self._X) < self.min_samples:
+            return False
+        if self._fitted < len(self._X):
+            y = np.array(self._y)
+            self.regressor.fit(self.encode(self._X), y)
+            # Only solutions of the previous front and new solutions can be
+            # on the new front
+            self._front = _nondominated(np.vstack(
+                [self._front.reshape(-1, y.shape[1]), y[self._fitted:]]))
+            self._fitted = len(self._X)
+        return True
+
+    def front(self):
+        """ Return the non-dominated objective vectors of the training set
+            (as of the last fit) """
+        return self._front
+
+    def predict(self, variables):
+        """ Return the predicted objectives of a list of decision vectors """
+        return np.atleast_2d(self.regressor.predict(self.encode(variables)))
+
+    @staticmethod
+    def accuracy(predicted, evaluated):
+        """ Return the Spearman rank correlation between predicted and
+            evaluated values of each objective """
+        predicted = np.asarray(predicted, dtype=np.float64)
+        evaluated = np.asarray(evaluated, dtype=np.float64)
+        if len(predicted) < 2:
+            return [np.nan] * predicted.shape[1]
+        correlations = []
+        for p, e in zip(predicted.T, evaluated.T):
+            rp = np.argsort(np.argsort(p))
+            re = np.argsort(np.argsort(e))
+            if np.std(rp) == 0 or np.std(re) == 0:
+                correlations.append(np.nan)
+            else:
+                correlations.append(float(np.corrcoef(rp, re)[0, 1]))
+        return correlations
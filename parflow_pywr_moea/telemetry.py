@@ -0,0 +1,240 @@
+""" This module defines the telemetry of MOEA searches
+
+    Workers time the phases of each evaluation (Parflow runs, reading of
+    Parflow outputs, saving of results; the remaining time is spent in
+    Pywr) with the timer context manager. The times are returned to the
+    master with the evaluated job (see TimedJob), where Telemetry aggregates
+    them with the evaluation rate, the busy fraction of each worker and the
+    hit rate of the evaluation cache. The metrics are appended periodically
+    to a JSON lines file.
+
+    Functions:
+    ---------------------------------
+    timer(phase): context manager adding the time spent in its block to a
+                  phase of the current evaluation
+    reset_timings(): clears the phase times of the current process
+    timings(): returns the phase times of the current process
+    set_startup_time(seconds): records the start-up time of the worker
+                               process
+    metrics_filename(search_name): returns the metrics file of a search
+
+    Classes:
+    ---------------------------------
+    TimedJob(Job): runs a job and records the phase times of its evaluation
+    Telemetry: aggregates the metrics of a search and writes them to a file
+    TelemetryEvaluator(Evaluator): records the metrics of evaluated jobs
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import contextlib
+from collections import defaultdict
+import numpy as np
+from platypus.evaluator import Evaluator, Job
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+# Phases timed in the workers. The time not spent in these phases is
+# reported as "pywr".
+PHASES = ('parflow', 'read', 'save')
+
+# Upper bounds (seconds) of the buckets of the latency histograms
+BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0, 1800.0,
+           3600.0, float('inf'))
+
+# Phase times of the evaluation running in this process
+_timings = defaultdict(float)
+
+# Seconds spent preparing this worker process (see warmup.py)
+_startup_time = None
+
+
+@contextlib.contextmanager
+def timer(phase):
+    """ Add the time spent in the block to the given phase """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timings[phase] += time.perf_counter() - start
+
+
+def reset_timings():
+    """ Clear the phase times of the current process """
+    _timings.clear()
+
+
+def timings():
+    """ Return a copy of the phase times of the current process """
+    return dict(_timings)
+
+
+def set_startup_time(seconds):
+    """ Record the start-up time of the current (worker) process """
+    global _startup_time
+    _startup_time = seconds
+
+
+def metrics_filename(search_name):
+    """ Return the name of the metrics file of a search """
+    return 'metrics_{}.jsonl'.format(search_name)
+
+
+class TimedJob(Job):
+    """ Job running another job and recording the worker (and its
+        start-up time), start and end times and the phase times of the
+        evaluation """
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+        self.worker = None
+        self.start = None
+        self.end = None
+        self.timings = None
+        self.startup = None
+
+    def run(self):
+        reset_timings()
+        self.worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.startup = _startup_time
+        self.start = time.time()
+        self.job.run()
+        self.end = time.time()
+        self.timings = timings()
+
+
+class Telemetry:
+    """ Aggregates the metrics of a search and appends them to a JSON lines
+        file every interval seconds.
+
+        Each line holds the number of evaluations, the evaluation rate (per
+        minute, since the previous line and since the start), the latency
+        histograms and percentiles of each phase, the busy fraction and
+        start-up time of each worker and the hit rate of the evaluation
+        cache.
+
+        Attributes:
+        -------------------------
+        filename: str
+            JSON lines file to which the metrics are appended
+        interval: float
+            seconds between two lines of metrics
+        cache: EvaluationCache
+            optional evaluation cache whose hit rate is reported
+
+        Methods:
+        -------------------------
+        record(self, job): adds the times of an evaluated TimedJob
+        write(self): appends the current metrics to the file
+    """
+
+    def __init__(self, filename, interval=60.0, cache=None):
+        self.filename = filename
+        self.interval = interval
+        self.cache = cache
+        self.evaluations = 0
+        self._start = time.time()
+        self._window_start = self._start
+        self._window_evaluations = 0
+        self._latencies = defaultdict(list)
+        self._histograms = {phase: [0] * len(BUCKETS)
+                            for phase in PHASES + ('pywr', 'total')}
+        self._busy = {}
+        self._startup = {}
+
+    def record(self, job):
+        """ Add the times of an evaluated TimedJob """
+        self.evaluations += 1
+        self._window_evaluations += 1
+        total = job.end - job.start
+        phases = {phase: job.timings.get(phase, 0.0) for phase in PHASES}
+        phases['pywr'] = max(total - sum(phases.values()), 0.0)
+        phases['total'] = total
+        for phase, seconds in phases.items():
+            self._latencies[phase].append(seconds)
+            bucket = np.searchsorted(BUCKETS, seconds)
+            self._histograms[phase][bucket] += 1
+        # Only the time within the current window counts as busy (worker
+        # clocks are not compared with the master's clock)
+        now = time.time()
+        if job.startup is not None:
+            self._startup[job.worker] = job.startup
+        self._busy[job.worker] = self._busy.get(job.worker, 0.0) + \
+            min(total, now - self._window_start)
+        if now - self._window_start >= self.interval:
+            self.write()
+
+    def write(self):
+        """ Append the metrics since the previous line to the file """
+        now = time.time()
+        window = now - self._window_start
+        metrics = {
+            'time': now,
+            'evaluations': self.evaluations,
+            'evaluations_per_minute': 60.0 * self._window_evaluations /
+            window if window > 0 else None,
+            'evaluations_per_minute_total': 60.0 * self.evaluations /
+            (now - self._start) if now > self._start else None,
+            'latency': {},
+            'worker_busy_fraction': {
+                worker: min(busy / window, 1.0) if window > 0 else None
+                for worker, busy in sorted(self._busy.items())},
+            'worker_startup_seconds': dict(sorted(self._startup.items())),
+        }
+        for phase, histogram in self._histograms.items():
+            values = self._latencies[phase]
+            metrics['latency'][phase] = {
+                'count': int(sum(histogram)),
+                'buckets': dict(zip(
+                    [str(bound) for bound in BUCKETS],
+                    np.cumsum(histogram).tolist())),
+                'p50': float(np.percentile(values, 50)) if values else None,
+                'p90': float(np.percentile(values, 90)) if values else None,
+                'max': float(max(values)) if values else None,
+            }
+        if self.cache is not None:
+            lookups = self.cache.hits + self.cache.misses
+            metrics['cache'] = {
+                'hits': self.cache.hits, 'misses': self.cache.misses,
+                'hit_rate': self.cache.hits / lookups if lookups else None}
+        with open(self.filename, 'a') as fh:
+            fh.write(json.dumps(metrics) + '\n')
+
+        # Start a new window; workers seen before are reported as idle
+        # until they complete another evaluation
+        self._window_start = now
+        self._window_evaluations = 0
+        self._latencies.clear()
+        self._busy = {worker: 0.0 for worker in self._busy}
+
+
+class TelemetryEvaluator(Evaluator):
+    """ Evaluator running each job in a TimedJob and recording its metrics.
+        It must directly wrap the evaluator of the process or MPI pool so
+        that the jobs are timed in the workers.
+
+        Methods:
+        ---------------------------------
+        evaluate_all(self, jobs): evaluates the jobs
+        close(self): closes the wrapped evaluator
+    """
+
+    def __init__(self, evaluator, telemetry):
+        super().__init__()
+        self.evaluator = evaluator
+        self.telemetry = telemetry
+
+    def evaluate_all(self, jobs, **kwargs):
+        results = self.evaluator.evaluate_all(
+            [TimedJob(job) for job in jobs], **kwargs)
+        for result in results:
+            self.telemetry.record(result)
+        return [result.job for result in results]
+
+    def close(self):
+        self.evaluator.close()
@@ -0,0 +1,215 @@
+""" This module defines Platypus variators used in MOEA runs with the
+    integrated Pywr / Parflow model
+
+    Functions:
+    ---------------------------------
+    default_variator(problem): returns Platypus' default variator for the
+                               types of the problem's variables
+
+    Classes:
+    ---------------------------------
+    SurrogateVariator(Variator): generates extra offspring and keeps only
+        those with the best objectives predicted by a surrogate model
+    UniqueVariator(Variator): resamples offspring whose decision vectors
+        have already been proposed
+"""
+
+import math
+import logging
+import numpy as np
+from platypus import PlatypusConfig
+from platypus.core import Variator
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+
+def default_variator(problem):
+    """ Return the variator Platypus uses for the types of the problem's
+        variables when an algorithm is created without one """
+    return PlatypusConfig.default_variator(problem)
+
+
+def domination_counts(objectives, reference=None):
+    """ Return for each row of objectives (minimised) the number of rows of
+        objectives and reference which dominate it """
+    objectives = np.atleast_2d(objectives)
+    others = objectives if reference is None or len(reference) == 0 \
+        else np.vstack([objectives, reference])
+    better_or_equal = np.all(others[None, :, :] <= objectives[:, None, :],
+                             axis=2)
+    better = np.any(others[None, :, :] < objectives[:, None, :], axis=2)
+    return np.sum(better_or_equal & better, axis=1)
+
+
+class SurrogateVariator(Variator):
+    """ Variator wrapping another variator. It evolves the parents several
+        times and keeps only the fraction of the offspring with the best
+        objectives predicted by the surrogate, so that only these are
+        evaluated with the full model.
+
+        Offspring are ranked by the number of solutions (other offspring and
+        the non-dominated evaluated solutions) that dominate their predicted
+        objectives. Until the surrogate has enough training data all
+        offspring are kept.
+
+        Each kept solution stores its prediction in the
+        predicted_objectives attribute, which is used to measure the
+        accuracy of the surrogate (see SurrogateTrainingEvaluator).
+
+        If filter is set (a callable returning the candidates worth
+        ranking, see UniqueVariator), the other candidates are only kept
+        when too few remain.
+
+        Methods:
+        ---------------------------------
+        evolve(self, parents): returns the offspring which pass the
+                               surrogate screen
+    """
+
+    def __init__(self, variator, surrogate, fraction):
+        super().__init__(variator.arity)
+        if not 0.0 < fraction <= 1.0:
+            raise ValueError('The fraction of evaluated offspring must be '
+                             'in (0, 1].')
+        self.variator = variator
+        self.surrogate = surrogate
+        self.fraction = fraction
+        self.filter = None
+        self.generated = 0
+        self.kept = 0
+
+    def evolve(self, parents):
+        offspring = self.variator.evolve(parents)
+        if not self.surrogate.ready():
+            return offspring
+        # Generate enough candidates to keep len(offspring) of them
+        count = len(offspring)
+        candidates = list(offspring)
+        for _ in range(math.ceil(1.0 / self.fraction) - 1):
+            candidates.extend(self.variator.evolve(parents))
+        self.generated += len(candidates)
+        if self.filter is not None:
+            ranked = self.filter(candidates)
+            if len(ranked) < count:
+                kept = set(map(id, ranked))
+                ranked += [c for c in candidates
+                           if id(c) not in kept][:count - len(ranked)]
+            candidates = ranked
+
+        predicted = self.surrogate.predict(
+            [list(c.variables) for c in candidates])
+        counts = domination_counts(predicted, self.surrogate.front())
+        # Ties are broken randomly
+        order = np.lexsort((np.random.random(len(candidates)), counts))
+        selected = [candidates[i] for i in order[:count]]
+        for i, child in zip(order[:count], selected):
+            child.predicted_objectives = list(predicted[i])
+        self.kept += count
+        return selected
+
+
+class UniqueVariator(Variator):
+    """ Variator wrapping another variator so that offspring are not
+        duplicates of solutions proposed earlier in the search.
+
+        The keys (canonical decision vectors, e.g. EvaluationCache.key) of
+        all parents and offspring are kept in a set. An offspring whose key
+        is in the set is replaced by evolving the parents again, at most
+        max_retries times; after that the duplicate is accepted (the
+        evaluation cache then avoids evaluating it again).
+
+        When wrapping a SurrogateVariator, duplicates are removed from its
+        candidates before they are ranked and the remaining duplicates are
+        resampled with the variator it wraps, so that resampling does not
+        run the surrogate screen again.
+
+        Statistics are collected for every report_every offspring (a
+        generation) in history and logged.
+
+        Methods:
+        ---------------------------------
+        evolve(self, parents): returns offspring with new decision vectors
+        new_candidates(self, candidates): returns the candidates with new
+                                          decision vectors
+        report(self): logs and stores the statistics of the generation
+        get_state(self): returns the keys seen and the statistics (stored in
+                         checkpoints)
+        set_state(self, state): restores the state returned by get_state
+    """
+
+    def __init__(self, variator, key, max_retries=10, report_every=None):
+        super().__init__(variator.arity)
+        self.variator = variator
+        self.key = key
+        self.max_retries = max_retries
+        self.report_every = report_every
+        self.seen = set()
+        self.history = []
+        self._reset_counts()
+        if isinstance(variator, SurrogateVariator):
+            variator.filter = self.new_candidates
+            self._resample = variator.variator
+        else:
+            self._resample = variator
+
+    def _reset_counts(self):
+        self.offspring = 0
+        self.rejected = 0
+        self.accepted_duplicates = 0
+
+    def get_state(self):
+        """ Return the keys seen and the statistics of the variator """
+        return {'seen': self.seen, 'history': self.history}
+
+    def set_state(self, state):
+        """ Restore the keys seen and the statistics returned by get_state """
+        self.seen = set(state['seen'])
+        self.history = list(state['history'])
+
+    def evolve(self, parents):
+        for parent in parents:
+            self.seen.add(self.key(parent.variables))
+        offspring = []
+        for child in self.variator.evolve(parents):
+            key = self.key(child.variables)
+            retries = 0
+            while key in self.seen and retries < self.max_retries:
+                self.rejected += 1
+                retries += 1
+                child = self._resample.evolve(parents)[0]
+                key = self.key(child.variables)
+            if key in self.seen:
+                self.accepted_duplicates += 1
+            self.seen.add(key)
+            offspring.append(child)
+
+        self.offspring += len(offspring)
+        if self.report_every is not None and \
+                self.offspring >= self.report_every:
+            self.report()
+        return offspring
+
+    def new_candidates(self, candidates):
+        """ Return the candidates whose decision vectors were not proposed
+            before (nor by an earlier candidate) """
+        keys = set()
+        new = []
+        for candidate in candidates:
+            key = self.key(candidate.variables)
+            if key not in self.seen and key not in keys:
+                keys.add(key)
+                new.append(candidate)
+        return new
+
+    def report(self):
+        """ Log and store the duplicate statistics since the last report """
+        stats = {'offspring': self.offspring, 'rejected': self.rejected,
+                 'accepted_duplicates': self.accepted_duplicates,
+                 'unique_vectors': len(self.seen)}
+        self.history.append(stats)
+        logger.info('Offspring: {offspring}, duplicates rejected: '
+                    '{rejected}, duplicates accepted after retries: '
+                    '{accepted_duplicates}, distinct decision vectors: '
+                    '{unique_vectors}'.format(**stats))
+        self._reset_counts()
@@ -0,0 +1,91 @@
+""" This module defines the initialisation of worker processes
+
+    A worker evaluating solutions loads the Pywr model of the search, runs
+    Parflow from a compiled database of the base model, reads the static
+    slopes of the Parflow model and the vegetation template, and saves its
+    results to the search database. warm_up does all this once when the
+    worker starts, before it receives its first solution, and reports the
+    time it took (in the log and the search telemetry).
+
+    Functions:
+    ---------------------------------
+    warm_up_parflow(model): precompiles the base models and reads the
+                            vegetation templates of the Parflow runners
+    warm_up(wrapper): prepares the worker process evaluating the solutions
+                      of wrapper
+    job_wrapper(job): returns the wrapper whose solution a job evaluates
+
+    Classes:
+    ---------------------------------
+    WarmProcessPoolEvaluator(SubmitEvaluator): process pool evaluator whose
+                                               workers are warmed up
+"""
+
+import os
+import time
+import socket
+import logging
+import concurrent.futures
+from platypus.evaluator import SubmitEvaluator
+from .telemetry import set_startup_time
+from .parflow.pywr_parameters import ParflowRunnerParameter
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+
+def warm_up_parflow(model):
+    """ Precompile the base model and read the vegetation template of each
+        Parflow runner of model. Called before worker processes are forked,
+        the workers share the compiled base model. """
+    for parameter in model.parameters:
+        if isinstance(parameter, ParflowRunnerParameter):
+            parameter.runner.warm_up()
+
+
+def job_wrapper(job):
+    """ Return the wrapper whose solution(s) job evaluates or None """
+    while hasattr(job, 'job'):
+        job = job.job
+    wrapper = getattr(job, 'wrapper', None)
+    if wrapper is None:
+        problem = getattr(getattr(job, 'solution', None), 'problem', None)
+        wrapper = getattr(problem, 'wrapper', None)
+    return wrapper
+
+
+def warm_up(wrapper):
+    """ Prepare the current process for evaluating the solutions of wrapper:
+        load the Pywr model (kept by Pywr for the following evaluations),
+        precompile the base Parflow model and read the vegetation template
+        of each Parflow runner and open the connections of the recorders
+        saving results. Returns the start-up time in seconds. """
+    start = time.time()
+    model = wrapper.model
+    loaded = time.time()
+    warm_up_parflow(model)
+    compiled = time.time()
+    for recorder in model.recorders:
+        if hasattr(recorder, 'connect'):
+            recorder.connect()
+    startup = time.time() - start
+    set_startup_time(startup)
+    logger.info('Worker {}:{} ready in {:.2f}s (model {:.2f}s, Parflow '
+                '{:.2f}s, connections {:.2f}s)'.format(
+                    socket.gethostname(), os.getpid(), startup,
+                    loaded - start, compiled - loaded,
+                    time.time() - compiled))
+    return startup
+
+
+class WarmProcessPoolEvaluator(SubmitEvaluator):
+    """ Evaluator running jobs on a pool of processes, each warmed up for
+        the solutions of wrapper when it starts (see warm_up) """
+
+    def __init__(self, processes, wrapper):
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            processes, initializer=warm_up, initargs=(wrapper,))
+        super().__init__(self.executor.submit)
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,466 @@
+""" This module defines a work queue through which independently started
+    workers evaluate the solutions of a search
+
+    The queue is a SQLite database on a filesystem shared by the master and
+    the workers. The master enqueues evaluation jobs and collects their
+    results; any number of workers (started with "parflow-pywr worker", e.g.
+    as separate batch jobs on any node) lease jobs, run them and post the
+    results. A worker renews the leases of its jobs while they run, so the
+    jobs of a worker which died are requeued once their lease has expired.
+    Workers can therefore be added and removed while a search is running.
+
+    Functions:
+    ---------------------------------
+    run_worker(filename, lease_timeout, idle_timeout, max_evaluations,
+               poll_interval): evaluates jobs of a queue until the search is
+                               finished
+    fail_job(job, worker): gives a job whose evaluation failed the result
+                           of an infeasible solution
+
+    Classes:
+    ---------------------------------
+    TaskFailed(RuntimeError): error of a failed task, with its job
+    WorkQueue: SQLite-backed queue of evaluation jobs
+    QueueDispatcher: dispatches jobs to the workers of a WorkQueue
+    QueueEvaluator(Evaluator): evaluates jobs through a WorkQueue
+"""
+
+import os
+import time
+import pickle
+import socket
+import sqlite3
+import logging
+import threading
+import contextlib
+import collections
+from platypus.evaluator import Evaluator
+from platypus.core import EvaluateSolution
+from .asynchronous import run_timed_job
+from .evaluators import mark_failed
+from .telemetry import TimedJob
+from .warmup import warm_up, job_wrapper
+
+# instantiate logger for logging errors, warnings and other communication
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    state TEXT NOT NULL,
+    job BLOB NOT NULL,
+    result BLOB,
+    error TEXT,
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state);
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL,
+    evaluations INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT);
+"""
+
+# Largest number of task ids in one SQL query
+_CHUNK = 500
+
+
+class TaskFailed(RuntimeError):
+    """ Error of a task which failed (last leased by worker), with the
+        job of the task """
+
+    def __init__(self, error, job, worker=None):
+        super().__init__(error)
+        self.job = job
+        self.worker = worker
+
+
+def fail_job(job, worker=None):
+    """ Give job, whose evaluation failed on worker, the result of an
+        infeasible solution (see evaluators.mark_failed) and return it.
+        The evaluators reading the results of their own jobs (e.g.
+        FidelityJob) check the failed attribute of the job instead. """
+    now = time.time()
+    job.elapsed = 0.0
+    inner = job
+    while hasattr(inner, 'job'):
+        if isinstance(inner, TimedJob):
+            # Recorded as an evaluation taking no time
+            inner.worker = worker
+            inner.start = inner.end = now
+            inner.timings = {}
+        inner = inner.job
+    inner.failed = True
+    if isinstance(inner, EvaluateSolution):
+        mark_failed(inner.solution)
+    return job
+
+
+class WorkQueue:
+    """ Queue of evaluation jobs stored in a SQLite database.
+
+        A task is "queued", "leased" by a worker until lease_expires, "done"
+        (with the pickled evaluated job) or "failed" (with an error). Tasks
+        whose lease expired are queued again, unless they were already
+        leased max_attempts times.
+
+        Attributes:
+        -------------------------
+        filename: str
+            SQLite database of the queue (on a filesystem shared by the
+            master and the workers)
+        lease_timeout: float
+            seconds after which a task leased by a worker which stopped
+            renewing its lease is queued again
+
+        Methods:
+        -------------------------
+        open(self): marks the queue as serving a running search
+        close(self): marks the search as finished (workers then exit)
+        is_closed(self): returns True after close
+        put(self, job): queues a job and returns its task id
+        lease(self, worker): leases the oldest queued task to worker
+        renew(self, worker): extends the leases of a worker
+        complete(self, task_id, worker, job): stores the evaluated job
+        fail(self, task_id, worker, error): stores the error of a task
+        collect(self, task_ids): returns and removes finished tasks
+        cancel(self, task_ids): removes tasks
+        clear(self): removes all tasks
+        active_workers(self): returns the number of live workers
+        remove_worker(self, worker): unregisters a worker
+    """
+
+    def __init__(self, filename, lease_timeout=300.0, max_attempts=3):
+        self.filename = filename
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        # Transactions are started explicitly (see _transaction)
+        self._db = sqlite3.connect(filename, timeout=60.0,
+                                   isolation_level=None)
+        self._db.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """ Run the block in a transaction holding the database's write
+            lock """
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            yield self._db
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+    def _set(self, key, value):
+        with self._transaction() as db:
+            db.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)',
+                       (key, value))
+
+    def open(self):
+        self._set('closed', '0')
+
+    def close(self):
+        self._set('closed', '1')
+
+    def is_closed(self):
+        row = self._db.execute(
+            "SELECT value FROM settings WHERE key = 'closed'").fetchone()
+        return row is not None and row[0] == '1'
+
+    def put(self, job):
+        with self._transaction() as db:
+            cursor = db.execute(
+                "INSERT INTO tasks (state, job) VALUES ('queued', ?)",
+                (pickle.dumps(job, pickle.HIGHEST_PROTOCOL),))
+        return cursor.lastrowid
+
+    def lease(self, worker):
+        """ Lease the oldest queued task to worker and return its id and
+            job (or None if no task is queued). Expired leases are
+            requeued first. """
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE tasks SET state = 'failed', error = ? "
+                "WHERE state = 'leased' AND lease_expires < ? "
+                "AND attempts >= ?",
+                ('The lease expired {} times'.format(self.max_attempts), now,
+                 self.max_attempts))
+            if cursor.rowcount:
+                logger.warning('{} tasks failed after {} expired '
+                               'leases'.format(cursor.rowcount,
+                                               self.max_attempts))
+            cursor = db.execute(
+                "UPDATE tasks SET state = 'queued', worker = NULL "
+                "WHERE state = 'leased' AND lease_expires < ?", (now,))
+            if cursor.rowcount:
+                logger.warning('Requeued {} tasks of workers whose lease '
+                               'expired'.format(cursor.rowcount))
+            row = db.execute("SELECT id, job FROM tasks WHERE state = "
+                             "'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE tasks SET state = 'leased', worker = ?, "
+                       "lease_expires = ?, attempts = attempts + 1 "
+                       "WHERE id = ?", (worker, now + self.lease_timeout,
+                                        row[0]))
+        return row[0], pickle.loads(row[1])
+
+    def renew(self, worker):
+        """ Extend the leases of worker and record its heartbeat """
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET lease_expires = ? WHERE state = "
+                       "'leased' AND worker = ?",
+                       (now + self.lease_timeout, worker))
+            db.execute('INSERT INTO workers (worker, heartbeat) VALUES '
+                       '(?, ?) ON CONFLICT (worker) DO UPDATE SET '
+                       'heartbeat = excluded.heartbeat', (worker, now))
+
+    def complete(self, task_id, worker, job):
+        """ Store the evaluated job of a task. The first result of a task
+            which was requeued is kept. """
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET state = 'done', result = ?, "
+                       "worker = ? WHERE id = ? AND state IN ('queued', "
+                       "'leased')", (pickle.dumps(
+                           job, pickle.HIGHEST_PROTOCOL), worker, task_id))
+            db.execute('UPDATE workers SET evaluations = evaluations + 1 '
+                       'WHERE worker = ?', (worker,))
+
+    def fail(self, task_id, worker, error):
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET state = 'failed', error = ?, "
+                       "worker = ? WHERE id = ? AND state IN ('queued', "
+                       "'leased')", (error, worker, task_id))
+
+    def collect(self, task_ids):
+        """ Return a dictionary mapping the finished tasks among task_ids
+            to their evaluated job (or a TaskFailed error holding the job of
+            a failed task) and remove them from the queue """
+        task_ids = list(task_ids)
+        finished = {}
+        with self._transaction() as db:
+            for i in range(0, len(task_ids), _CHUNK):
+                chunk = task_ids[i:i + _CHUNK]
+                marks = ', '.join('?' * len(chunk))
+                rows = db.execute(
+                    "SELECT id, state, job, result, error, worker FROM tasks "
+                    "WHERE id IN ({}) AND state IN ('done', "
+                    "'failed')".format(marks), chunk).fetchall()
+                for task_id, state, job, result, error, worker in rows:
+                    finished[task_id] = pickle.loads(result) \
+                        if state == 'done' else TaskFailed(
+                            error, pickle.loads(job), worker)
+                db.execute('DELETE FROM tasks WHERE id IN ({}) AND state IN '
+                           "('done', 'failed')".format(marks), chunk)
+        return finished
+
+    def cancel(self, task_ids):
+        """ Remove the tasks task_ids from the queue. A worker evaluating
+            one of them is not interrupted; its result is not stored. """
+        task_ids = list(task_ids)
+        with self._transaction() as db:
+            for i in range(0, len(task_ids), _CHUNK):
+                chunk = task_ids[i:i + _CHUNK]
+                db.execute('DELETE FROM tasks WHERE id IN ({})'.format(
+                    ', '.join('?' * len(chunk))), chunk)
+
+    def clear(self):
+        """ Remove all tasks and return their number """
+        with self._transaction() as db:
+            return db.execute('DELETE FROM tasks').rowcount
+
+    def active_workers(self):
+        """ Return the number of workers whose last heartbeat is more recent
+            than the lease timeout """
+        return self._db.execute(
+            'SELECT COUNT(*) FROM workers WHERE heartbeat >= ?',
+            (time.time() - self.lease_timeout,)).fetchone()[0]
+
+    def remove_worker(self, worker):
+        with self._transaction() as db:
+            db.execute('DELETE FROM workers WHERE worker = ?', (worker,))
+
+
+class QueueDispatcher:
+    """ Dispatches jobs to the workers of a WorkQueue. The number of workers
+        (size) is the number of live workers, so it grows and shrinks as
+        workers are started and stopped.
+
+        Tasks left in the queue by a previous run of the search (e.g. before
+        it was resumed from a checkpoint) belong to no dispatcher and are
+        removed. A task which failed (its job raised an error, or its lease
+        expired too often) is logged and its job returned with the result
+        of an infeasible solution (see fail_job), so the search continues.
+
+        Methods:
+        ---------------------------------
+        close(self): marks the search as finished
+        idle(self): returns the number of idle workers
+        submit(self, job): queues job and returns its tag
+        receive(self, timeout): waits for a job to complete and returns its
+                                tag and the job (or None after timeout)
+        next_completed(self): waits for a job to complete and returns it
+        cancel(self, tag): removes the job of tag from the queue
+    """
+
+    def __init__(self, queue, poll_interval=1.0):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self._tasks = set()
+        self._completed = collections.deque()
+        removed = queue.clear()
+        if removed:
+            logger.warning('Removed {} tasks left in the queue by a previous '
+                           'run'.format(removed))
+        queue.open()
+
+    @property
+    def size(self):
+        return max(self.queue.active_workers(), 1)
+
+    @property
+    def pending(self):
+        return len(self._tasks) + len(self._completed)
+
+    def idle(self):
+        return max(self.size - self.pending, 0)
+
+    def submit(self, job):
+        task_id = self.queue.put(job)
+        self._tasks.add(task_id)
+        return task_id
+
+    def receive(self, timeout=None):
+        start = time.time()
+        while not self._completed:
+            for task_id, job in self.queue.collect(self._tasks).items():
+                self._tasks.discard(task_id)
+                if isinstance(job, TaskFailed):
+                    logger.error('Task {} failed on worker {}; its solution '
+                                 'is treated as infeasible: {}'.format(
+                                     task_id, job.worker, job))
+                    job = fail_job(job.job, job.worker)
+                self._completed.append((task_id, job))
+            if self._completed:
+                break
+            if timeout is not None and time.time() - start >= timeout:
+                return None
+            time.sleep(self.poll_interval)
+        return self._completed.popleft()
+
+    def next_completed(self):
+        return self.receive()[1]
+
+    def cancel(self, tag):
+        self._tasks.discard(tag)
+        self._completed = collections.deque(
+            completed for completed in self._completed
+            if completed[0] != tag)
+        self.queue.cancel([tag])
+
+    def close(self):
+        self.queue.close()
+
+
+class QueueEvaluator(Evaluator):
+    """ Evaluator queueing all jobs in a WorkQueue and waiting for the
+        workers to evaluate them.
+
+        Methods:
+        ---------------------------------
+        evaluate_all(self, jobs): evaluates the jobs
+        close(self): marks the search as finished
+    """
+
+    def __init__(self, queue, poll_interval=1.0):
+        super().__init__()
+        self.dispatcher = QueueDispatcher(queue, poll_interval)
+
+    def evaluate_all(self, jobs, **kwargs):
+        tags = [self.dispatcher.submit(job) for job in jobs]
+        results = {}
+        while len(results) < len(tags):
+            tag, job = self.dispatcher.receive()
+            results[tag] = job
+        return [results[tag] for tag in tags]
+
+    def close(self):
+        self.dispatcher.close()
+
+
+class _Heartbeat(threading.Thread):
+    """ Renews the leases of a worker every third of the lease timeout """
+
+    def __init__(self, filename, worker, lease_timeout):
+        super().__init__(daemon=True)
+        self.filename = filename
+        self.worker = worker
+        self.lease_timeout = lease_timeout
+        self._stop_event = threading.Event()
+
+    def run(self):
+        # SQLite connections can not be shared between threads
+        queue = WorkQueue(self.filename, self.lease_timeout)
+        while not self._stop_event.is_set():
+            queue.renew(self.worker)
+            self._stop_event.wait(self.lease_timeout / 3.0)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_worker(filename, lease_timeout=300.0, idle_timeout=None,
+               max_evaluations=None, poll_interval=5.0):
+    """ Lease and evaluate the jobs of the queue in filename until the
+        search is finished, no job was queued for idle_timeout seconds or
+        max_evaluations jobs were evaluated. Returns the number of evaluated
+        jobs. """
+    queue = WorkQueue(filename, lease_timeout)
+    worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+    queue.renew(worker)
+    heartbeat = _Heartbeat(filename, worker, lease_timeout)
+    heartbeat.start()
+    logger.info('Worker {} started on queue {}'.format(worker, filename))
+    evaluations = 0
+    idle_since = time.time()
+    warmed = set()
+    try:
+        while max_evaluations is None or evaluations < max_evaluations:
+            if queue.is_closed():
+                logger.info('The search is finished')
+                break
+            task = queue.lease(worker)
+            if task is None:
+                if idle_timeout is not None and \
+                        time.time() - idle_since >= idle_timeout:
+                    logger.info('No work for {} seconds'.format(
+                        idle_timeout))
+                    break
+                time.sleep(poll_interval)
+                continue
+            task_id, job = task
+            wrapper = job_wrapper(job)
+            try:
+                if wrapper is not None and wrapper.uid not in warmed:
+                    warm_up(wrapper)
+                    warmed.add(wrapper.uid)
+                job = run_timed_job(job)
+            except Exception as error:
+                logger.exception('Evaluation of task {} failed'.format(
+                    task_id))
+                queue.fail(task_id, worker, repr(error))
+            else:
+                queue.complete(task_id, worker, job)
+            evaluations += 1
+            idle_since = time.time()
+    finally:
+        heartbeat.stop()
+        queue.remove_worker(worker)
+    logger.info('Worker {} evaluated {} jobs'.format(worker, evaluations))
+    return evaluations
@@ -0,0 +1,69 @@
+""" Tests of the asynchronous MOEA and its process pool dispatcher """
+import concurrent.futures
+import platypus
+import pytest
+from parflow_pywr_moea.moea import PlatypusPyretoDBWrapper
+from parflow_pywr_moea.asynchronous import ProcessDispatcher, \
+    AsynchronousEpsMOEA
+from parflow_pywr_moea.checkpoint import CheckpointExtension, \
+    load_checkpoint
+from parflow_pywr_moea.warmup import warm_up
+from test_batching import model_data
+
+EPSILONS = [0.5, 0.5]
+
+
+@pytest.fixture(scope='module')
+def wrapper():
+    return PlatypusPyretoDBWrapper(model_data(), search_id=None)
+
+
+@pytest.fixture
+def dispatcher(wrapper):
+    dispatcher = ProcessDispatcher(concurrent.futures.ProcessPoolExecutor(
+        2, initializer=warm_up, initargs=(wrapper,)), 2)
+    yield dispatcher
+    dispatcher.close()
+
+
+def test_dispatcher_returns_evaluated_jobs(wrapper, dispatcher):
+    solution = platypus.Solution(wrapper.problem)
+    solution.variables[:] = [1, 0, 3, 2, 2.0]
+    tag = dispatcher.submit(platypus.core.EvaluateSolution(solution))
+    assert dispatcher.idle() == 1
+    received, job = dispatcher.receive()
+    assert received == tag
+    assert job.solution.evaluated
+    assert job.solution.objectives[:] == wrapper.evaluate(
+        [1, 0, 3, 2, 2.0])
+    assert dispatcher.pending == 0
+
+
+def test_search_evaluates_all_solutions(wrapper, dispatcher):
+    algorithm = AsynchronousEpsMOEA(wrapper.problem, EPSILONS, dispatcher,
+                                    population_size=6)
+    algorithm.run(20)
+    assert algorithm.nfe == 20
+    assert dispatcher.pending == 0
+    assert len(algorithm.population) == 6
+    assert len(algorithm.archive) > 0
+    assert all(s.evaluated for s in algorithm.archive)
+
+
+def test_resumed_search(tmp_path, wrapper, dispatcher):
+    filename = str(tmp_path / 'checkpoint.pkl')
+    algorithm = AsynchronousEpsMOEA(wrapper.problem, EPSILONS, dispatcher,
+                                    population_size=6)
+    algorithm.add_extension(CheckpointExtension(filename, 5))
+    algorithm.run(12)
+    archive = [s.objectives[:] for s in algorithm.archive]
+
+    resumed = AsynchronousEpsMOEA(wrapper.problem, EPSILONS, dispatcher,
+                                  population_size=6)
+    load_checkpoint(resumed, filename)
+    assert resumed.nfe == 12
+    assert [s.objectives[:] for s in resumed.archive] == archive
+    resumed.run(8)
+    assert resumed.nfe == 20
+    assert dispatcher.pending == 0
+    assert len(resumed.archive) > 0
@@ -0,0 +1,111 @@
+""" Tests of the evaluation of control-curve candidates in scenario batches
+"""
+import numpy as np
+import platypus
+import pytest
+from pywr.model import Model
+from pywr.nodes import Input, Output
+from pywr.core import Scenario
+from pywr.recorders import TotalFlowNodeRecorder
+from parflow_pywr_moea.parameters import ScenarioBatchParameter
+# Import registers the Parflow vegetation parameter and recorders
+import parflow_pywr_moea.parflow.pywr_parameters  # noqa: F401
+import parflow_pywr_moea.parflow.pywr_recorders  # noqa: F401
+from parflow_pywr_moea.moea import PlatypusPyretoDBWrapper
+from parflow_pywr_moea.evaluators import ScenarioBatchEvaluator
+
+
+def model_data():
+    """ Pywr model with a landuse (integer) and a control-curve (double)
+        variable which does not need Parflow """
+    return {
+        'metadata': {'title': 'batch', 'minimum_version': '0.1'},
+        'timestepper': {'start': '2000-01-01', 'end': '2000-01-10',
+                        'timestep': 1},
+        'nodes': [{'name': 'supply', 'type': 'input', 'max_flow': 'flow'},
+                  {'name': 'demand', 'type': 'output', 'cost': -1}],
+        'edges': [['supply', 'demand']],
+        'parameters': {
+            'flow': {'type': 'constant', 'value': 3.0, 'is_variable': True,
+                     'lower_bounds': 0, 'upper_bounds': 10},
+            'parflow_landuse': {'type': 'ParflowVegetation',
+                                'land_use_classes': [5, 10, 12, 18],
+                                'num_variable_tiles': 4,
+                                'is_variable': True}},
+        'recorders': {
+            'total_flow': {'type': 'totalflownoderecorder',
+                           'node': 'supply', 'is_objective': 'maximise'},
+            'crop_count': {'type': 'ParflowCropLandTypeNumberRecorder',
+                           'vegetation_param': 'parflow_landuse',
+                           'is_objective': 'maximise'}}}
+
+
+def test_parameter_value_per_member():
+    model = Model.load({
+        'metadata': {'title': 'batch', 'minimum_version': '0.1'},
+        'timestepper': {'start': '2000-01-01', 'end': '2000-01-05',
+                        'timestep': 1},
+        'nodes': [], 'edges': []})
+    scenario = Scenario(model, 'batch', size=3)
+    supply = Input(model, 'supply', max_flow=ScenarioBatchParameter(
+        model, scenario, [1.0, 2.0, 4.0]))
+    demand = Output(model, 'demand', cost=-1)
+    supply.connect(demand)
+    recorder = TotalFlowNodeRecorder(model, supply)
+    model.run()
+    np.testing.assert_allclose(recorder.values(), [5.0, 10.0, 20.0])
+
+
+def test_parameter_values_must_match_scenario_size():
+    model = Model()
+    scenario = Scenario(model, 'batch', size=3)
+    with pytest.raises(ValueError):
+        ScenarioBatchParameter(model, scenario, [1.0, 2.0])
+
+
+def test_batch_matches_single_evaluations():
+    wrapper = PlatypusPyretoDBWrapper(model_data(), search_id=None,
+                                      batch_size=4)
+    landuse = [1, 0, 3, 2]
+    batch = [landuse + [flow] for flow in (1.0, 2.5, 7.0)]
+    results = wrapper.evaluate_batch(batch)
+    assert len({tuple(objectives) for objectives, _ in results}) == 3
+    for variables, (objectives, constraints) in zip(batch, results):
+        np.testing.assert_allclose(objectives, wrapper.evaluate(variables))
+        assert constraints == []
+
+
+def test_batch_requires_shared_landuse():
+    wrapper = PlatypusPyretoDBWrapper(model_data(), search_id=None,
+                                      batch_size=4)
+    with pytest.raises(ValueError):
+        wrapper.evaluate_batch([[1, 0, 3, 2, 1.0], [0, 0, 3, 2, 2.0]])
+
+
+def test_evaluator_groups_solutions_by_landuse():
+    wrapper = PlatypusPyretoDBWrapper(model_data(), search_id=None,
+                                      batch_size=2)
+    vectors = [[1, 0, 3, 2, 1.0], [0, 0, 3, 2, 2.0], [1, 0, 3, 2, 3.0],
+               [1, 0, 3, 2, 4.0]]
+    solutions = []
+    for variables in vectors:
+        solution = platypus.Solution(wrapper.problem)
+        solution.variables[:] = variables
+        solutions.append(solution)
+
+    batches = []
+
+    class RecordingEvaluator(platypus.MapEvaluator):
+        def evaluate_all(self, jobs, **kwargs):
+            batches.extend(len(job.variables) for job in jobs)
+            return super().evaluate_all(jobs, **kwargs)
+
+    evaluator = ScenarioBatchEvaluator(RecordingEvaluator(), wrapper, 2)
+    evaluator.evaluate_all([platypus.core.EvaluateSolution(s)
+                            for s in solutions])
+    # Three solutions share a landuse vector: batches of 2 and 1, plus 1
+    assert sorted(batches) == [1, 1, 2]
+    for variables, solution in zip(vectors, solutions):
+        assert solution.evaluated
+        np.testing.assert_allclose(solution.objectives,
+                                   wrapper.evaluate(variables))
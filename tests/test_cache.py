@@ -0,0 +1,45 @@
+""" Tests of the evaluation cache """
+from parflow_pywr_moea.cache import EvaluationCache
+
+
+def test_key_rounds_integer_variables():
+    cache = EvaluationCache([0, 1])
+    assert cache.key([1.2, 2.7, 0.5]) == (1, 3, 0.5)
+    assert cache.key([0.8, 3.4, 0.5]) == cache.key([1, 3, 0.5])
+
+
+def test_key_rounds_real_variables_to_significant_digits():
+    cache = EvaluationCache([], digits=3)
+    assert cache.key([0.123456, 1234.56]) == (0.123, 1230.0)
+    assert cache.key([0.12345]) == cache.key([0.12349])
+    assert cache.key([0.1234]) != cache.key([0.1236])
+
+
+def test_get_counts_hits_and_misses():
+    cache = EvaluationCache([0])
+    assert cache.get([1, 0.5]) is None
+    cache.put([1.1, 0.5], [1.0, 2.0], [0.0])
+    assert [0.9, 0.5] in cache
+    assert cache.get([0.9, 0.5]) == ([1.0, 2.0], [0.0])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_put_keeps_first_result():
+    cache = EvaluationCache([0])
+    cache.put([1, 0.5], [1.0], [])
+    cache.put([1, 0.5], [2.0], [])
+    assert cache.get([1, 0.5]) == ([1.0], [])
+    assert len(cache) == 1
+
+
+def test_results_reloaded_from_file(tmp_path):
+    filename = str(tmp_path / 'cache.jsonl')
+    cache = EvaluationCache([0], filename=filename)
+    cache.put([2, 0.25], [3.0], [1.0])
+    # Line truncated when a run was killed
+    with open(filename, 'a') as fh:
+        fh.write('{"variables": [1')
+
+    reloaded = EvaluationCache([0], filename=filename)
+    assert len(reloaded) == 1
+    assert reloaded.get([2.2, 0.25]) == ([3.0], [1.0])
@@ -0,0 +1,61 @@
+""" Tests of checkpointing and resuming a search """
+import os
+import random
+import numpy as np
+import platypus
+import pytest
+from parflow_pywr_moea.checkpoint import CheckpointExtension, \
+    save_checkpoint, load_checkpoint
+from parflow_pywr_moea.cache import EvaluationCache
+from parflow_pywr_moea.variators import UniqueVariator, default_variator
+
+PROBLEM = platypus.DTLZ2(2)
+
+
+def make_algorithm(unique=False):
+    kwargs = {}
+    if unique:
+        kwargs['variator'] = UniqueVariator(
+            default_variator(PROBLEM),
+            EvaluationCache([], digits=6).key)
+    return platypus.NSGAII(PROBLEM, population_size=10,
+                           evaluator=platypus.MapEvaluator(), **kwargs)
+
+
+def run(filename, evaluations, resume=False, unique=False):
+    random.seed(3)
+    np.random.seed(3)
+    algorithm = make_algorithm(unique)
+    if resume:
+        load_checkpoint(algorithm, filename)
+    algorithm.add_extension(CheckpointExtension(filename, 20))
+    algorithm.run(evaluations - algorithm.nfe)
+    return algorithm
+
+
+def objectives(algorithm):
+    return sorted(tuple(s.objectives) for s in algorithm.result)
+
+
+@pytest.mark.parametrize('unique', [False, True])
+def test_resumed_search_matches_uninterrupted_search(tmp_path, unique):
+    uninterrupted = run(str(tmp_path / 'a.pkl'), 100, unique=unique)
+    filename = str(tmp_path / 'b.pkl')
+    run(filename, 50, unique=unique)
+    resumed = run(filename, 100, resume=True, unique=unique)
+
+    assert resumed.nfe == uninterrupted.nfe
+    assert objectives(resumed) == objectives(uninterrupted)
+    assert resumed.population[0].problem is PROBLEM
+    if unique:
+        assert resumed.variator.seen == uninterrupted.variator.seen
+
+
+def test_checkpoint_of_another_algorithm_is_rejected(tmp_path):
+    filename = str(tmp_path / 'c.pkl')
+    algorithm = make_algorithm()
+    algorithm.run(10)
+    save_checkpoint(algorithm, filename)
+    assert not os.path.exists(filename + '.tmp')
+    with pytest.raises(ValueError):
+        load_checkpoint(platypus.SPEA2(PROBLEM), filename)
@@ -0,0 +1,73 @@
+""" Tests of the multi-fidelity screening of MOEA candidates
+"""
+import json
+import platypus
+from platypus.core import EvaluateSolution, nondominated
+from parflow_pywr_moea.evaluators import MultiFidelityEvaluator
+from parflow_pywr_moea.moea import _save_nondominated
+
+
+class FidelityWrapper:
+    """ Two fidelity levels; the low fidelity objectives of a design are
+        much better than its full-model objectives """
+    num_fidelities = 2
+    LOW = {0: [1.0, 2.0], 1: [2.0, 1.0], 2: [3.0, 3.0]}
+    FULL = {0: [5.0, 6.0], 1: [6.0, 5.0], 2: [7.0, 7.0]}
+
+    def evaluate_fidelity(self, variables, level):
+        design = int(variables[0])
+        table = self.FULL if level == self.num_fidelities - 1 else self.LOW
+        return table[design], []
+
+
+def jobs():
+    problem = platypus.Problem(1, 2)
+    problem.types[:] = platypus.Real(0, 2)
+    result = []
+    for design in range(3):
+        solution = platypus.Solution(problem)
+        solution.variables[:] = [float(design)]
+        result.append(EvaluateSolution(solution))
+    return result
+
+
+def evaluate():
+    evaluator = MultiFidelityEvaluator(platypus.MapEvaluator(),
+                                       FidelityWrapper())
+    return [job.solution for job in evaluator.evaluate_all(jobs())]
+
+
+def test_screened_solution_is_infeasible():
+    promoted_a, promoted_b, screened = evaluate()
+    assert (promoted_a.fidelity, promoted_b.fidelity) == (1, 1)
+    assert promoted_a.feasible and promoted_b.feasible
+    assert screened.fidelity == 0
+    assert screened.screened
+    assert not screened.feasible
+    # Its low fidelity objectives are better than the full-model ones
+    assert screened.screened_objectives == [3.0, 3.0]
+    assert screened.objectives[:] == [6.0, 6.0]
+
+
+def test_screened_solution_does_not_displace_full_fidelity():
+    solutions = evaluate()
+    assert nondominated(solutions) == solutions[:2]
+
+    archive = platypus.EpsilonBoxArchive([0.5, 0.5])
+    for solution in reversed(solutions):
+        archive.add(solution)
+    assert set(map(id, archive)) == set(map(id, solutions[:2]))
+
+
+def test_final_results_only_full_fidelity(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    solutions = evaluate()
+    # Even alone, the screened solution is not a final result
+    _save_nondominated('test', solutions[2:], full_fidelity=1)
+    with open(tmp_path / 'nondom_final_test.json') as fh:
+        assert json.load(fh)['nondom obj'] == []
+
+    _save_nondominated('test', solutions, full_fidelity=1)
+    with open(tmp_path / 'nondom_final_test.json') as fh:
+        results = json.load(fh)
+    assert results['nondom obj'] == [[5.0, 6.0], [6.0, 5.0]]
@@ -0,0 +1,96 @@
+""" Tests of the validation of the ranks and Parflow topology of the
+    hierarchical MPI mode. mpi4py is replaced by a communicator of a single
+    rank of MPI_COMM_WORLD, so that no MPI launcher is needed. """
+import sys
+import types
+import pytest
+from parflow_pywr_moea.hierarchical import EvaluationGroup
+from parflow_pywr_moea.parflow.manager import ParflowRunner
+
+
+class Comm:
+    """ MPI_COMM_WORLD seen by one rank, split into the master and groups
+        of ranks_per_evaluation ranks """
+
+    def __init__(self, rank, size, ranks_per_evaluation):
+        self.rank = rank
+        self.size = size
+        self.ranks_per_evaluation = ranks_per_evaluation
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return self.size
+
+    def Split(self, color, key):
+        if color is MPI.UNDEFINED:
+            return MPI.COMM_NULL
+        if self.rank == 0:
+            return Comm(0, 1, 1)
+        return Comm((self.rank - 1) % self.ranks_per_evaluation,
+                    self.ranks_per_evaluation, self.ranks_per_evaluation)
+
+    def allgather(self, value):
+        return ['node{}'.format(i) for i in range(self.size)]
+
+
+MPI = types.SimpleNamespace(UNDEFINED=object(), COMM_NULL=None,
+                            COMM_WORLD=None,
+                            Get_processor_name=lambda: 'node')
+
+
+@pytest.fixture
+def world(monkeypatch):
+    """ Return a function setting the rank and size of MPI_COMM_WORLD """
+    monkeypatch.setitem(sys.modules, 'mpi4py',
+                        types.SimpleNamespace(MPI=MPI))
+    monkeypatch.setattr(ParflowRunner, 'default_topology', None)
+    monkeypatch.setattr(ParflowRunner, 'default_launcher', None)
+
+    def set_world(rank, size, ranks_per_evaluation):
+        monkeypatch.setattr(MPI, 'COMM_WORLD',
+                            Comm(rank, size, ranks_per_evaluation))
+    return set_world
+
+
+@pytest.mark.parametrize('topology', [(2, 2), (2, 0, 1), (-1, -1, 1)])
+def test_topology_must_be_three_positive_integers(world, topology):
+    world(1, 5, 4)
+    with pytest.raises(ValueError, match='three positive integers'):
+        EvaluationGroup(4, topology)
+
+
+def test_topology_must_fit_the_group(world):
+    world(1, 5, 4)
+    with pytest.raises(ValueError, match='needs 6 processes'):
+        EvaluationGroup(4, (3, 2, 1))
+
+
+@pytest.mark.parametrize('size', [4, 6, 3])
+def test_number_of_ranks(world, size):
+    world(1, size, 4)
+    with pytest.raises(ValueError, match='multiple of the number of ranks'):
+        EvaluationGroup(4)
+
+
+def test_group_leader_runs_parflow_on_its_ranks(world):
+    world(5, 9, 4)
+    group = EvaluationGroup(4, ('2', '1', '1'),
+                            launcher=('mpirun', '-host', '{hosts}'))
+    assert group.is_leader()
+    assert group.topology == (2, 1, 1)
+    assert ParflowRunner.default_topology == (2, 1, 1)
+    # Parflow runs on the hosts of the first P * Q * R ranks of the group
+    assert ParflowRunner.default_launcher == ('mpirun', '-host',
+                                              'node0,node1')
+
+
+def test_default_topology(world):
+    world(2, 9, 4)
+    group = EvaluationGroup(4)
+    assert group.topology == (4, 1, 1)
+    # Reserved ranks do not configure the Parflow runners
+    assert not group.is_leader()
+    assert group.pool_comm is None
+    assert ParflowRunner.default_topology is None
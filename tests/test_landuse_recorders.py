@@ -0,0 +1,51 @@
+""" Tests of the recorders counting the landuse of the land surface cells
+"""
+from pywr.model import Model
+# Import registers the Parflow vegetation parameter and recorders
+import parflow_pywr_moea.parflow.pywr_parameters  # noqa: F401
+import parflow_pywr_moea.parflow.pywr_recorders  # noqa: F401
+
+RECORDERS = {
+    'diversity': 'ParflowVegetationDiversityRecorder',
+    'crop_count': 'ParflowCropLandTypeNumberRecorder',
+    'bare_soil_count': 'ParflowBareSoilLandTypeNumberRecorder'}
+
+
+def recorder_values(landuse, variables):
+    """ Return the values of the recorders for the decision variables of
+        the landuse parameter """
+    model = Model.load({
+        'metadata': {'title': 'landuse', 'minimum_version': '0.1'},
+        'timestepper': {'start': '2000-01-01', 'end': '2000-01-02',
+                        'timestep': 1},
+        'nodes': [{'name': 'supply', 'type': 'input', 'max_flow': 1.0},
+                  {'name': 'demand', 'type': 'output', 'cost': -1}],
+        'edges': [['supply', 'demand']],
+        'parameters': {
+            'parflow_landuse': dict(landuse, type='ParflowVegetation',
+                                    land_use_classes=[5, 10, 12, 18],
+                                    is_variable=True)},
+        'recorders': {name: {'type': recorder,
+                             'vegetation_param': 'parflow_landuse'}
+                      for name, recorder in RECORDERS.items()}})
+    model.setup()
+    model.parameters['parflow_landuse'].set_integer_variables(variables)
+    return {name: list(model.recorders[name].values()) for name in RECORDERS}
+
+
+def test_counts_of_cells_in_zones():
+    # 3 x 2 grid; crops in zones 0 and 3 (three cells), bare soil in zone 1
+    # (three cells) and class 10 in zone 2, which has no cells
+    values = recorder_values({'grid': [3, 2],
+                              'zones': [[0, 0, 1], [1, 1, 3]]},
+                             [2, 3, 1, 2])
+    assert values['crop_count'] == [3.0]
+    assert values['bare_soil_count'] == [3.0]
+    # Class 10 is not allocated to any cell and bare soil is not green
+    assert values['diversity'] == [1.0]
+
+
+def test_counts_of_tiles_without_zones():
+    values = recorder_values({'num_variable_tiles': 4}, [2, 2, 0, 3])
+    assert values == {'diversity': [2.0], 'crop_count': [2.0],
+                      'bare_soil_count': [1.0]}
@@ -0,0 +1,81 @@
+""" Tests of the nested landuse / control-curve search """
+import platypus
+import pytest
+from platypus.evaluator import MapEvaluator
+from parflow_pywr_moea.moea import PlatypusPyretoDBWrapper
+from parflow_pywr_moea.evaluators import NestedEvaluator
+from test_batching import model_data
+
+
+class FakeWrapper:
+    """ Returns preset inner Pareto sets, as (decision vector, objectives,
+        constraints) tuples, for each landuse design """
+
+    def __init__(self, results):
+        self.problem = platypus.Problem(3, 2, 1)
+        self.problem.constraints[:] = '<=0'
+        self.results = results
+
+    def evaluate_nested(self, landuse, inner):
+        return self.results[tuple(landuse)]
+
+
+def landuse_solution(problem, landuse):
+    solution = platypus.Solution(problem)
+    solution.variables[:] = landuse
+    return platypus.core.EvaluateSolution(solution)
+
+
+@pytest.fixture(scope='module')
+def wrapper():
+    return PlatypusPyretoDBWrapper(model_data(), search_id=None)
+
+
+def test_landuse_problem(wrapper):
+    problem = wrapper.landuse_problem()
+    assert problem.nvars == 4
+    assert [t.max_value for t in problem.types] == [3] * 4
+    vector = wrapper.full_vector([1, 0, 3, 2], [2.0])
+    assert sorted(vector) == [0, 1, 2, 2.0, 3]
+    assert wrapper.evaluate(vector) == wrapper.evaluate([1, 0, 3, 2, 2.0])
+
+
+def test_grid_inner_search(wrapper):
+    landuse = [1, 0, 3, 2]
+    results = wrapper.evaluate_nested(landuse, {'grid': 3})
+    # The largest flow is best and the landuse is the same for all curves
+    assert len(results) == 1
+    variables, objectives, constraints = results[0]
+    assert variables == wrapper.full_vector(landuse, [10.0])
+    assert objectives == wrapper.evaluate(variables)
+
+
+def test_inner_pareto_sets_are_merged():
+    results = {
+        (0, 0): [([0, 0, 1.0], [1.0, 4.0], [0.0]),
+                 ([0, 0, 2.0], [3.0, 2.0], [0.0]),
+                 ([0, 0, 3.0], [0.0, 0.0], [2.0])],
+        (1, 1): [([1, 1, 1.0], [2.0, 2.0], [1.0]),
+                 ([1, 1, 2.0], [1.0, 3.0], [3.0])]}
+    fake = FakeWrapper(results)
+    evaluator = NestedEvaluator(MapEvaluator(), fake, {'grid': 3})
+    problem = platypus.Problem(2, 2, 1)
+    problem.constraints[:] = '<=0'
+    jobs = evaluator.evaluate_all([landuse_solution(problem, landuse)
+                                   for landuse in results])
+
+    feasible, infeasible = [job.solution for job in jobs]
+    # Ideal point of the feasible members only
+    assert feasible.objectives[:] == [1.0, 2.0]
+    assert feasible.constraints[:] == [0.0]
+    assert feasible.feasible
+    assert feasible.inner_front == 3
+    # Without feasible members, the ideal point of all members and the
+    # constraints of the least infeasible one
+    assert infeasible.objectives[:] == [1.0, 2.0]
+    assert infeasible.constraints[:] == [1.0]
+    assert not infeasible.feasible
+
+    # The archive holds the non-dominated solutions of the full problem
+    archived = sorted(list(s.variables) for s in evaluator.archive)
+    assert archived == [[0, 0, 1.0], [0, 0, 2.0]]
@@ -0,0 +1,71 @@
+""" Tests of setting pfset keys in Parflow scripts """
+import pytest
+from parflow_pywr_moea.parflow.manager import ParflowRunner
+
+SCRIPT = """lappend auto_path $env(PARFLOW_DIR)/bin
+package require parflow
+pfset TimeStep.Value               1.0
+  pfset Solver.Nonlinear.ResidualTol 1e-9
+pfset TimeStep.ValueMax            4.0
+pfset CLMDumpInterval              24
+pfwritedb profile
+"""
+
+
+@pytest.fixture
+def runner(tmp_path):
+    base = tmp_path / 'base'
+    base.mkdir()
+    (base / 'profile.tcl').write_text(SCRIPT)
+    return ParflowRunner('profile', [], str(base), str(tmp_path / 'work'))
+
+
+def read_keys(filename):
+    with open(filename) as fh:
+        return [line.split()[1:3] for line in fh
+                if line.split()[:1] == ['pfset']]
+
+
+def test_existing_keys_are_replaced(runner):
+    filename = runner.script_filename(runner.base_model_directory)
+    runner._set_script_keys(filename, {'TimeStep.Value': 2.0,
+                                       'Solver.Nonlinear.ResidualTol': 1e-6})
+    assert read_keys(filename) == [
+        ['TimeStep.Value', '2.0'], ['Solver.Nonlinear.ResidualTol', '1e-06'],
+        ['TimeStep.ValueMax', '4.0'], ['CLMDumpInterval', '24']]
+    # The indentation of the line is kept
+    with open(filename) as fh:
+        assert '  pfset Solver.Nonlinear.ResidualTol 1e-06\n' in fh.read()
+
+
+def test_key_prefix_of_another_key_is_not_replaced(runner):
+    filename = runner.script_filename(runner.base_model_directory)
+    runner._set_script_keys(filename, {'TimeStep.Value': 3.0})
+    keys = dict(read_keys(filename))
+    assert keys['TimeStep.Value'] == '3.0'
+    assert keys['TimeStep.ValueMax'] == '4.0'
+
+
+def test_missing_keys_are_added_before_pfwritedb(runner):
+    filename = runner.script_filename(runner.base_model_directory)
+    runner._set_script_keys(filename, {'Solver.MaxIter': 100})
+    with open(filename) as fh:
+        lines = fh.read().splitlines()
+    assert lines[-2:] == ['pfset Solver.MaxIter 100', 'pfwritedb profile']
+
+
+def test_missing_keys_are_appended_without_pfwritedb(tmp_path, runner):
+    filename = str(tmp_path / 'script.tcl')
+    with open(filename, 'w') as fh:
+        fh.write('pfset TimeStep.Value 1.0\n')
+    runner._set_script_keys(filename, {'Solver.MaxIter': 100})
+    assert read_keys(filename) == [['TimeStep.Value', '1.0'],
+                                   ['Solver.MaxIter', '100']]
+
+
+def test_base_keys_and_timestep(runner):
+    keys = runner.base_keys()
+    assert keys['CLMDumpInterval'] == '24'
+    assert runner.timestep() == 1.0
+    assert runner.timestep({'TimeStep.Value': '0.5'}) == 0.5
+    assert runner.timestep({}) == 1.0
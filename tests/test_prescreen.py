@@ -0,0 +1,39 @@
+""" Tests of the selection of the recorders evaluated before the model runs
+"""
+from parflow_pywr_moea.moea import PlatypusPyretoDBWrapper
+from test_batching import model_data
+
+
+def wrapper(**flags):
+    data = model_data()
+    for name, flag in flags.items():
+        data['recorders'][name]['prescreen'] = flag
+    return PlatypusPyretoDBWrapper(data, search_id=None)
+
+
+def objective_names(wrapper, indices):
+    return [wrapper.model_objectives[i].name for i in indices]
+
+
+def test_landuse_recorders_are_prescreened_by_default():
+    default = wrapper()
+    objectives, constraints = default.prescreen_indices()
+    assert objective_names(default, objectives) == ['crop_count']
+    assert constraints == []
+
+
+def test_prescreen_flags():
+    flagged = wrapper(total_flow=True, crop_count=False)
+    assert flagged.prescreen_flags == {'total_flow': True,
+                                       'crop_count': False}
+    assert 'prescreen' not in flagged.pywr_model_json['recorders'][
+        'total_flow']
+    objectives, _ = flagged.prescreen_indices()
+    assert objective_names(flagged, objectives) == ['total_flow']
+
+
+def test_evaluate_prescreen():
+    default = wrapper()
+    objectives, constraints = default.evaluate_prescreen([1, 0, 3, 2, 2.0])
+    assert objective_names(default, objectives) == ['crop_count']
+    assert constraints == {}
@@ -0,0 +1,167 @@
+""" Tests of the spin-up library and of restarting Parflow runs from it """
+import os
+import pytest
+from pywr.model import Model
+from parflow_pywr_moea.parflow.manager import ParflowRunner
+from parflow_pywr_moea.parflow.pywr_parameters import ParflowRunnerParameter
+from parflow_pywr_moea.parflow.spinup import SpinupLibrary
+
+SCRIPT = """pfset TimingInfo.StartCount      0
+pfset TimingInfo.StartTime       0.0
+pfset TimingInfo.StopTime        1000.0
+pfset TimingInfo.DumpInterval    24.0
+pfset TimeStep.Value             0.5
+pfset Solver.CLM.IstepStart      1
+pfwritedb profile
+"""
+
+
+class FakeRunner:
+    """ Records the calls made by the runner parameter instead of running
+        Parflow; save_state writes the dump number to the state """
+
+    def __init__(self, spinup_result=(480.0, 20)):
+        self.spinup_result = spinup_result
+        self.calls = []
+        self.keys = {}
+
+    def base_keys(self):
+        return {'TimingInfo.StopTime': '1000.0', 'TimeStep.Value': '0.5'}
+
+    def timestep(self, keys):
+        return float(keys['TimeStep.Value'])
+
+    def create_environment(self, name):
+        self.calls.append(('create_environment', name))
+
+    def remove_environment(self, name):
+        self.calls.append(('remove_environment', name))
+
+    def spinup(self, name, hours, **kwargs):
+        self.calls.append(('spinup', hours))
+        return self.spinup_result
+
+    def save_state(self, name, dump_number, destination):
+        os.makedirs(destination, exist_ok=True)
+        with open(os.path.join(destination, 'press.ini.pfb'), 'w') as fh:
+            fh.write(str(dump_number))
+
+    def load_state(self, name, source):
+        self.calls.append(('load_state', name, source))
+
+    def set_start(self, name, dump_number, hours, timestep=1.0):
+        self.calls.append(('set_start', name, dump_number, hours, timestep))
+
+    def set_keys(self, name, keys):
+        self.keys.update(keys)
+
+
+@pytest.fixture
+def library(tmp_path):
+    return SpinupLibrary(str(tmp_path / 'library'))
+
+
+def test_lookup_and_store(library):
+    landuse = [0, 1, 2, 3]
+    assert library.lookup(landuse, 'wet') is None
+
+    stored = library.store(landuse, 'wet', FakeRunner(), 'env', 20, 480.0)
+    assert stored.hours == 480.0
+    assert (stored.dump_number, stored.distance) == (20, 0)
+    with open(os.path.join(stored.path, 'press.ini.pfb')) as fh:
+        assert fh.read() == '20'
+    assert library.lookup(landuse, 'wet') == stored
+    # States are kept per forcing
+    assert library.lookup(landuse, 'dry') is None
+    assert library.key(landuse, 'wet') != library.key(landuse, 'dry')
+
+
+def test_store_existing_state_is_kept(library):
+    first = library.store([0, 1], '', FakeRunner(), 'env', 20, 480.0)
+    second = library.store([0, 1], '', FakeRunner(), 'env', 30, 720.0)
+    assert second == first
+    # No temporary directories are left behind
+    assert os.listdir(library.directory) == [os.path.basename(first.path)]
+
+
+def test_nearest_state_within_max_distance(tmp_path):
+    library = SpinupLibrary(str(tmp_path / 'library'),
+                            seed_from_nearest=True, max_distance=2)
+    library.store([0, 0, 0, 0], '', FakeRunner(), 'env', 20, 480.0)
+    near = library.store([1, 1, 1, 0], '', FakeRunner(), 'env', 10, 240.0)
+    # A different forcing and a landuse of another size are ignored
+    library.store([1, 1, 1, 1], 'dry', FakeRunner(), 'env', 20, 480.0)
+    library.store([1, 1, 1, 1, 1], '', FakeRunner(), 'env', 20, 480.0)
+
+    state = library.lookup([1, 1, 1, 1])
+    assert (state.path, state.distance) == (near.path, 1)
+    assert library.lookup([2, 1, 1, 1]).distance == 2
+    assert library.lookup([2, 2, 2, 1]) is None
+
+
+def test_nearest_state_not_used_by_default(library):
+    library.store([0, 0, 0, 0], '', FakeRunner(), 'env', 20, 480.0)
+    assert library.lookup([1, 0, 0, 0]) is None
+
+
+def test_set_start(tmp_path):
+    base = tmp_path / 'base'
+    base.mkdir()
+    (base / 'profile.tcl').write_text(SCRIPT)
+    runner = ParflowRunner('profile', [], str(base), str(tmp_path / 'work'))
+    runner.create_environment('env')
+    runner.set_start('env', 20, 480.0, timestep=0.5)
+    runner.set_keys('env', {'TimingInfo.StopTime': 1000.0})
+    filename = runner.script_filename(runner.model_directory('env'))
+    with open(filename) as fh:
+        keys = dict(line.split()[1:3] for line in fh
+                    if line.startswith('pfset'))
+    assert keys['TimingInfo.StartCount'] == '20'
+    assert keys['TimingInfo.StartTime'] == '480.0'
+    assert keys['TimingInfo.StopTime'] == '1000.0'
+    # CLM counts its time steps from one
+    assert keys['Solver.CLM.IstepStart'] == '961'
+
+
+def runner_parameter(library, runner, **kwargs):
+    param = ParflowRunnerParameter(Model(), runner, spinup_library=library,
+                                   spinup_hours=480.0, **kwargs)
+    param.env_names = ['env']
+    param.first_dumps = [0]
+    return param
+
+
+def test_restart_from_spinup(library):
+    runner = FakeRunner()
+    param = runner_parameter(library, runner)
+    param._restart_from_spinup(0, None)
+    assert ('spinup', 480.0) in runner.calls
+    assert ('set_start', 'env', 20, 480.0, 0.5) in runner.calls
+    assert runner.keys['TimingInfo.StopTime'] == 1000.0
+    assert param.first_dump(0) == 20
+
+    # The next evaluation restarts from the stored state
+    runner = FakeRunner()
+    param = runner_parameter(library, runner)
+    param._restart_from_spinup(0, None)
+    assert not [call for call in runner.calls if call[0] == 'spinup']
+    assert runner.keys['TimingInfo.StopTime'] == 1000.0
+
+
+def test_restart_after_short_spinup(library):
+    # An adaptive spin-up which stopped after one forcing period simulates
+    # the same length of run after the spin-up
+    runner = FakeRunner(spinup_result=(240.0, 10))
+    param = runner_parameter(library, runner, spinup_chunk=48.0,
+                             spinup_tolerance=0.01, spinup_period=240.0)
+    param._restart_from_spinup(0, None)
+    assert ('set_start', 'env', 10, 240.0, 0.5) in runner.calls
+    assert runner.keys['TimingInfo.StopTime'] == 760.0
+    assert param.first_dump(0) == 10
+
+
+def test_restart_out_of_phase_is_rejected(library):
+    runner = FakeRunner(spinup_result=(96.0, 4))
+    param = runner_parameter(library, runner, spinup_period=240.0)
+    with pytest.raises(ValueError):
+        param._restart_from_spinup(0, None)
@@ -0,0 +1,52 @@
+""" Tests of staging the Parflow model into node-local scratch """
+import os
+from parflow_pywr_moea.parflow.manager import ParflowRunner, content_key
+
+
+def runner(tmp_path):
+    return ParflowRunner('profile', [], str(tmp_path / 'base'),
+                         str(tmp_path / 'work'),
+                         staging_directory=str(tmp_path / 'scratch'))
+
+
+def touch(path, content, mtime):
+    path.write_text(content)
+    os.utime(str(path), ns=(mtime, mtime))
+
+
+def test_changed_base_model_is_staged_again(tmp_path):
+    base = tmp_path / 'base'
+    base.mkdir()
+    touch(base / 'slopes.pfb', 'slopes', 10**9)
+    first = runner(tmp_path)
+    assert runner(tmp_path).staging_root == first.staging_root
+    assert first.work_directory == os.path.join(first.staging_root, 'work')
+
+    # Files changed or added in place
+    touch(base / 'slopes.pfb', 'new slopes', 10**9)
+    changed = runner(tmp_path).staging_root
+    assert changed != first.staging_root
+    touch(base / 'slopes.pfb', 'new slopes', 2 * 10**9)
+    assert runner(tmp_path).staging_root != changed
+    (base / 'indicator.pfb').write_text('indicator')
+    assert runner(tmp_path).staging_root not in (first.staging_root, changed)
+
+
+def test_changed_forcing_file_is_staged_again(tmp_path):
+    (tmp_path / 'base').mkdir()
+    forcing = tmp_path / 'forcing.txt'
+    touch(forcing, '1.0', 10**9)
+    staged = runner(tmp_path).stage_file(str(forcing))
+    assert open(staged).read() == '1.0'
+    assert runner(tmp_path).stage_file(str(forcing)) == staged
+
+    touch(forcing, '2.0', 2 * 10**9)
+    restaged = runner(tmp_path).stage_file(str(forcing))
+    assert restaged != staged
+    assert open(restaged).read() == '2.0'
+
+
+def test_content_key_of_missing_path(tmp_path):
+    # The key of a model which is not there yet depends on its path only
+    assert content_key(str(tmp_path / 'a')) == content_key(str(tmp_path / 'a'))
+    assert content_key(str(tmp_path / 'a')) != content_key(str(tmp_path / 'b'))
@@ -0,0 +1,45 @@
+""" Tests of the startup time of the command line interface """
+import sys
+import subprocess
+import pytest
+from parflow_pywr_moea.cli import COMMAND_IMPORTS
+from parflow_pywr_moea.startup import DEFAULT_BUDGETS, DEFAULT_BUDGET, \
+    import_time
+
+# Optional modules which the search imports only when they are used
+OPTIONAL_MODULES = ('requests', 'mongoengine', 'pyreto_db',
+                    'parflow_pywr_moea.autotune',
+                    'parflow_pywr_moea.workqueue',
+                    'parflow_pywr_moea.hierarchical',
+                    'parflow_pywr_moea.checkpoint',
+                    'parflow_pywr_moea.snapshots',
+                    'parflow_pywr_moea.islands',
+                    'parflow_pywr_moea.surrogate')
+
+
+@pytest.mark.parametrize('command', ['--help'] + sorted(COMMAND_IMPORTS))
+def test_startup_within_budget(command):
+    modules = ('parflow_pywr_moea.cli', ) + \
+        tuple(COMMAND_IMPORTS.get(command, ()))
+    try:
+        seconds = import_time(modules)
+    except ImportError as error:
+        pytest.skip('Missing dependency: {}'.format(error))
+    budget = DEFAULT_BUDGETS.get(command, DEFAULT_BUDGET)
+    assert seconds <= budget, '{} starts in {:.2f}s (budget {:.2f}s)'.format(
+        command, seconds, budget)
+
+
+def test_search_imports_no_optional_modules():
+    script = ('import sys, importlib\n'
+              'for module in sys.argv[1:]:\n'
+              '    importlib.import_module(module)\n'
+              'print(" ".join(m for m in {!r} if m in sys.modules))'.format(
+                  OPTIONAL_MODULES))
+    process = subprocess.run(
+        [sys.executable, '-c', script, 'parflow_pywr_moea.cli'] +
+        list(COMMAND_IMPORTS['search']), capture_output=True, text=True)
+    if process.returncode != 0:
+        pytest.skip('Missing dependency: {}'.format(
+            process.stderr.strip().splitlines()[-1]))
+    assert process.stdout.split() == []
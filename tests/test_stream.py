@@ -0,0 +1,86 @@
+""" Tests of waiting for the outputs of a running Parflow process """
+import sys
+import subprocess
+import pytest
+from parflow_pywr_moea.parflow.stream import output_filename, \
+    wait_for_output
+
+# Writes two pressure files and exits with the given code, like a Parflow
+# run which fails part-way when the code is not zero
+SCRIPT = """
+import sys, time
+for number in range(2):
+    with open('profile.out.press.{:05d}.pfb'.format(number), 'w') as fh:
+        fh.write('data')
+    time.sleep(0.1)
+sys.exit(int(sys.argv[1]))
+"""
+
+
+class Process:
+    """ Replaces a subprocess.Popen which is still running """
+
+    def __init__(self, returncode=None):
+        self.returncode = returncode
+
+    def poll(self):
+        return self.returncode
+
+
+def start(directory, returncode):
+    return subprocess.Popen([sys.executable, '-c', SCRIPT, str(returncode)],
+                            cwd=str(directory))
+
+
+def test_output_filename():
+    assert output_filename('profile', 'press', 365) == \
+        'profile.out.press.00365.pfb'
+
+
+def test_file_is_complete_once_next_file_exists(tmp_path):
+    (tmp_path / 'a.pfb').write_text('data')
+    with pytest.raises(TimeoutError):
+        wait_for_output(str(tmp_path), 'a.pfb', Process(), 'b.pfb',
+                        poll_interval=0.01, timeout=0.05)
+    (tmp_path / 'b.pfb').write_text('data')
+    assert wait_for_output(str(tmp_path), 'a.pfb', Process(), 'b.pfb') == \
+        str(tmp_path / 'a.pfb')
+
+
+def test_last_file_is_complete_when_parflow_finishes(tmp_path):
+    (tmp_path / 'a.pfb').write_text('data')
+    with pytest.raises(TimeoutError):
+        wait_for_output(str(tmp_path), 'a.pfb', Process(),
+                        poll_interval=0.01, timeout=0.05)
+    assert wait_for_output(str(tmp_path), 'a.pfb', Process(0)) == \
+        str(tmp_path / 'a.pfb')
+
+
+def test_missing_file_after_parflow_finished(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        wait_for_output(str(tmp_path), 'a.pfb', Process(0))
+
+
+def test_outputs_of_running_process(tmp_path):
+    process = start(tmp_path, 0)
+    first, second = [output_filename('profile', 'press', number)
+                     for number in range(2)]
+    assert wait_for_output(str(tmp_path), first, process, second,
+                           poll_interval=0.01, timeout=30) == \
+        str(tmp_path / first)
+    assert wait_for_output(str(tmp_path), second, process,
+                           poll_interval=0.01, timeout=30) == \
+        str(tmp_path / second)
+    assert process.wait() == 0
+
+
+def test_parflow_failing_part_way(tmp_path):
+    process = start(tmp_path, 1)
+    first, second, third = [output_filename('profile', 'press', number)
+                            for number in range(3)]
+    # The outputs written before the failure are complete
+    wait_for_output(str(tmp_path), first, process, second,
+                    poll_interval=0.01, timeout=30)
+    with pytest.raises(RuntimeError, match='code 1'):
+        wait_for_output(str(tmp_path), third, process, poll_interval=0.01,
+                        timeout=30)
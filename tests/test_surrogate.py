@@ -0,0 +1,124 @@
+""" Tests of the surrogate ranking and filtering of offspring """
+import numpy as np
+import platypus
+import pytest
+from parflow_pywr_moea.surrogate import Surrogate, RidgeRegressor, \
+    NearestNeighboursRegressor
+from parflow_pywr_moea.variators import SurrogateVariator, \
+    domination_counts
+
+PROBLEM = platypus.Problem(2, 2)
+PROBLEM.types[:] = platypus.Real(0, 10)
+
+
+def solution(variables, objectives=None, feasible=True):
+    result = platypus.Solution(PROBLEM)
+    result.variables[:] = variables
+    if objectives is not None:
+        result.objectives[:] = objectives
+        result.evaluated = True
+        result.feasible = feasible
+    return result
+
+
+class ListVariator(platypus.Variator):
+    """ Returns offspring with the next decision vectors of a list """
+
+    def __init__(self, vectors, count=2):
+        super().__init__(2)
+        self.vectors = iter(vectors)
+        self.count = count
+
+    def evolve(self, parents):
+        return [solution(next(self.vectors)) for _ in range(self.count)]
+
+
+def objectives(variables):
+    return [variables[0], 10 - variables[0] + variables[1]]
+
+
+def trained_surrogate(min_samples=5):
+    """ Surrogate of the linear objectives (x0, 10 - x0 + x1), trained on a
+        front of (1, 9) and (5, 5) """
+    surrogate = Surrogate([0, 0], [10, 10], [False, False],
+                          regressor=RidgeRegressor(alpha=1e-9),
+                          min_samples=min_samples)
+    surrogate.add([solution(x, objectives(x))
+                   for x in ([1, 0], [3, 5], [5, 0], [7, 5], [2, 2])])
+    return surrogate
+
+
+def test_regressors_fit_training_data():
+    X = np.array([[0.0, 1.0], [1.0, 0.0], [2.0, 2.0], [3.0, 1.0]])
+    y = np.column_stack([2 * X[:, 0] - X[:, 1] + 1, X[:, 1]])
+    ridge = RidgeRegressor(alpha=1e-9).fit(X, y)
+    np.testing.assert_allclose(ridge.predict([[4.0, 3.0]]), [[6.0, 3.0]],
+                               atol=1e-6)
+    knn = NearestNeighboursRegressor(n_neighbors=2).fit(X, y)
+    np.testing.assert_allclose(knn.predict(X[:1]), y[:1], atol=1e-9)
+
+
+def test_encoding_of_landuse_classes():
+    surrogate = Surrogate([0, 0], [10, 2], [False, True])
+    np.testing.assert_allclose(surrogate.encode([[5, 0], [10, 2]]),
+                               [[0.5, 1, 0, 0], [1.0, 0, 0, 1]])
+
+
+def test_only_evaluated_feasible_solutions_are_used():
+    surrogate = trained_surrogate(min_samples=6)
+    surrogate.add([solution([9, 0], [9, 1], feasible=False),
+                   solution([9, 0])])
+    assert not surrogate.ready()
+    surrogate.add([solution([0, 0], [0, 10])])
+    assert surrogate.ready()
+    front = sorted(map(tuple, surrogate.front()))
+    assert front == [(0, 10), (1, 9), (5, 5)]
+
+
+def test_domination_counts():
+    counts = domination_counts([[1, 1], [2, 2], [0, 3]], [[0.5, 0.5]])
+    assert list(counts) == [1, 2, 0]
+
+
+def test_offspring_kept_until_surrogate_is_ready():
+    variator = SurrogateVariator(ListVariator([[9, 0], [8, 0]]),
+                                 trained_surrogate(min_samples=10), 0.5)
+    offspring = variator.evolve([])
+    assert [c.variables[0] for c in offspring] == [9, 8]
+    assert not hasattr(offspring[0], 'predicted_objectives')
+
+
+def test_best_predicted_offspring_are_kept():
+    # (2, 8) and (6, 4) are not dominated; (2, 13) and (4, 10) are
+    vectors = [[2, 5], [2, 0], [4, 4], [6, 0]]
+    variator = SurrogateVariator(ListVariator(vectors), trained_surrogate(),
+                                 0.5)
+    offspring = variator.evolve([])
+    assert len(offspring) == 2
+    assert variator.generated == 4
+    assert variator.kept == 2
+    for child in offspring:
+        assert child.variables[:] in ([2, 0], [6, 0])
+        np.testing.assert_allclose(child.predicted_objectives,
+                                   objectives(child.variables), atol=1e-6)
+
+
+def test_filter_removes_candidates_before_ranking():
+    vectors = [[2, 0], [6, 0], [4, 0], [8, 0]]
+    variator = SurrogateVariator(ListVariator(vectors), trained_surrogate(),
+                                 0.5)
+    variator.filter = lambda candidates: [
+        c for c in candidates if c.variables[0] > 5]
+    offspring = variator.evolve([])
+    assert sorted(c.variables[0] for c in offspring) == [6, 8]
+
+
+def test_fraction_must_be_positive():
+    with pytest.raises(ValueError):
+        SurrogateVariator(ListVariator([]), trained_surrogate(), 0.0)
+
+
+def test_accuracy():
+    evaluated = [[1, 4], [2, 3], [3, 2], [4, 1]]
+    predicted = [[1.5, 1], [2.5, 2], [2.6, 3], [9, 4]]
+    assert Surrogate.accuracy(predicted, evaluated) == [1.0, -1.0]
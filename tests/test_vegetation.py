@@ -0,0 +1,78 @@
+""" Tests of reading and writing the vegetation DAT file of Parflow/CLM """
+import numpy as np
+import pytest
+from parflow_pywr_moea.parflow.vegetation import \
+    VegetationTileFractionalCoverage
+
+NUM_CLASSES = VegetationTileFractionalCoverage.NUM_CLASSES
+
+
+def write_dat(filename, classes):
+    """ Write a DAT file in which tile i is covered by classes[i] """
+    with open(filename, 'w') as fh:
+        fh.write('x y lat lon sand clay color fractional coverage of grid '
+                 'by vegetation class (Must/Should Add to 1.0)\n')
+        fh.write('  (Deg) (Deg) (%/100) index 1 2 3 4 5 6 7 8 9 10 11 12 13 '
+                 '14 15 16 17 18\n')
+        for i, cls in enumerate(classes):
+            values = ['1.0' if j == cls else '0.0'
+                      for j in range(NUM_CLASSES)]
+            fh.write('{} 1 34.750 -98.138 0.16 0.265 2 {}\n'.format(
+                i + 1, ' '.join(values)))
+
+
+@pytest.fixture
+def dat_file(tmp_path):
+    filename = str(tmp_path / 'drv_vegm.dat')
+    write_dat(filename, [0, 4, 17])
+    return filename
+
+
+def test_read_from(dat_file):
+    coverage = VegetationTileFractionalCoverage.read_from(dat_file)
+    assert coverage.fractional_coverage.shape == (3, NUM_CLASSES)
+    assert list(coverage.fractional_coverage.argmax(axis=1)) == [0, 4, 17]
+
+
+def test_round_trip_keeps_leading_columns(dat_file):
+    with open(dat_file) as fh:
+        original = fh.read().splitlines()
+    fractional_coverage = np.zeros((3, NUM_CLASSES))
+    fractional_coverage[:, 9] = 0.25
+    fractional_coverage[:, 2] = 0.75
+    VegetationTileFractionalCoverage(fractional_coverage).rewrite_to(
+        dat_file)
+
+    np.testing.assert_array_equal(
+        VegetationTileFractionalCoverage.read_from(
+            dat_file).fractional_coverage, fractional_coverage)
+    with open(dat_file) as fh:
+        lines = fh.read().splitlines()
+    assert lines[:2] == original[:2]
+    for line, original_line in zip(lines[2:], original[2:]):
+        assert line.split()[:-NUM_CLASSES] == \
+            original_line.split()[:-NUM_CLASSES]
+
+
+def test_rewrite_with_template_of_another_file(tmp_path, dat_file):
+    template = VegetationTileFractionalCoverage.read_template(dat_file)
+    filename = str(tmp_path / 'copy.dat')
+    coverage = VegetationTileFractionalCoverage.read_from(dat_file)
+    coverage.rewrite_to(filename, template)
+    np.testing.assert_array_equal(
+        VegetationTileFractionalCoverage.read_from(
+            filename).fractional_coverage, coverage.fractional_coverage)
+
+
+def test_rewrite_rejects_wrong_number_of_tiles(dat_file):
+    coverage = np.zeros((2, NUM_CLASSES))
+    coverage[:, 0] = 1.0
+    with pytest.raises(ValueError):
+        VegetationTileFractionalCoverage(coverage).rewrite_to(dat_file)
+
+
+def test_rewrite_rejects_coverage_not_adding_to_one(dat_file):
+    coverage = np.zeros((3, NUM_CLASSES))
+    coverage[:, 0] = 0.5
+    with pytest.raises(ValueError):
+        VegetationTileFractionalCoverage(coverage).rewrite_to(dat_file)
@@ -0,0 +1,152 @@
+""" Tests of the SQLite work queue """
+import sys
+import pytest
+import platypus
+from platypus.core import EvaluateSolution
+from parflow_pywr_moea import workqueue
+from parflow_pywr_moea.workqueue import WorkQueue, QueueDispatcher
+
+
+class Clock:
+    """ Replaces the time module of workqueue with a settable clock """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(workqueue, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return WorkQueue(str(tmp_path / 'queue.db'), lease_timeout=10.0,
+                     max_attempts=2)
+
+
+def test_tasks_are_leased_in_order(queue):
+    first = queue.put('a')
+    second = queue.put('b')
+    assert queue.lease('w1') == (first, 'a')
+    assert queue.lease('w2') == (second, 'b')
+    assert queue.lease('w3') is None
+
+
+def test_completed_tasks_are_collected_once(queue):
+    task_id = queue.put('a')
+    queue.lease('w1')
+    assert queue.collect([task_id]) == {}
+    queue.complete(task_id, 'w1', 'a!')
+    assert queue.collect([task_id]) == {task_id: 'a!'}
+    assert queue.collect([task_id]) == {}
+
+
+def test_expired_lease_is_requeued(queue, clock):
+    task_id = queue.put('a')
+    queue.lease('w1')
+    clock.now += 5.0
+    assert queue.lease('w2') is None
+    clock.now += 6.0
+    assert queue.lease('w2') == (task_id, 'a')
+
+
+def test_renewed_lease_is_kept(queue, clock):
+    queue.put('a')
+    queue.lease('w1')
+    clock.now += 8.0
+    queue.renew('w1')
+    clock.now += 8.0
+    assert queue.lease('w2') is None
+
+
+def test_task_fails_after_max_attempts(queue, clock):
+    task_id = queue.put('a')
+    queue.lease('w1')
+    clock.now += 11.0
+    queue.lease('w2')
+    clock.now += 11.0
+    assert queue.lease('w3') is None
+    error = queue.collect([task_id])[task_id]
+    assert isinstance(error, RuntimeError)
+    assert 'expired 2 times' in str(error)
+
+
+def test_first_result_of_requeued_task_is_kept(queue, clock):
+    task_id = queue.put('a')
+    queue.lease('w1')
+    clock.now += 11.0
+    queue.lease('w2')
+    queue.complete(task_id, 'w2', 'from w2')
+    queue.complete(task_id, 'w1', 'from w1')
+    assert queue.collect([task_id]) == {task_id: 'from w2'}
+
+
+def test_cancelled_task_is_not_leased_or_stored(queue):
+    leased = queue.put('a')
+    queued = queue.put('b')
+    queue.lease('w1')
+    queue.cancel([leased, queued])
+    assert queue.lease('w2') is None
+    queue.complete(leased, 'w1', 'a!')
+    assert queue.collect([leased, queued]) == {}
+
+
+def test_active_workers(queue, clock):
+    queue.renew('w1')
+    clock.now += 5.0
+    queue.renew('w2')
+    assert queue.active_workers() == 2
+    clock.now += 6.0
+    assert queue.active_workers() == 1
+    queue.remove_worker('w2')
+    assert queue.active_workers() == 0
+
+
+def test_dispatcher_receives_results(queue):
+    dispatcher = QueueDispatcher(queue, poll_interval=1.0)
+    queue.renew('w1')
+    tag = dispatcher.submit('a')
+    assert dispatcher.idle() == 0
+    assert dispatcher.receive(timeout=2.0) is None
+    task_id, job = queue.lease('w1')
+    queue.complete(task_id, 'w1', job + '!')
+    assert dispatcher.receive(timeout=2.0) == (tag, 'a!')
+    assert dispatcher.pending == 0
+    dispatcher.close()
+    assert queue.is_closed()
+
+
+def test_failed_task_returns_infeasible_solution(queue):
+    problem = platypus.Problem(1, 2)
+    problem.types[:] = platypus.Real(0, 1)
+    solution = platypus.Solution(problem)
+    dispatcher = QueueDispatcher(queue, poll_interval=1.0)
+    tag = dispatcher.submit(EvaluateSolution(solution))
+    task_id, _ = queue.lease('w1')
+    queue.fail(task_id, 'w1', 'ValueError()')
+    received, job = dispatcher.receive(timeout=2.0)
+    assert received == tag
+    assert job.failed
+    assert job.solution.failed
+    assert not job.solution.feasible
+    assert job.solution.objectives[:] == [sys.float_info.max] * 2
+    assert dispatcher.pending == 0
+
+
+def test_dispatcher_removes_tasks_of_previous_run(queue):
+    queue.put('a')
+    queue.put('b')
+    queue.lease('w1')
+    dispatcher = QueueDispatcher(queue, poll_interval=1.0)
+    assert queue.lease('w2') is None
+    tag = dispatcher.submit('c')
+    assert queue.lease('w2') == (tag, 'c')